@@ -1,85 +1,638 @@
 
 import os
-from typing import Dict, List, Any
+import atexit
+import gc
+import hashlib
+import itertools
+import json
+import threading
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Any, Optional, Tuple
+
+import numpy as np
 
 from .vector_index import VectorIndex
 from .embedder import Embedder
+from .embedding_cache import EmbeddingCache
+from .index_cache import IndexCache
+from .lru_cache import LRUCache
 from .connector_interface import FileConnector
-from .summarizer import Summarizer
-from .utils import TextProcessor
+from .summarizer import SummaryCache, Summarizer
+from .utils import TEXT_BLOCK_SIZE, Chunk, TextProcessor
+
+STREAM_BATCH_CHUNKS = 256 # Chunks embedded and added per step when streaming a large file
+
+def _content_hash(raw_content: Any) -> str:
+    """Hashes raw file content as returned by a connector (str for text files, bytes otherwise)."""
+    if isinstance(raw_content, str):
+        raw_content = raw_content.encode("utf-8")
+    return hashlib.sha256(raw_content).hexdigest()
+
+def _file_hash(local_path: str, file_type: str) -> str:
+    """Hashes a local file block by block; equals _content_hash of what LocalFileConnector.read_file returns."""
+    digest = hashlib.sha256()
+    if file_type == "txt":
+        with open(local_path, "r", encoding="utf-8") as f:
+            for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ""):
+                digest.update(block.encode("utf-8"))
+    else:
+        with open(local_path, "rb") as f:
+            for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def _filters_key(filters: Optional[Dict[str, Any]]) -> Optional[str]:
+    """A hashable form of search filters for the search cache."""
+    return json.dumps(filters, sort_keys=True, default=list) if filters else None
+
+def _register_close_at_exit(agent: "FetchItAgent") -> Callable[[], None]:
+    """Registers agent.close() to run at interpreter shutdown through a weak reference, so an agent
+       dropped without close() can still be collected; its registration goes with it.
+    """
+    def close():
+        alive = agent_ref()
+        if alive is not None:
+            alive.close()
+    agent_ref = weakref.ref(agent, lambda _: atexit.unregister(close))
+    atexit.register(close)
+    return close
+
+def _read_local_text(local_path: str, file_type: str) -> Tuple[str, str]:
+    """Returns (content hash, extracted text) of a local file."""
+    content_hash, pieces = _stream_local_text(local_path, file_type)
+    return content_hash, "".join(pieces)
+
+def _stream_local_text(local_path: str, file_type: str) -> Tuple[str, Iterator[str]]:
+    """Returns (content hash, extracted text streamed a page or block at a time) of a local file."""
+    return _file_hash(local_path, file_type), TextProcessor().iter_text_from_file(local_path, file_type)
+
+def _stream_text(connector: FileConnector, file_path: str, file_type: str) -> Tuple[str, Iterable[str]]:
+    """Returns (content hash, extracted text in pieces) of a file; local files are streamed, not read whole."""
+    local_path = connector.get_local_path(file_path)
+    if local_path is not None:
+        return _stream_local_text(local_path, file_type)
+    raw_content = connector.read_file(file_path, file_type)
+    return _content_hash(raw_content), TextProcessor().iter_text_from_raw(raw_content, file_type)
+
+def _read_and_extract(connector: FileConnector, file_path: str, file_type: str) -> Tuple[str, str]:
+    """Reads a file and returns (content hash, extracted text).
+       Runs in a worker process, so it must stay module-level.
+    """
+    local_path = connector.get_local_path(file_path)
+    if local_path is not None:
+        return _read_local_text(local_path, file_type)
+    raw_content = connector.read_file(file_path, file_type)
+    return _content_hash(raw_content), TextProcessor().extract_text_from_raw(raw_content, file_type)
 
 class FetchItAgent:
-    def __init__(self, data_dir: str = "./data"):
+    def __init__(self, data_dir: str = "./data", autosave_every: Optional[int] = 1, autosave_interval: Optional[float] = None,
+                 embedding_cache_size: Optional[int] = 100000, embedding_cache_path: Optional[str] = None,
+                 query_cache_size: int = 1024, search_cache_size: int = 1024, index_options: Optional[Dict[str, Any]] = None,
+                 answer_min_score: Optional[float] = None, max_loaded_indexes: Optional[int] = None,
+                 index_ttl: Optional[float] = None, index_memory_budget: Optional[int] = None,
+                 query_batch_wait: Optional[float] = None, query_batch_size: int = 32,
+                 summary_sentence_counts: Optional[Tuple[int, ...]] = (1, 3, 5), answer_method: str = "lsa",
+                 embedding_backend: Any = "torch", embedding_threads: Optional[int] = None):
+        """embedding_cache_size bounds the on-disk embedding cache shared by all users (None disables it).
+           Point embedding_cache_path at a common location to share the cache between agents.
+           query_cache_size and search_cache_size bound the in-memory caches of query embeddings
+           and of search results (0 disables them).
+           index_options are passed to every VectorIndex (index_type, ann_threshold, nprobe, ef_search, ...);
+           new indexes use inner-product search over normalized embeddings unless a metric is given,
+           and searches fuse BM25 and vector rankings unless hybrid=False is given.
+           answer_min_score is the default similarity a chunk needs to be used by answer_question.
+           max_loaded_indexes, index_ttl (seconds idle) and index_memory_budget (bytes) bound the
+           per-user indexes kept in memory; evicted indexes are flushed and reloaded on demand.
+           With query_batch_wait (seconds, e.g. 0.003), queries searched concurrently from several
+           threads are embedded together in batches of up to query_batch_size.
+           Summaries of each indexed file at summary_sentence_counts sentences are computed in the
+           background and stored next to the user's index, so summarize_file can answer without
+           reading the file (None turns this off). answer_method "embedding" builds answers from the
+           stored vectors of the retrieved chunks instead of running LSA over them.
+           embedding_backend picks how the embedding model runs ("torch", "torch-int8", "onnx", "onnx-int8"
+           or an EmbeddingBackend) and embedding_threads bounds its CPU threads; see Embedder.
+           Models and parsing libraries are loaded on first use; call warmup to load them up front.
+        """
+        if answer_method not in ("lsa", "embedding"):
+            raise ValueError(f"Unknown answer_method: {answer_method}")
         self.data_dir = data_dir
+        self.autosave_every = autosave_every
+        self.autosave_interval = autosave_interval
         os.makedirs(self.data_dir, exist_ok=True)
-        self.embedder = Embedder()
-        self.vector_indices: Dict[str, VectorIndex] = {}
+        self.embedding_cache = None
+        if embedding_cache_size is not None:
+            self.embedding_cache = EmbeddingCache(embedding_cache_path or os.path.join(self.data_dir, "embedding_cache.sqlite"), embedding_cache_size)
+        self.embedder = Embedder(cache=self.embedding_cache, query_cache_size=query_cache_size, normalize=True,
+                                 backend=embedding_backend, threads=embedding_threads)
+        if query_batch_wait is not None:
+            self.embedder.enable_query_batching(query_batch_size, query_batch_wait)
+        # Keyed on the index version, so any change to a user's index invalidates their cached results
+        self.search_cache = LRUCache(search_cache_size)
+        self.vector_indices = IndexCache(self._load_vector_index, max_loaded_indexes, index_ttl, index_memory_budget)
+        self.index_options = {"metric": "ip", "hybrid": True, **(index_options or {})}
+        self.answer_min_score = answer_min_score
+        self.user_index_options: Dict[str, Dict[str, Any]] = {} # Per-user overrides of index_options
         self.summarizer = Summarizer()
-        self.text_processor = TextProcessor()
+        self.summary_sentence_counts = summary_sentence_counts
+        self.answer_method = answer_method
+        self._summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetchit-summaries")
+        self._summary_jobs: List[Future] = []
+        self._summary_lock = threading.Lock()
+        self._text_processor: Optional[TextProcessor] = None
         self.chat_histories: Dict[str, List[Dict[str, str]]] = {}
+        self._chat_lock = threading.Lock()
+        self._close_at_exit = _register_close_at_exit(self)
+
+    @property
+    def text_processor(self) -> TextProcessor:
+        if self._text_processor is None:
+            # Chunks are sized to what the embedding model reads without truncation, so this loads the model
+            self._text_processor = TextProcessor(max_tokens=self.embedder.max_tokens, count_tokens=self.embedder.count_tokens)
+        return self._text_processor
+
+    def warmup(self, freeze: bool = False):
+        """Loads the embedding model (with one dummy encode) and the summarizer's language data, so
+           the first request does not wait for them. Call it before forking worker processes (e.g. in
+           a preloading server) to have them share the loaded model copy-on-write; with freeze,
+           gc.freeze() then keeps the workers' garbage collections from touching, and so copying,
+           the pages of everything loaded so far.
+        """
+        self.embedder.warmup()
+        self.summarizer.warmup()
+        if freeze:
+            gc.freeze()
 
     def _get_vector_index(self, user_id: str) -> VectorIndex:
-        if user_id not in self.vector_indices:
-            user_index_path = os.path.join(self.data_dir, f"user_{user_id}_index.faiss")
-            self.vector_indices[user_id] = VectorIndex(self.embedder, user_index_path)
-        return self.vector_indices[user_id]
+        return self.vector_indices.get(user_id)
+
+    def _load_vector_index(self, user_id: str) -> VectorIndex:
+        user_index_path = os.path.join(self.data_dir, f"user_{user_id}_index.faiss")
+        options = {**self.index_options, **self.user_index_options.get(user_id, {})}
+        return VectorIndex(self.embedder, user_index_path, self.autosave_every, self.autosave_interval, **options)
+
+    def _summary_cache(self, user_id: str) -> SummaryCache:
+        return SummaryCache(os.path.join(self.data_dir, f"user_{user_id}_summaries"))
+
+    def _schedule_summaries(self, user_id: str, file_path: str, content_hash: str, read: Callable[[], Tuple[str, Iterable[str]]]):
+        """Queues the precomputation of a just indexed file's summaries; read() returns (content hash, text pieces).
+           The pieces are summarized as they stream in, so a large file is not held in memory whole.
+        """
+        if not self.summary_sentence_counts:
+            return
+        with self._summary_lock:
+            self._summary_jobs = [job for job in self._summary_jobs if not job.done()]
+            self._summary_jobs.append(self._summary_executor.submit(self._precompute_summaries, user_id, file_path, content_hash, read))
+
+    def _precompute_summaries(self, user_id: str, file_path: str, content_hash: str, read: Callable[[], Tuple[str, Iterable[str]]]):
+        try:
+            current_hash, pieces = read()
+            if current_hash != content_hash:
+                return # Changed again since it was indexed; its next indexing schedules new summaries
+            summaries = self.summarizer.summarize_stream(pieces, self.summary_sentence_counts)
+            self._summary_cache(user_id).put(file_path, content_hash, summaries)
+        except Exception as e:
+            print(f"Error summarizing file {file_path}: {e}")
+
+    def summarization_stats(self) -> Dict[str, Any]:
+        """Returns per-call latency histograms (milliseconds) of the summarizer, by method."""
+        return self.summarizer.stats()
+
+    def query_batching_stats(self) -> Optional[Dict[str, Any]]:
+        """Returns queue-depth and batch-size histograms of query embedding, if query batching is on."""
+        batcher = self.embedder.query_batcher
+        return batcher.stats() if batcher is not None else None
+
+    def index_cache_stats(self) -> Dict[str, Any]:
+        """Returns hit/miss/eviction counts and estimated memory of the loaded per-user indexes."""
+        return self.vector_indices.stats()
+
+    def configure_index(self, user_id: str, **options):
+        """Overrides index options for one user, e.g. an HNSW index with a higher ef_search for a large tenant.
+           A loaded index is rebuilt from its stored vectors if its type changes.
+           Raises ValueError for an unsupported option or value, which is then not kept.
+        """
+        with self.vector_indices.using(user_id) as vector_index:
+            vector_index.configure(**options)
+            self.user_index_options.setdefault(user_id, {}).update(options)
+
+    @contextmanager
+    def batch(self, user_id: str):
+        """Groups several index_file/remove_file calls for a user into one save of their index."""
+        with self.vector_indices.using(user_id) as vector_index, vector_index.batch():
+            yield self
 
-    def index_file(self, user_id: str, file_path: str, file_type: str, connector: FileConnector):
-        """Indexes the content of a file for a specific user."""
+    def flush(self):
+        """Writes pending index changes of all loaded users to disk and waits for queued summaries."""
+        with self._summary_lock:
+            jobs, self._summary_jobs = self._summary_jobs, []
+        for job in jobs:
+            job.result()
+        for vector_index in self.vector_indices.values():
+            vector_index.flush()
+        if self.embedding_cache is not None:
+            self.embedding_cache.flush()
+
+    def close(self):
+        """Flushes and unloads all indexes. Runs at interpreter shutdown for agents still open then."""
+        atexit.unregister(self._close_at_exit)
+        self._summary_executor.shutdown(wait=True)
+        self.vector_indices.clear()
+        self.embedder.close()
+        self.summarizer.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+            self.embedding_cache = self.embedder.cache = None
+
+    def index_file(self, user_id: str, file_path: str, file_type: str, connector: FileConnector, force: bool = False) -> bool:
+        """Indexes the content of a file for a specific user.
+
+        Files whose size and modification time (or, failing that, content hash) match what
+        was recorded when they were last indexed are skipped unless force is set. A changed
+        file has its old chunks replaced. Files the connector can give a local path for are
+        streamed, so their size is not limited by memory. Returns True if the file was (re)indexed.
+        """
         print(f"Indexing file {file_path} for user {user_id}")
         try:
-            # The connector provides the raw file content (e.g., binary for PDF/DOCX)
-            raw_content = connector.read_file(file_path, file_type)
-            # The TextProcessor extracts text from the raw content based on file_type
-            text_content = self.text_processor.extract_text_from_raw(raw_content, file_type)
-            
-            chunks = self.text_processor.chunk_text(text_content)
-            metadata = {"file_path": file_path, "file_type": file_type}
-            self._get_vector_index(user_id).add_documents(chunks, metadata)
-            print(f"Successfully indexed {file_path}")
+            file_metadata = connector.get_file_metadata(file_path)
+            if not force and self.is_file_unchanged(user_id, file_path, file_metadata):
+                print(f"Skipping unchanged file {file_path}")
+                return False
+
+            local_path = connector.get_local_path(file_path)
+            if local_path is None:
+                # The connector provides the raw file content (e.g., binary for PDF/DOCX)
+                raw_content = connector.read_file(file_path, file_type)
         except Exception as e:
             print(f"Error indexing file {file_path}: {e}")
             raise
+        if local_path is not None:
+            return self._index_local_file(user_id, file_path, file_type, local_path, file_metadata, force)
+        return self.index_content(user_id, file_path, file_type, raw_content, file_metadata, force)
+
+    def _index_local_file(self, user_id: str, file_path: str, file_type: str, local_path: str,
+                          file_metadata: Dict[str, Any], force: bool) -> bool:
+        """Streams a local file into the index: text is extracted a page or block at a time and
+           chunks are embedded and added STREAM_BATCH_CHUNKS at a time as they are produced.
+        """
+        with self.vector_indices.using(user_id) as vector_index:
+            try:
+                record = self._file_record(file_type, _file_hash(local_path, file_type), file_metadata)
+                if not force and self._is_unchanged(vector_index, file_path, record=record):
+                    # Touched but not modified: remember the new mtime so the next check is cheap
+                    vector_index.set_file_record(file_path, record)
+                    print(f"Skipping unchanged file {file_path}")
+                    return False
+
+                chunks = self.text_processor.iter_chunks(self.text_processor.iter_text_from_file(local_path, file_type))
+                first = list(itertools.islice(chunks, STREAM_BATCH_CHUNKS))
+                if len(first) < STREAM_BATCH_CHUNKS:
+                    # Small enough to swap in at once, so searches never see the file half replaced
+                    self._replace_file_chunks(vector_index, file_path, file_type, first, record)
+                else:
+                    self._stream_file_chunks(vector_index, file_path, file_type, first, chunks, record)
+                print(f"Successfully indexed {file_path}")
+            except Exception as e:
+                print(f"Error indexing file {file_path}: {e}")
+                raise
+        self._schedule_summaries(user_id, file_path, record["content_hash"],
+                                 partial(_stream_local_text, local_path, file_type))
+        return True
+
+    def _stream_file_chunks(self, vector_index: VectorIndex, file_path: str, file_type: str, first: List[Chunk],
+                            chunks: Iterator[Chunk], record: Dict[str, Any]):
+        """Replaces a large file's chunks batch by batch; searches see the new chunks as they are added.
+           Each batch is saved once added, so the unsaved changes held in memory stay bounded too.
+           The file record is only set at the end: a file cut short by a crash is indexed again.
+        """
+        metadata = {"file_path": file_path, "file_type": file_type}
+        with vector_index.batch():
+            vector_index.remove_documents(file_path)
+            try:
+                batch = first
+                while batch:
+                    vector_index.add_documents([text for text, _, _ in batch], metadata,
+                                               offsets=[(start, end) for _, start, end in batch])
+                    vector_index.flush()
+                    batch = list(itertools.islice(chunks, STREAM_BATCH_CHUNKS))
+            except Exception:
+                vector_index.remove_documents(file_path) # Do not leave a partially indexed file behind
+                raise
+            vector_index.set_file_record(file_path, record)
+
+    def is_file_unchanged(self, user_id: str, file_path: str, file_metadata: Dict[str, Any]) -> bool:
+        """True if file_path was indexed at the size and modification time given in file_metadata."""
+        with self.vector_indices.using(user_id) as vector_index:
+            return self._is_unchanged(vector_index, file_path, file_metadata)
+
+    def index_content(self, user_id: str, file_path: str, file_type: str, raw_content: Any,
+                      file_metadata: Optional[Dict[str, Any]] = None, force: bool = False) -> bool:
+        """Indexes raw file content that the caller has already read, e.g. asynchronously or from an upload.
+           Content whose hash matches the last indexed version is skipped unless force is set.
+        """
+        with self.vector_indices.using(user_id) as vector_index:
+            try:
+                content_hash = _content_hash(raw_content)
+                record = self._file_record(file_type, content_hash, file_metadata or {})
+                if not force and self._is_unchanged(vector_index, file_path, record=record):
+                    # Touched but not modified: remember the new mtime so the next check is cheap
+                    vector_index.set_file_record(file_path, record)
+                    print(f"Skipping unchanged file {file_path}")
+                    return False
+
+                # The TextProcessor extracts text from the raw content based on file_type
+                text_content = self.text_processor.extract_text_from_raw(raw_content, file_type)
+
+                chunks = list(self.text_processor.iter_chunks([text_content]))
+                self._replace_file_chunks(vector_index, file_path, file_type, chunks, record)
+                print(f"Successfully indexed {file_path}")
+            except Exception as e:
+                print(f"Error indexing file {file_path}: {e}")
+                raise
+        self._schedule_summaries(user_id, file_path, content_hash, lambda: (content_hash, [text_content]))
+        return True
+
+    def _file_record(self, file_type: str, content_hash: str, file_metadata: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "file_type": file_type,
+            "content_hash": content_hash,
+            "file_size": file_metadata.get("file_size"),
+            "last_modified": file_metadata.get("last_modified"),
+        }
+
+    def _is_unchanged(self, vector_index: VectorIndex, file_path: str, file_metadata: Optional[Dict[str, Any]] = None,
+                      record: Optional[Dict[str, Any]] = None) -> bool:
+        """Compares a file against its manifest record by size/mtime (file_metadata) or content hash (record)."""
+        previous = vector_index.get_file_record(file_path)
+        if previous is None:
+            return False
+        if record is not None:
+            return previous["content_hash"] == record["content_hash"] and previous["file_type"] == record["file_type"]
+        return (file_metadata.get("last_modified") is not None
+                and previous["file_size"] == file_metadata.get("file_size")
+                and previous["last_modified"] == file_metadata.get("last_modified"))
+
+    def _replace_file_chunks(self, vector_index: VectorIndex, file_path: str, file_type: str, chunks: List[Chunk],
+                             record: Dict[str, Any], embeddings: Optional[np.ndarray] = None):
+        """Swaps a file's previous chunks (if any) for new ones and records its manifest entry, saving once.
+           Searches never see the file half replaced.
+        """
+        texts = [text for text, _, _ in chunks]
+        if embeddings is None and texts:
+            embeddings = self.embedder.embed(texts) # Outside the write lock, so searches keep running
+        with vector_index.batch(), vector_index.lock.write_locked():
+            vector_index.remove_documents(file_path)
+            vector_index.add_documents(texts, {"file_path": file_path, "file_type": file_type}, embeddings,
+                                       offsets=[(start, end) for _, start, end in chunks])
+            vector_index.set_file_record(file_path, record)
+
+    def index_files(self, user_id: str, files: List[Tuple[str, str]], connector: FileConnector,
+                    max_workers: Optional[int] = None, embed_batch_size: int = 64) -> List[Dict[str, Any]]:
+        """Indexes many (file_path, file_type) pairs for a user in one pass.
+
+        Reading and text extraction run in a process pool, and chunks from different files
+        are packed into full embed_batch_size batches for the embedder. The index is saved
+        once at the end. Unchanged files are skipped as in index_file. Returns one result per
+        input file, in input order, with a "status" of "indexed" (plus the number of "chunks"),
+        "skipped" or "error" (plus the "error" message); a failing file does not abort the others.
+        """
+        print(f"Indexing {len(files)} files for user {user_id}")
+        with self.vector_indices.using(user_id) as vector_index:
+            results = self._index_files(vector_index, files, connector, max_workers, embed_batch_size)
+            for result in results:
+                if result["status"] == "indexed":
+                    file_path, file_type = result["file_path"], result["file_type"]
+                    self._schedule_summaries(user_id, file_path, vector_index.get_file_record(file_path)["content_hash"],
+                                             partial(_stream_text, connector, file_path, file_type))
+        indexed = sum(1 for result in results if result["status"] == "indexed")
+        print(f"Indexed {indexed} of {len(files)} files for user {user_id}")
+        return results
+
+    def _index_files(self, vector_index: VectorIndex, files: List[Tuple[str, str]], connector: FileConnector,
+                     max_workers: Optional[int], embed_batch_size: int) -> List[Dict[str, Any]]:
+        results = [{"file_path": file_path, "file_type": file_type, "status": "pending", "chunks": 0} for file_path, file_type in files]
+        file_records: Dict[int, Dict[str, Any]] = {}
+        file_chunks: Dict[int, List[Chunk]] = {}
+        file_vectors: Dict[int, List[np.ndarray]] = {}
+        pending: List[Tuple[int, str]] = [] # (file position, chunk) waiting for a batch slot
+
+        def fail(pos, error):
+            # Drop what was gathered for the file, including chunks still waiting to be embedded
+            self._fail_indexing(results[pos], error)
+            file_chunks.pop(pos, None)
+            file_vectors.pop(pos, None)
+            pending[:] = [entry for entry in pending if entry[0] != pos]
+
+        def add_completed_files(positions):
+            for pos in positions:
+                if results[pos]["status"] != "pending" or sum(len(v) for v in file_vectors[pos]) < len(file_chunks[pos]):
+                    continue
+                file_path, file_type = files[pos]
+                try:
+                    embeddings = np.vstack(file_vectors[pos]) if file_vectors[pos] else None
+                    self._replace_file_chunks(vector_index, file_path, file_type, file_chunks[pos], file_records[pos], embeddings)
+                except Exception as e:
+                    fail(pos, e) # The files committed before this one stay indexed
+                    continue
+                results[pos].update(status="indexed", chunks=len(file_chunks[pos]))
+                del file_chunks[pos], file_vectors[pos]
+
+        def embed_pending(batch_size):
+            batch, pending[:] = pending[:batch_size], pending[batch_size:]
+            positions = sorted(set(pos for pos, _ in batch))
+            try:
+                embeddings = self.embedder.embed([chunk for _, chunk in batch], batch_size=embed_batch_size)
+            except Exception as e:
+                for pos in positions:
+                    fail(pos, e)
+                return
+            for row, (pos, _) in enumerate(batch):
+                if results[pos]["status"] == "pending":
+                    file_vectors[pos].append(embeddings[row:row + 1])
+            add_completed_files(positions)
+
+        to_read = []
+        for pos, (file_path, file_type) in enumerate(files):
+            try:
+                file_metadata = connector.get_file_metadata(file_path)
+            except Exception as e:
+                self._fail_indexing(results[pos], e)
+                continue
+            if self._is_unchanged(vector_index, file_path, file_metadata):
+                results[pos]["status"] = "skipped"
+            else:
+                file_records[pos] = self._file_record(file_type, None, file_metadata)
+                to_read.append(pos)
+
+        with vector_index.batch(), ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(_read_and_extract, connector, *files[pos]): pos for pos in to_read}
+            for future in as_completed(futures):
+                pos = futures[future]
+                try:
+                    file_records[pos]["content_hash"], text_content = future.result()
+                    if self._is_unchanged(vector_index, files[pos][0], record=file_records[pos]):
+                        vector_index.set_file_record(files[pos][0], file_records[pos])
+                        results[pos]["status"] = "skipped"
+                        continue
+                    chunks = list(self.text_processor.iter_chunks([text_content]))
+                except Exception as e:
+                    self._fail_indexing(results[pos], e)
+                    continue
+                file_chunks[pos] = chunks
+                file_vectors[pos] = []
+                pending.extend((pos, text) for text, _, _ in chunks)
+                add_completed_files([pos]) # Files without any text are done already
+                while len(pending) >= embed_batch_size:
+                    embed_pending(embed_batch_size)
+            while pending:
+                embed_pending(embed_batch_size)
+        return results
+
+    def sync_directory(self, user_id: str, directory: str, connector: FileConnector, **index_options) -> List[Dict[str, Any]]:
+        """Brings a user's index in line with a directory: new and changed files are (re)indexed,
+           unchanged files are skipped and files that disappeared from the directory are removed.
+           Returns the index_files results plus a "removed" result for each deleted file.
+        """
+        files = connector.list_files(directory)
+        with self.vector_indices.using(user_id) as vector_index, vector_index.batch():
+            results = self.index_files(user_id, files, connector, **index_options) if files else []
+            present = set(file_path for file_path, _ in files)
+            prefix = os.path.join(directory, "")
+            for file_path in list(vector_index.file_records):
+                if file_path.startswith(prefix) and file_path not in present:
+                    vector_index.remove_documents(file_path)
+                    self._summary_cache(user_id).remove(file_path)
+                    results.append({"file_path": file_path, "file_type": None, "status": "removed", "chunks": 0})
+        return results
+
+    def _fail_indexing(self, result: Dict[str, Any], error: Exception):
+        print(f"Error indexing file {result['file_path']}: {error}")
+        result.update(status="error", error=str(error))
 
     def remove_file(self, user_id: str, file_path: str):
         """Removes a file's content from the user's index."""
         print(f"Removing file {file_path} for user {user_id}")
-        self._get_vector_index(user_id).remove_documents(file_path)
+        with self.vector_indices.using(user_id) as vector_index:
+            vector_index.remove_documents(file_path)
+        self._summary_cache(user_id).remove(file_path)
         print(f"Successfully removed {file_path}")
 
     def list_indexed_files(self, user_id: str) -> List[str]:
         """Lists files that have been indexed for a given user."""
-        return self._get_vector_index(user_id).list_indexed_files()
+        with self.vector_indices.using(user_id) as vector_index:
+            return vector_index.list_indexed_files()
 
-    def search_files(self, user_id: str, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Performs a semantic search against the user's indexed files."""
+    def search_files(self, user_id: str, query: str, top_k: int = 5, min_score: Optional[float] = None,
+                     filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Performs a semantic search against the user's indexed files.
+           Results carry a similarity "score" in [-1, 1]; those below min_score are left out.
+           filters restricts the search by file, e.g. {"file_type": "pdf", "path_prefix": "/docs/",
+           "modified_after": timestamp}; see VectorIndex.search.
+        """
         print(f"Searching files for user {user_id} with query: {query}")
-        results = self._get_vector_index(user_id).search(query, top_k)
+        with self.vector_indices.using(user_id) as vector_index:
+            cache_key = (user_id, vector_index.version, query, top_k, _filters_key(filters))
+            results = self.search_cache.get(cache_key)
+            if results is None:
+                results = vector_index.search(query, top_k, filters=filters)
+                self.search_cache.put(cache_key, results)
+        if min_score is not None:
+            results = [result for result in results if result["score"] >= min_score]
         print(f"Found {len(results)} results.")
-        return results
+        return list(results)
+
+    def search_files_batch(self, user_id: str, queries: List[str], top_k: int = 5, min_score: Optional[float] = None,
+                           filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Runs several searches against the user's indexed files at once, e.g. for evaluation jobs.
+           Returns one search_files result list per query; uncached queries share one embedding
+           call and one FAISS search. filters apply to every query.
+        """
+        print(f"Searching files for user {user_id} with {len(queries)} queries")
+        filters_key = _filters_key(filters)
+        with self.vector_indices.using(user_id) as vector_index:
+            version = vector_index.version
+            results = [self.search_cache.get((user_id, version, query, top_k, filters_key)) for query in queries]
+            missing = list(dict.fromkeys(query for query, result in zip(queries, results) if result is None))
+            if missing:
+                found = dict(zip(missing, vector_index.search_batch(missing, top_k, filters=filters)))
+                for query, query_results in found.items():
+                    self.search_cache.put((user_id, version, query, top_k, filters_key), query_results)
+                results = [found[query] if result is None else result for query, result in zip(queries, results)]
+        if min_score is not None:
+            results = [[result for result in query_results if result["score"] >= min_score] for query_results in results]
+        return [list(query_results) for query_results in results]
 
     def summarize_file(self, user_id: str, file_path: str, file_type: str, connector: FileConnector, num_sentences: int = 3) -> str:
-        """Generates an extractive summary of a specific indexed file."""
+        """Generates an extractive summary of a specific indexed file.
+           A summary precomputed when the file was indexed is returned without reading the file,
+           as long as the file's size and modification time still match its index record.
+        """
         print(f"Summarizing file {file_path} for user {user_id}")
         try:
+            summary = self.cached_summary(user_id, file_path, num_sentences, connector.get_file_metadata(file_path))
+            if summary is not None:
+                return summary
             raw_content = connector.read_file(file_path, file_type)
-            text_content = self.text_processor.extract_text_from_raw(raw_content, file_type)
-            return self.summarizer.summarize(text_content, num_sentences)
+            return self.summarize_content(user_id, file_path, file_type, raw_content, num_sentences)
         except Exception as e:
             print(f"Error summarizing file {file_path}: {e}")
             raise
 
+    def cached_summary(self, user_id: str, file_path: str, num_sentences: int, file_metadata: Dict[str, Any]) -> Optional[str]:
+        """Returns the stored summary of an indexed file if file_metadata shows it unchanged since indexing, else None."""
+        with self.vector_indices.using(user_id) as vector_index:
+            if not self._is_unchanged(vector_index, file_path, file_metadata):
+                return None
+            content_hash = vector_index.get_file_record(file_path)["content_hash"]
+        return self._summary_cache(user_id).get(file_path, content_hash, num_sentences)
+
+    def summarize_content(self, user_id: str, file_path: str, file_type: str, raw_content: Any, num_sentences: int = 3) -> str:
+        """Summarizes raw file content the caller has already read, reusing or storing the file's
+           precomputed summaries when the content is what was last indexed.
+        """
+        content_hash = _content_hash(raw_content)
+        summaries = self._summary_cache(user_id)
+        summary = summaries.get(file_path, content_hash, num_sentences)
+        if summary is not None:
+            return summary
+        text_content = self.text_processor.extract_text_from_raw(raw_content, file_type)
+        with self.vector_indices.using(user_id) as vector_index:
+            record = vector_index.get_file_record(file_path)
+        if record is None or record["content_hash"] != content_hash:
+            return self.summarizer.summarize(text_content, num_sentences)
+        # Ranking the sentences once yields every count, so the stored counts come almost for free
+        counts = sorted(set(self.summary_sentence_counts or ()) | {num_sentences})
+        computed = self.summarizer.summarize_many(text_content, counts)
+        summaries.put(file_path, content_hash, computed)
+        return computed[num_sentences]
+
     def summarize_text(self, text_content: str, num_sentences: int = 3) -> str:
         """Generates an extractive summary of provided text content."""
         return self.summarizer.summarize(text_content, num_sentences)
 
-    def answer_question(self, user_id: str, question: str) -> Dict[str, Any]:
-        """Answers a question based on indexed files and conversational context."""
+    def answer_question(self, user_id: str, question: str, top_k: int = 5, min_score: Optional[float] = None) -> Dict[str, Any]:
+        """Answers a question based on indexed files and conversational context.
+           Only chunks scoring at least min_score (default: answer_min_score) are used as context.
+        """
         print(f"Answering question for user {user_id}: {question}")
-        
+        if min_score is None:
+            min_score = self.answer_min_score
+
         # 1. Retrieve relevant documents/chunks based on the question
-        search_results = self.search_files(user_id, question, top_k=5) # Get top 5 relevant chunks
-        
+        search_results = self.search_files(user_id, question, top_k=top_k, min_score=min_score) # Get the top relevant chunks
+        return self._answer_from_results(user_id, question, search_results)
+
+    def answer_questions(self, user_id: str, questions: List[str], top_k: int = 5, min_score: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Answers several questions, e.g. from one multi-question message, retrieving context for all of them in one batched search."""
+        print(f"Answering {len(questions)} questions for user {user_id}")
+        if min_score is None:
+            min_score = self.answer_min_score
+        batch_results = self.search_files_batch(user_id, questions, top_k=top_k, min_score=min_score)
+        return [self._answer_from_results(user_id, question, search_results) for question, search_results in zip(questions, batch_results)]
+
+    def _answer_from_results(self, user_id: str, question: str, search_results: List[Dict[str, Any]]) -> Dict[str, Any]:
         if not search_results:
             return {"answer": "I couldn't find relevant information in your indexed files to answer that question.", "source_files": []}
 
@@ -88,27 +641,36 @@ class FetchItAgent:
         combined_context = "\n\n".join(context_texts)
 
         # 3. Use a simple approach for answering: summarize the context or directly use relevant snippets
-        answer = self.summarizer.summarize(combined_context, num_sentences=2) # Summarize the context
+        if self.answer_method == "embedding":
+            # The chunks' vectors are already stored and the question's is cached, so nothing is embedded
+            with self.vector_indices.using(user_id) as vector_index:
+                vectors, found = vector_index.get_vectors([result['metadata']['chunk_id'] for result in search_results])
+            texts = [text for text, stored in zip(context_texts, found) if stored]
+            answer = self.summarizer.summarize_by_vectors(texts, vectors, 2, self.embedder.embed_query(question))
+        else:
+            answer = self.summarizer.summarize(combined_context, num_sentences=2) # Summarize the context
         
-        # Extract unique source files from search results
-        source_files = list(set([result['metadata']['file_path'] for result in search_results if 'file_path' in result['metadata']]))
+        # Extract unique source files from search results, including every file a deduplicated chunk occurs in
+        source_files = list(set([file_path for result in search_results
+                                 for file_path in result['metadata'].get('file_paths', [result['metadata'].get('file_path')])
+                                 if file_path is not None]))
 
         return {"answer": answer, "source_files": source_files}
 
     def get_chat_history(self, user_id: str) -> List[Dict[str, str]]:
         """Retrieves the current conversational history for a user."""
-        return self.chat_histories.get(user_id, [])
+        with self._chat_lock:
+            return list(self.chat_histories.get(user_id, []))
 
     def add_to_chat_history(self, user_id: str, role: str, message: str):
         """Adds a message to the conversational history for a user."""
-        if user_id not in self.chat_histories:
-            self.chat_histories[user_id] = []
-        self.chat_histories[user_id].append({"role": role, "content": message})
+        with self._chat_lock:
+            self.chat_histories.setdefault(user_id, []).append({"role": role, "content": message})
 
     def clear_chat_history(self, user_id: str):
         """Clears the conversational history for a user."""
-        if user_id in self.chat_histories:
-            del self.chat_histories[user_id]
+        with self._chat_lock:
+            self.chat_histories.pop(user_id, None)
         print(f"Chat history cleared for user {user_id}")
 
     def process_message(self, user_id: str, message: str) -> Dict[str, Any]:
@@ -0,0 +1,37 @@
+import hashlib
+import re
+from typing import List
+
+import numpy as np
+
+DEDUP_MODES = (None, "exact", "near")
+SIMHASH_BANDS = 4 # 16-bit bands: fingerprints differing in at most 3 bits share at least one band
+
+_WORDS = re.compile(r"\w+")
+_BITS = np.arange(64, dtype=np.uint64)
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+def content_hash(text: str) -> int:
+    """64-bit hash of text with runs of whitespace collapsed, for exact duplicate detection."""
+    return _hash64(" ".join(text.split()).encode("utf-8"))
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """64-bit SimHash over lowercased word shingles; similar texts get fingerprints a few bits apart.
+       Returns 0 for text without words.
+    """
+    words = _WORDS.findall(text.lower())
+    if not words:
+        return 0
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    hashes = np.array([_hash64(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+    ones = ((hashes[:, None] >> _BITS) & np.uint64(1)).sum(axis=0)
+    return int(sum(1 << bit for bit in range(64) if 2 * ones[bit] > len(shingles)))
+
+def simhash_bands(fingerprint: int) -> List[tuple]:
+    """The (band, value) keys a fingerprint is filed under for candidate lookup."""
+    return [(band, (fingerprint >> (16 * band)) & 0xFFFF) for band in range(SIMHASH_BANDS)]
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
@@ -0,0 +1,363 @@
+import json
+import mmap
+import os
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from .dedup import content_hash
+
+# One fixed-size record per chunk, kept sorted by chunk_id. offset/length locate the text in the
+# blob; start/end are the chunk's character offsets in its source document (-1 if unknown).
+# content_hash/simhash fingerprint the text (simhash 0 if not computed) and canonical is the
+# chunk_id of the chunk whose text and vector this one shares (its own id unless a duplicate).
+ROW_DTYPE = np.dtype([("chunk_id", "<i8"), ("offset", "<i8"), ("length", "<i4"), ("meta_id", "<i4"),
+                      ("start", "<i8"), ("end", "<i8"),
+                      ("content_hash", "<u8"), ("simhash", "<u8"), ("canonical", "<i8")])
+REMOVED = -1 # meta_id of a removed row, which stays in the table until the next save drops it
+
+def save_rows(f, array: np.ndarray, keep: np.ndarray, step: int = 65536):
+    """Writes array[keep] to f in .npy format a slice at a time, so a memory-mapped array is
+       never read into memory as a whole.
+    """
+    shape = (int(np.count_nonzero(keep)),) + array.shape[1:]
+    np.lib.format.write_array_header_1_0(f, {"descr": np.lib.format.dtype_to_descr(array.dtype), "fortran_order": False, "shape": shape})
+    for start in range(0, len(array), step):
+        f.write(np.ascontiguousarray(array[start:start + step][keep[start:start + step]]).tobytes())
+
+def replace_file(path: str, write):
+    """Writes a file through write(f) into a temporary file and renames it over path.
+       Readers that memory-mapped the old file keep a valid mapping of the old contents.
+       The data is on disk before the rename, so a crash leaves either the old or the new file.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class DocumentStore:
+    """Chunk texts and metadata in a compact binary layout.
+
+    <path>.bin holds the UTF-8 texts back to back, <path>.idx.npy a table of
+    (chunk_id, offset, length, meta_id, ...) rows and <path>.meta.json the distinct metadata
+    dicts, so metadata shared by all chunks of a file is stored once, as is the text of
+    chunks that duplicate another chunk. Both binary files
+    are memory-mapped on load: opening a store is O(1) and texts are paged in only when
+    a chunk is materialized with get(). Removing chunks marks their rows in place (the table
+    is mapped copy-on-write), so it costs as much as the removed chunks; the next save drops them.
+
+    Saved with a generation, the table and metadata go to new files named after it, e.g.
+    <path>.idx.3.npy, and the previous ones are left in place: the owner of the store records
+    the returned file names in its own manifest and deletes the old files once that is written.
+    An owner that writes without holding its lock splits save() into snapshot(), under its
+    lock, write_snapshot(), without it, and adopt(), under its lock again.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.blob_path = path + ".bin"
+        self.metadata: List[Dict[str, Any]] = [] # Interned metadata dicts, addressed by meta_id
+        self._meta_ids: Dict[str, int] = {}
+        self._table_blocks: List[np.ndarray] = []
+        self._blob = b"" # Memory-mapped texts saved so far
+        self._blob_file = None
+        self._pending_text = bytearray() # Texts added since the last save, logically following _blob
+        self.garbage_bytes = 0 # Bytes of removed texts still in the blob
+        self._changes = 0 # Counts changes to the table, so adopt() can tell whether any were made since a snapshot
+        self._removed = 0 # Rows marked removed
+        self._shared: Optional[Dict[int, int]] = None # Offset -> live rows using it, for texts used by several; built on first use
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path + ".idx.npy")
+
+    def load(self, files: Optional[Dict[str, str]] = None):
+        """Loads the files save() returned, or the unversioned ones if files is None."""
+        files = files or {"blob": self.path + ".bin", "table": self.path + ".idx.npy", "meta": self.path + ".meta.json"}
+        directory = os.path.dirname(self.path)
+        self.blob_path = os.path.join(directory, files["blob"])
+        with open(os.path.join(directory, files["meta"]), "r") as f:
+            saved = json.load(f)
+        self.metadata = saved["metadata"]
+        self.garbage_bytes = saved.get("garbage_bytes", 0)
+        self._meta_ids = {self._meta_key(metadata): meta_id for meta_id, metadata in enumerate(self.metadata)}
+        table = np.load(os.path.join(directory, files["table"]), mmap_mode="c")
+        self._map_blob()
+        if table.dtype != ROW_DTYPE:
+            table = self._upgrade_table(table)
+        self._table_blocks = [table]
+        self._removed = int((table["meta_id"] == REMOVED).sum())
+        self._shared = None
+
+    def _upgrade_table(self, table: np.ndarray) -> np.ndarray:
+        """Converts a table written by an older version; the next save writes the new layout."""
+        upgraded = np.zeros(len(table), dtype=ROW_DTYPE)
+        for field in table.dtype.names:
+            upgraded[field] = table[field]
+        if "start" not in table.dtype.names:
+            upgraded["start"] = upgraded["end"] = -1
+        if "canonical" not in table.dtype.names:
+            # Older stores hold no duplicates: every chunk is its own canonical copy
+            upgraded["canonical"] = upgraded["chunk_id"]
+            upgraded["content_hash"] = [content_hash(self._raw_text(int(row["offset"]), int(row["length"])).decode("utf-8"))
+                                        for row in upgraded]
+        return upgraded
+
+    def _map_blob(self):
+        self._close_blob()
+        self._blob_file = open(self.blob_path, "rb")
+        size = os.fstat(self._blob_file.fileno()).st_size
+        self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def _close_blob(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._blob = b""
+        if self._blob_file is not None:
+            self._blob_file.close()
+            self._blob_file = None
+
+    def close(self):
+        self._close_blob()
+
+    @staticmethod
+    def _meta_key(metadata: Dict[str, Any]) -> str:
+        return json.dumps(metadata, sort_keys=True)
+
+    def _intern(self, metadata: Dict[str, Any]) -> int:
+        key = self._meta_key(metadata)
+        if key not in self._meta_ids:
+            self._meta_ids[key] = len(self.metadata)
+            self.metadata.append(metadata)
+        return self._meta_ids[key]
+
+    def table(self) -> np.ndarray:
+        """Returns the row table, ordered by chunk_id. It includes the rows of removed chunks; see live()."""
+        if len(self._table_blocks) > 1:
+            self._table_blocks = [np.concatenate(self._table_blocks)]
+        return self._table_blocks[0] if self._table_blocks else np.zeros(0, dtype=ROW_DTYPE)
+
+    def __len__(self) -> int:
+        return sum(len(block) for block in self._table_blocks) - self._removed
+
+    def live(self) -> np.ndarray:
+        """Returns a boolean mask over table() of the rows of chunks that have not been removed."""
+        return self.table()["meta_id"] != REMOVED
+
+    def chunk_ids(self) -> np.ndarray:
+        """Returns the ids of the stored chunks, in order."""
+        table = self.table()
+        return np.asarray(table["chunk_id"] if not self._removed else table["chunk_id"][self.live()])
+
+    def add(self, chunk_ids: np.ndarray, texts: List[str], metadata: Dict[str, Any],
+            offsets: Optional[List[Tuple[int, int]]] = None, content_hashes: Optional[List[int]] = None,
+            simhashes: Optional[List[int]] = None, canonical: Optional[List[int]] = None):
+        """Appends chunks; chunk_ids must be larger than any id already in the store.
+           offsets are the (start, end) character offsets of each chunk in its source document.
+           canonical gives, per chunk, the chunk_id of an already stored chunk with the same text
+           (or the chunk's own id); such duplicates share that chunk's text instead of storing it again.
+        """
+        meta_id = self._intern(metadata)
+        rows = np.zeros(len(texts), dtype=ROW_DTYPE)
+        offset = len(self._blob) + len(self._pending_text)
+        for row, (chunk_id, text) in enumerate(zip(chunk_ids, texts)):
+            start, end = offsets[row] if offsets is not None else (-1, -1)
+            text_hash = content_hashes[row] if content_hashes is not None else content_hash(text)
+            fingerprint = simhashes[row] if simhashes is not None else 0
+            canonical_id = canonical[row] if canonical is not None else chunk_id
+            source = self._row(canonical_id) if canonical_id != chunk_id else None
+            if source is not None and source["content_hash"] == text_hash:
+                # An exact duplicate points at the text already in the blob
+                text_offset, length = int(source["offset"]), int(source["length"])
+                if self._shared is not None:
+                    self._shared[text_offset] = self._shared.get(text_offset, 1) + 1
+            else:
+                encoded = text.encode("utf-8")
+                text_offset, length = offset, len(encoded)
+                self._pending_text += encoded
+                offset += len(encoded)
+            rows[row] = (chunk_id, text_offset, length, meta_id, start, end, text_hash, fingerprint, canonical_id)
+        self._table_blocks.append(rows)
+        self._changes += 1
+
+    def _row(self, chunk_id: int) -> Optional[np.void]:
+        chunk_ids = self.table()["chunk_id"]
+        row = int(np.searchsorted(chunk_ids, chunk_id))
+        if row >= len(chunk_ids) or chunk_ids[row] != chunk_id or self.table()["meta_id"][row] == REMOVED:
+            return None
+        return self.table()[row]
+
+    def set_canonical(self, chunk_ids: np.ndarray, canonical: np.ndarray):
+        """Points the given chunks at a new canonical chunk, e.g. after the previous one was removed."""
+        table = self.table()
+        rows = np.searchsorted(table["chunk_id"], chunk_ids)
+        table["canonical"][rows] = canonical # In place: the table is writable or mapped copy-on-write
+        self._changes += 1
+
+    def rows_for_file(self, file_path: str) -> np.ndarray:
+        """Returns a boolean mask over table() selecting the chunks of file_path."""
+        meta_ids = [meta_id for meta_id, metadata in enumerate(self.metadata) if metadata.get("file_path") == file_path]
+        return np.isin(self.table()["meta_id"], meta_ids)
+
+    def remove_rows(self, mask: np.ndarray):
+        """Removes the chunks selected by a boolean mask over table(). Their rows are only marked,
+           so this costs as much as the removed chunks, not the store.
+        """
+        table = self.table()
+        rows = np.flatnonzero(mask & (table["meta_id"] != REMOVED))
+        # Texts shared with a surviving chunk (duplicates share their canonical chunk's text) stay in use
+        shared = self._shared_offsets()
+        for offset, length in zip(table["offset"][rows].tolist(), table["length"][rows].tolist()):
+            users = shared.pop(offset, 1) - 1
+            if users > 1:
+                shared[offset] = users
+            elif not users:
+                self.garbage_bytes += length
+        table["meta_id"][rows] = REMOVED
+        self._removed += len(rows)
+        self._changes += 1
+
+    def _shared_offsets(self) -> Dict[int, int]:
+        if self._shared is None:
+            table = self.table()
+            offsets, users = np.unique(table["offset"][table["meta_id"] != REMOVED], return_counts=True)
+            self._shared = dict(zip(offsets[users > 1].tolist(), users[users > 1].tolist()))
+        return self._shared
+
+    def _raw_text(self, offset: int, length: int) -> bytes:
+        saved = len(self._blob)
+        if offset >= saved:
+            return bytes(self._pending_text[offset - saved:offset - saved + length])
+        return self._blob[offset:offset + length]
+
+    def get(self, chunk_id: int) -> Optional[Dict[str, Any]]:
+        """Materializes one chunk as {'content': str, 'metadata': dict}, or None if it is not stored."""
+        record = self._row(chunk_id)
+        if record is None:
+            return None
+        metadata = dict(self.metadata[int(record["meta_id"])])
+        metadata["chunk_id"] = int(chunk_id)
+        if record["start"] >= 0:
+            metadata["start_offset"], metadata["end_offset"] = int(record["start"]), int(record["end"])
+        return {"content": self._raw_text(int(record["offset"]), int(record["length"])).decode("utf-8"), "metadata": metadata}
+
+    def file_paths_of(self, chunk_ids: List[int]) -> List[str]:
+        """Returns the source file path of each of the given stored chunks."""
+        table = self.table()
+        rows = np.searchsorted(table["chunk_id"], chunk_ids)
+        return [self.metadata[meta_id].get("file_path") for meta_id in table["meta_id"][rows].tolist()]
+
+    def file_paths(self) -> List[str]:
+        """Returns the unique file paths that still have chunks in the store."""
+        meta_ids = np.unique(self.table()["meta_id"])
+        meta_ids = meta_ids[meta_ids != REMOVED]
+        return list(set(self.metadata[meta_id]["file_path"] for meta_id in meta_ids.tolist() if "file_path" in self.metadata[meta_id]))
+
+    def memory_bytes(self) -> int:
+        """Bytes held outside the page cache: the row table, unsaved texts and interned metadata."""
+        table_bytes = sum(block.nbytes for block in self._table_blocks) # Without merging the blocks: this only reads
+        return int(table_bytes) + len(self._pending_text) + sum(len(key) for key in self._meta_ids)
+
+    def save(self, generation: Optional[int] = None) -> Dict[str, str]:
+        """Writes the store and returns the names of its files, relative to the store's directory.
+           New texts are appended to the blob, which is only rewritten (compacted) once removed
+           texts make up more than half of it. Appended texts lie past the end of the blob any
+           saved table refers to, so they never disturb an earlier generation.
+        """
+        snapshot = self.snapshot()
+        written = self.write_snapshot(snapshot, generation)
+        self.adopt(snapshot, written)
+        return written["files"]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Captures what save() writes: a copy of the table, as removals mark it in place, and of
+           the texts added since the last save.
+        """
+        pending = bytes(self._pending_text)
+        table = np.array(self.table())
+        return {"table": table, "live": table["meta_id"] != REMOVED, "blob": self._blob, "blob_length": len(self._blob), "pending": pending,
+                "metadata": list(self.metadata), "garbage_bytes": self.garbage_bytes, "changes": self._changes,
+                "compact": self._blob_file is None or self.garbage_bytes > (len(self._blob) + len(pending)) // 2}
+
+    def write_snapshot(self, snapshot: Dict[str, Any], generation: Optional[int] = None) -> Dict[str, Any]:
+        """Writes the files of a snapshot without changing the store, so the store may be used and
+           changed meanwhile. Returns their names under "files", plus what adopt() needs.
+        """
+        suffix = "" if generation is None else f".{generation}"
+        table, live, remap = snapshot["table"], snapshot["live"], None
+        if snapshot["compact"]:
+            blob_path = self.path + suffix + ".bin" # Also writes the blob of a store that has never been saved
+            table, remap = self._compact(snapshot, blob_path)
+            live = np.ones(len(table), dtype=bool)
+            blob_length, garbage_bytes = os.path.getsize(blob_path), 0
+        else:
+            blob_path = self.blob_path
+            blob_length, garbage_bytes = snapshot["blob_length"] + len(snapshot["pending"]), snapshot["garbage_bytes"]
+            with open(blob_path, "r+b") as f:
+                # Written where the saved texts end, over anything an interrupted save left behind
+                f.truncate(snapshot["blob_length"])
+                f.seek(snapshot["blob_length"])
+                f.write(snapshot["pending"])
+                f.flush()
+                os.fsync(f.fileno())
+        table_path = self.path + ".idx" + suffix + ".npy"
+        meta_path = self.path + ".meta" + suffix + ".json"
+        replace_file(table_path, lambda f: save_rows(f, table, live)) # Without the removed rows
+        meta = json.dumps({"metadata": snapshot["metadata"], "garbage_bytes": garbage_bytes}).encode("utf-8")
+        replace_file(meta_path, lambda f: f.write(meta))
+        return {"files": {"blob": os.path.basename(blob_path), "table": os.path.basename(table_path), "meta": os.path.basename(meta_path)},
+                "blob_path": blob_path, "blob_length": blob_length, "table_path": table_path, "remap": remap}
+
+    def adopt(self, snapshot: Dict[str, Any], written: Dict[str, Any]):
+        """Switches to the files write_snapshot() wrote for snapshot, keeping the changes made since.
+           Returns whether the table was replaced by the one written, which lacks the removed rows;
+           otherwise the table kept has changed since the snapshot.
+        """
+        old_end = snapshot["blob_length"] + len(snapshot["pending"])
+        replaced = self._changes == snapshot["changes"]
+        if replaced:
+            self._table_blocks = [np.load(written["table_path"], mmap_mode="c")] # As written
+            self._removed = 0
+        elif written["remap"] is not None:
+            # Move the offsets into the compacted blob: texts saved by the snapshot moved to
+            # where they were rewritten, and the texts added since follow the new blob
+            old_offsets, new_offsets = written["remap"]
+            table = np.array(self.table())
+            offsets = table["offset"]
+            saved = offsets < old_end
+            rows = np.minimum(np.searchsorted(old_offsets, offsets[saved]), max(len(old_offsets) - 1, 0))
+            offsets[saved] = new_offsets[rows] if len(old_offsets) else 0
+            offsets[~saved] += written["blob_length"] - old_end
+            self._table_blocks = [table]
+        if written["remap"] is not None:
+            self.garbage_bytes -= snapshot["garbage_bytes"]
+            self._shared = None
+        self._pending_text = self._pending_text[len(snapshot["pending"]):]
+        self.blob_path = written["blob_path"]
+        self._map_blob()
+        return replaced
+
+    def _compact(self, snapshot: Dict[str, Any], blob_path: str) -> Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """Writes the live texts of a snapshot to a new blob. Returns the table of the live rows with
+           the new offsets and the sorted old offsets with the new offset of each.
+        """
+        table, blob, saved, pending = snapshot["table"][snapshot["live"]], snapshot["blob"], snapshot["blob_length"], snapshot["pending"]
+        new_table = np.array(table)
+        written = {} # Old offset -> new offset, so duplicates keep sharing one copy of their text
+        def write(f):
+            offset = 0
+            for row in range(len(new_table)):
+                old_offset = int(table["offset"][row])
+                if old_offset in written:
+                    new_table["offset"][row] = written[old_offset]
+                    continue
+                length = int(table["length"][row])
+                encoded = pending[old_offset - saved:old_offset - saved + length] if old_offset >= saved else blob[old_offset:old_offset + length]
+                f.write(encoded)
+                new_table["offset"][row] = written[old_offset] = offset
+                offset += len(encoded)
+        replace_file(blob_path, write)
+        old_offsets = np.fromiter(written.keys(), dtype="int64", count=len(written))
+        new_offsets = np.fromiter(written.values(), dtype="int64", count=len(written))
+        order = np.argsort(old_offsets)
+        return new_table, (old_offsets[order], new_offsets[order])
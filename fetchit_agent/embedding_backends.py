@@ -0,0 +1,137 @@
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+class EmbeddingBackend(ABC):
+    """Runs an embedding model on a batch of texts. Embedder adds caching, query batching and
+       normalization on top, so a backend only has to turn texts into raw vectors.
+
+    The model is loaded on first use. threads bounds the CPU threads inference uses (None
+    leaves the library default, usually one per core).
+    """
+    name = "backend"
+
+    def __init__(self, model_name: str, threads: Optional[int] = None):
+        self.model_name = model_name
+        self.threads = threads
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self) -> Any:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def cache_namespace(self) -> str:
+        """Prefix of this backend's embedding cache keys. Backends whose vectors differ (e.g. quantized
+           ones) get their own, so their vectors never mix with full-precision ones in a shared cache.
+        """
+        return f"{self.model_name}@{self.name}"
+
+    @abstractmethod
+    def _load(self) -> Any:
+        """Loads the model; returns an object with a sentence-transformers style encode()."""
+        pass
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype="float32")
+
+    @property
+    def max_seq_length(self) -> int:
+        return int(self.model.max_seq_length)
+
+    @property
+    def tokenizer(self) -> Any:
+        return getattr(self.model, "tokenizer", None)
+
+class TorchBackend(EmbeddingBackend):
+    """The full-precision PyTorch SentenceTransformer on CPU. threads sets torch's intra-op
+       thread count, which is process-wide.
+    """
+    name = "torch"
+
+    @property
+    def cache_namespace(self) -> str:
+        return self.model_name # The original key format, so existing caches stay valid
+
+    def _load(self) -> Any:
+        from sentence_transformers import SentenceTransformer
+        if self.threads is not None:
+            import torch
+            torch.set_num_threads(self.threads)
+        return SentenceTransformer(self.model_name, device="cpu")
+
+class QuantizedTorchBackend(TorchBackend):
+    """The PyTorch model with its linear layers dynamically quantized to int8: weights are stored
+       as int8 and activations quantized on the fly. Needs nothing beyond torch.
+    """
+    name = "torch-int8"
+
+    @property
+    def cache_namespace(self) -> str:
+        return f"{self.model_name}@{self.name}"
+
+    def _load(self) -> Any:
+        import torch
+        model = super()._load()
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class OnnxBackend(EmbeddingBackend):
+    """The model exported to ONNX and run by ONNX Runtime on CPU (needs onnxruntime and optimum).
+
+    With quantized, the int8 ONNX export file_name is loaded instead of the float one; the
+    default suits AVX2 CPUs, "onnx/model_qint8_avx512_vnni.onnx" is faster on recent Xeons.
+    Models published without ONNX files are exported on first load.
+    """
+    name = "onnx"
+
+    def __init__(self, model_name: str, threads: Optional[int] = None, quantized: bool = False,
+                 file_name: Optional[str] = None):
+        super().__init__(model_name, threads)
+        self.quantized = quantized
+        self.file_name = file_name or ("onnx/model_quint8_avx2.onnx" if quantized else None)
+
+    @property
+    def cache_namespace(self) -> str:
+        return f"{self.model_name}@{self.name}:{self.file_name or 'onnx/model.onnx'}"
+
+    def _load(self) -> Any:
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx embedding backend needs onnxruntime and optimum: pip install optimum[onnxruntime]") from e
+        from sentence_transformers import SentenceTransformer
+        model_kwargs: Dict[str, Any] = {"provider": "CPUExecutionProvider"}
+        if self.file_name is not None:
+            model_kwargs["file_name"] = self.file_name
+        if self.threads is not None:
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = self.threads
+            session_options.inter_op_num_threads = 1
+            model_kwargs["session_options"] = session_options
+        return SentenceTransformer(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+BACKENDS = {
+    "torch": TorchBackend,
+    "torch-int8": QuantizedTorchBackend,
+    "onnx": OnnxBackend,
+    "onnx-int8": lambda model_name, threads: OnnxBackend(model_name, threads, quantized=True),
+}
+
+def make_backend(backend: Union[str, EmbeddingBackend], model_name: str, threads: Optional[int] = None) -> EmbeddingBackend:
+    """Returns backend itself if it is an EmbeddingBackend, else the named one of BACKENDS."""
+    if isinstance(backend, EmbeddingBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}. Choose one of {', '.join(BACKENDS)}")
+    return BACKENDS[backend](model_name, threads)
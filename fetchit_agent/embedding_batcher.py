@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Any, Optional
+
+class Histogram:
+    """Counts observations in power-of-two buckets: 1, 2, 3-4, 5-8, 9-16, ..."""
+    def __init__(self):
+        self.counts: Dict[int, int] = {} # Bucket upper bound -> count
+        self.total = 0
+        self.observations = 0
+
+    def record(self, value: int):
+        bound = 1
+        while bound < value:
+            bound *= 2
+        self.counts[bound] = self.counts.get(bound, 0) + 1
+        self.total += value
+        self.observations += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {}
+        for bound in sorted(self.counts):
+            low = bound // 2 + 1 if bound > 2 else bound
+            buckets[str(bound) if low == bound else f"{low}-{bound}"] = self.counts[bound]
+        mean = self.total / self.observations if self.observations else 0.0
+        return {"buckets": buckets, "count": self.observations, "mean": mean}
+
+class EmbeddingBatcher:
+    """Merges concurrent single-text embedding requests into batched model calls.
+
+    A background thread takes the first waiting request, collects more for up to max_wait
+    seconds or until max_batch_size texts are queued, embeds them with one embed_batch call
+    and hands every caller its own vector. Histograms of the queue depth seen when a batch
+    starts and of the batch sizes show how the window trades latency for throughput.
+    """
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]], max_batch_size: int = 32, max_wait: float = 0.003):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue_depths = Histogram()
+        self.batch_sizes = Histogram()
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def embed(self, text: str) -> List[float]:
+        """Embeds one text, waiting for the batch it was merged into."""
+        return self.submit(text).result()
+
+    def submit(self, text: str) -> Future:
+        """Queues one text and returns a Future of its embedding."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="fetchit-embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            depth = self._queue.qsize() + 1
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True # Finish this batch, then stop
+                    break
+                batch.append(item)
+            with self._stats_lock:
+                self.queue_depths.record(depth)
+                self.batch_sizes.record(len(batch))
+            self._embed(batch)
+
+    def _embed(self, batch: List[tuple]):
+        texts = list(dict.fromkeys(text for text, _ in batch)) # Identical concurrent queries are embedded once
+        try:
+            vectors = dict(zip(texts, self.embed_batch(texts)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the queue-depth and batch-size histograms."""
+        with self._stats_lock:
+            return {"queue_depth": self.queue_depths.snapshot(), "batch_size": self.batch_sizes.snapshot(),
+                    "max_batch_size": self.max_batch_size, "max_wait": self.max_wait}
+
+    def close(self):
+        """Embeds the requests already queued and stops the background thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Any
+
+import numpy as np
+
+class EmbeddingCache:
+    """Persistent, size-bounded cache of embeddings keyed by model name and text hash.
+
+    Entries live in a SQLite file so they survive restarts and can be shared by every
+    user index (and every process) pointing at the same path. When the cache holds more
+    than max_entries vectors, the least recently used ones are evicted.
+
+    Lookups do not write: the recency of hits is kept in memory and written with the next
+    put_many, flush or close, or once touch_flush_every hits are pending.
+    """
+    def __init__(self, path: str, max_entries: int = 100000, touch_flush_every: int = 4096):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_flush_every = touch_flush_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._touched: Dict[str, int] = {} # Key -> last_used not yet written
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL") # Readers do not block the writer, and commits append to the log
+        self._conn.execute("PRAGMA synchronous=NORMAL") # No fsync per commit; a crash can only lose recent entries
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()
+        self._size, self._clock = row
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        """Builds the cache key for a text embedded by model_name."""
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Returns the cached vectors for the keys that are present and marks them as recently used."""
+        found: Dict[str, np.ndarray] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500): # Stay below SQLite's bound-parameter limit
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+            if found:
+                self._clock += 1
+                self._touched.update(dict.fromkeys(found, self._clock))
+                if len(self._touched) >= self.touch_flush_every:
+                    self._write_touched()
+                    self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        """Stores vectors and evicts least recently used entries beyond max_entries."""
+        if not items:
+            return
+        with self._lock:
+            self._write_touched() # Before evicting, so recent hits are not taken for stale entries
+            self._clock += 1
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype="float32").tobytes(), self._clock) for key, vector in items.items()],
+            )
+            self._size += self._conn.total_changes - before
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (overflow,)
+                )
+                self._size -= overflow
+                self.evictions += overflow
+            self._conn.commit()
+
+    def _write_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def flush(self):
+        """Writes the recency of hits since the last write."""
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss/eviction counters and the current number of cached vectors."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": self._size}
+
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+            self._conn.close()
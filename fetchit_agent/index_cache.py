@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Any, Optional
+
+from .vector_index import VectorIndex
+
+class IndexCache:
+    """Keeps recently used per-user VectorIndex instances loaded, within configurable bounds.
+
+    An index is evicted when it has been idle for more than ttl seconds, or, least recently
+    used first, when more than max_indexes are loaded or their estimated memory exceeds
+    memory_budget bytes. Evicted indexes are flushed to disk and loaded again on next access;
+    when get() evicts, that happens on a background thread, not in the caller's request.
+    Indexes inside a batch() or held through using() are never evicted.
+    """
+    def __init__(self, loader: Callable[[str], VectorIndex], max_indexes: Optional[int] = None,
+                 ttl: Optional[float] = None, memory_budget: Optional[int] = None):
+        self.loader = loader
+        self.max_indexes = max_indexes
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, VectorIndex]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._in_use: Dict[str, int] = {} # Number of threads currently working with each index
+        self._pending: Dict[str, Future] = {} # Indexes being loaded or closed, resolved when that is done
+        self._lock = threading.RLock()
+        self._closer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetchit-index-close")
+
+    def get(self, user_id: str) -> VectorIndex:
+        """Returns the user's index, loading it if needed, and evicts others that are over the limits.
+           The index is loaded without holding the cache lock, so other users' indexes stay available;
+           callers asking for the same index meanwhile wait for that load instead of starting another.
+        """
+        while True:
+            with self._lock:
+                vector_index = self._entries.get(user_id)
+                pending = self._pending.get(user_id)
+                if vector_index is not None:
+                    self.hits += 1
+                    self._entries.move_to_end(user_id)
+                    self._last_used[user_id] = time.monotonic()
+                    break
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[user_id] = Future()
+                    loading = True
+                else:
+                    loading = False
+            if not loading:
+                pending.result() # Being loaded or closed by another thread; then look again
+                continue
+            try:
+                vector_index = self.loader(user_id)
+            except BaseException as e:
+                with self._lock:
+                    del self._pending[user_id]
+                pending.set_exception(e)
+                raise
+            with self._lock:
+                self._entries[user_id] = vector_index
+                self._last_used[user_id] = time.monotonic()
+                del self._pending[user_id]
+            pending.set_result(None)
+            break
+        self._evict_over_limits(keep=user_id)
+        return vector_index
+
+    @contextmanager
+    def using(self, user_id: str):
+        """Yields the user's index and keeps it from being evicted (and closed) until the block exits."""
+        while True:
+            vector_index = self.get(user_id)
+            with self._lock:
+                if self._entries.get(user_id) is vector_index: # Not evicted since get() returned it
+                    self._in_use[user_id] = self._in_use.get(user_id, 0) + 1
+                    break
+        try:
+            yield vector_index
+        finally:
+            with self._lock:
+                self._in_use[user_id] -= 1
+                if not self._in_use[user_id]:
+                    del self._in_use[user_id]
+
+    def peek(self, user_id: str) -> Optional[VectorIndex]:
+        """Returns the user's index if it is loaded, without loading it or counting an access."""
+        with self._lock:
+            return self._entries.get(user_id)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def values(self) -> List[VectorIndex]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def evict(self, user_id: str, wait: bool = True) -> bool:
+        """Flushes and unloads one user's index. Returns False if it is not loaded, in a batch or in use.
+           The index is closed without holding the cache lock, or without wait on a background thread;
+           get() waits for that before loading it again.
+        """
+        with self._lock:
+            vector_index = self._entries.get(user_id)
+            if vector_index is None or vector_index.in_batch or user_id in self._in_use:
+                return False
+            print(f"Evicting index of user {user_id}")
+            del self._entries[user_id], self._last_used[user_id]
+            closing = self._pending[user_id] = Future()
+            self.evictions += 1
+        if wait:
+            self._close(user_id, vector_index, closing)
+        else:
+            self._closer.submit(self._close, user_id, vector_index, closing, True)
+        return True
+
+    def _close(self, user_id: str, vector_index: VectorIndex, closing: Future, in_background: bool = False):
+        try:
+            vector_index.close()
+        except Exception as e:
+            if not in_background:
+                raise
+            print(f"Error closing index of user {user_id}: {e}")
+        finally:
+            with self._lock:
+                del self._pending[user_id]
+            closing.set_result(None)
+
+    def evict_expired(self, wait: bool = True):
+        """Evicts indexes that have been idle for longer than ttl."""
+        if self.ttl is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            expired = [user_id for user_id, used in self._last_used.items() if now - used > self.ttl]
+        for user_id in expired:
+            self.evict(user_id, wait)
+
+    def _evict_over_limits(self, keep: str):
+        self.evict_expired(wait=False)
+        with self._lock:
+            user_ids = list(self._entries)
+        for user_id in user_ids:
+            over_count = self.max_indexes is not None and len(self._entries) > self.max_indexes
+            over_memory = self.memory_budget is not None and self.memory_bytes() > self.memory_budget
+            if not (over_count or over_memory):
+                break
+            if user_id != keep:
+                self.evict(user_id, wait=False)
+
+    def memory_bytes(self) -> int:
+        """Estimated memory of all loaded indexes. Reads each index's running estimate without its lock."""
+        return sum(vector_index.memory_bytes() for vector_index in self.values())
+
+    def clear(self):
+        """Flushes and unloads every index that is not in a batch or in use, and waits for background closes."""
+        with self._lock:
+            user_ids = list(self._entries)
+        for user_id in user_ids:
+            self.evict(user_id)
+        with self._lock:
+            closing = list(self._pending.values())
+        for pending in closing:
+            pending.result()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss/eviction counters, the number of loaded indexes and their estimated memory."""
+        with self._lock:
+            stats = {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "loaded": len(self._entries)}
+        stats["memory_bytes"] = self.memory_bytes()
+        return stats
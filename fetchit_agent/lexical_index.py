@@ -0,0 +1,233 @@
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .doc_store import replace_file
+
+# One record per (term, chunk) pair. Terms are stored as 64-bit hashes, so no vocabulary is kept.
+POSTING_DTYPE = np.dtype([("term", "<u8"), ("chunk_id", "<i8"), ("tf", "<i4")])
+# Chunks and their length in tokens, sorted by chunk_id; a removed chunk has length -1 until the next save drops it
+DOC_DTYPE = np.dtype([("chunk_id", "<i8"), ("length", "<i4")])
+MAX_SEGMENTS = 8 # Segments are merged into one beyond this
+
+_TOKEN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; identifiers like snake_case names stay one token."""
+    return _TOKEN.findall(text.lower())
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+class LexicalIndex:
+    """BM25 inverted index over chunk texts, kept next to a VectorIndex.
+
+    Postings are sorted by term and written as immutable segment files <path>.<n>.npy,
+    which are memory-mapped on load. Postings of new chunks are buffered in memory and
+    written as a new segment on save; once there are more than MAX_SEGMENTS segments
+    they are merged into one. A removed chunk is marked in the <path>.docs.npy table of
+    chunks right away, which hides its postings until the next merge drops them; the next
+    save drops the chunk from the table.
+
+    save() records the segments in <path>.json. Saved with a generation instead, the table
+    goes to <path>.docs.<generation>.npy and nothing is written or deleted besides new files:
+    save() returns the state for the caller's own manifest, which is then the only record
+    of which files are current. Like DocumentStore, it can also be saved in three steps:
+    snapshot(), write_snapshot() and adopt().
+    """
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._segments: List[np.ndarray] = []
+        self._segment_numbers: List[int] = []
+        self._next_segment = 0
+        self._pending: List[np.ndarray] = [] # Postings added since the last save
+        self._frozen = 0 # Leading _pending arrays held by a snapshot, which add() leaves alone
+        self._changes = 0 # Counts changes to the live chunk table, so adopt() can tell whether any were made since a snapshot
+        self._doc_blocks: List[np.ndarray] = []
+        self._total_length = 0 # Tokens in all live chunks, for the average chunk length
+        self._removed = 0 # Chunks marked removed in the table
+        self._docs_path = path + ".docs.npy"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path + ".json")
+
+    def load(self, state: Optional[Dict[str, Any]] = None):
+        """Loads the state save() returned, or the one recorded in <path>.json if state is None."""
+        if state is None:
+            with open(self.path + ".json", "r") as f:
+                state = json.load(f)
+        self._segment_numbers = list(state["segments"])
+        self._next_segment = state["next_segment"]
+        if "docs" in state:
+            self._docs_path = os.path.join(os.path.dirname(self.path), state["docs"])
+        self._segments = [np.load(f"{self.path}.{number}.npy", mmap_mode="r") for number in self._segment_numbers]
+        docs = np.load(self._docs_path, mmap_mode="c") # Copy-on-write, so removals only copy the pages they mark
+        self._doc_blocks = [docs]
+        self._removed = int((docs["length"] < 0).sum())
+        self._total_length = int(docs["length"][docs["length"] >= 0].sum())
+        self._pending = []
+
+    def docs(self) -> np.ndarray:
+        """Returns the table of chunks, ordered by chunk_id. Removed chunks have length -1."""
+        if len(self._doc_blocks) > 1:
+            docs = np.concatenate(self._doc_blocks)
+            if len(docs) > 1 and (np.diff(docs["chunk_id"]) < 0).any():
+                docs = docs[np.argsort(docs["chunk_id"], kind="stable")]
+            self._doc_blocks = [docs]
+        return self._doc_blocks[0] if self._doc_blocks else np.zeros(0, dtype=DOC_DTYPE)
+
+    def __len__(self) -> int:
+        return sum(len(block) for block in self._doc_blocks) - self._removed
+
+    def add(self, chunk_ids: np.ndarray, texts: List[str]):
+        """Indexes chunks that are not in the index yet."""
+        postings = []
+        docs = np.zeros(len(texts), dtype=DOC_DTYPE)
+        for row, (chunk_id, text) in enumerate(zip(chunk_ids, texts)):
+            counts = Counter(tokenize(text))
+            docs[row] = (chunk_id, sum(counts.values()))
+            postings.extend((term_hash(term), chunk_id, tf) for term, tf in counts.items())
+        if not len(docs):
+            return
+        if postings:
+            self._pending.append(np.sort(np.array(postings, dtype=POSTING_DTYPE), order=["term", "chunk_id"]))
+            if len(self._pending) - self._frozen > MAX_SEGMENTS:
+                merged = np.sort(np.concatenate(self._pending[self._frozen:]), order=["term", "chunk_id"])
+                self._pending = self._pending[:self._frozen] + [merged]
+        self._doc_blocks.append(docs)
+        self._total_length += int(docs["length"].sum())
+        self._changes += 1
+
+    def remove(self, chunk_ids: np.ndarray):
+        """Marks chunks removed in place, which costs as much as the chunks, not the index."""
+        docs = self.docs()
+        if not len(docs) or not len(chunk_ids):
+            return
+        rows = np.minimum(np.searchsorted(docs["chunk_id"], chunk_ids), len(docs) - 1)
+        rows = np.unique(rows[(docs["chunk_id"][rows] == chunk_ids) & (docs["length"][rows] >= 0)])
+        if len(rows):
+            self._total_length -= int(docs["length"][rows].sum())
+            docs["length"][rows] = -1
+            self._removed += len(rows)
+            self._changes += 1
+
+    def _postings(self, term: np.uint64) -> np.ndarray:
+        parts = []
+        for segment in self._segments + self._pending:
+            low = np.searchsorted(segment["term"], term, side="left")
+            high = np.searchsorted(segment["term"], term, side="right")
+            if high > low:
+                parts.append(segment[low:high])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=POSTING_DTYPE)
+
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the chunk_ids of the up to top_k best BM25 matches for query and their scores, best first.
+           Only chunks containing at least one query term (and set in allowed, a boolean array over
+           chunk ids, if given) are returned.
+        """
+        docs = self.docs()
+        count = len(self)
+        terms = set(np.uint64(term_hash(term)) for term in tokenize(query))
+        if not count or not terms:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        average_length = self._total_length / count
+        hit_ids, hit_scores = [], []
+        for term in terms:
+            postings = self._postings(term)
+            rows = np.minimum(np.searchsorted(docs["chunk_id"], postings["chunk_id"]), len(docs) - 1)
+            # Postings of removed chunks linger until a merge
+            live = (docs["chunk_id"][rows] == postings["chunk_id"]) & (docs["length"][rows] >= 0)
+            postings, rows = postings[live], rows[live]
+            if not len(postings):
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            tf = postings["tf"].astype("float32")
+            norm = self.k1 * (1 - self.b + self.b * docs["length"][rows] / average_length)
+            hit_ids.append(postings["chunk_id"])
+            hit_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not hit_ids:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        ids, inverse = np.unique(np.concatenate(hit_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores)).astype("float32")
+        if allowed is not None:
+            # Term statistics stay those of the whole index; only the candidates are restricted
+            keep = allowed[np.minimum(ids, len(allowed) - 1)] & (ids < len(allowed))
+            ids, scores = ids[keep], scores[keep]
+        best = np.argsort(-scores, kind="stable")[:top_k]
+        return ids[best], scores[best]
+
+    def memory_bytes(self) -> int:
+        """Bytes held outside the page cache: unsaved postings and the live chunk table."""
+        return sum(block.nbytes for block in self._pending) + sum(block.nbytes for block in self._doc_blocks)
+
+    def save(self, generation: Optional[int] = None) -> Dict[str, Any]:
+        snapshot = self.snapshot()
+        written = self.write_snapshot(snapshot, generation)
+        self.adopt(snapshot, written)
+        if generation is None:
+            header = json.dumps(written["state"]).encode("utf-8")
+            replace_file(self.path + ".json", lambda f: f.write(header))
+            for number in written["obsolete"]:
+                os.remove(f"{self.path}.{number}.npy") # No longer listed in the header
+        return written["state"]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Captures what save() writes. Postings added from now on stay pending until adopt().
+           The chunk table is copied, as removals mark it in place.
+        """
+        self._frozen = len(self._pending)
+        return {"pending": list(self._pending), "segments": list(self._segments), "numbers": list(self._segment_numbers),
+                "next_segment": self._next_segment, "docs": np.array(self.docs()), "changes": self._changes}
+
+    def write_snapshot(self, snapshot: Dict[str, Any], generation: Optional[int] = None) -> Dict[str, Any]:
+        """Writes the files of a snapshot without changing the index. Returns the state save()
+           returns under "state", plus what adopt() needs.
+        """
+        segments, numbers, next_segment = list(snapshot["segments"]), list(snapshot["numbers"]), snapshot["next_segment"]
+        docs = snapshot["docs"][snapshot["docs"]["length"] >= 0] # Removed chunks are dropped here
+        if snapshot["pending"]:
+            segments.append(self._write_segment(next_segment, np.sort(np.concatenate(snapshot["pending"]), order=["term", "chunk_id"])))
+            numbers.append(next_segment)
+            next_segment += 1
+        obsolete = []
+        if len(segments) > MAX_SEGMENTS:
+            obsolete = numbers
+            merged = np.concatenate(segments)
+            merged = merged[np.isin(merged["chunk_id"], docs["chunk_id"])]
+            segments, numbers = [self._write_segment(next_segment, np.sort(merged, order=["term", "chunk_id"]))], [next_segment]
+            next_segment += 1
+        docs_path = self.path + (".docs.npy" if generation is None else f".docs.{generation}.npy")
+        replace_file(docs_path, lambda f: np.save(f, docs))
+        state = {"segments": list(numbers), "next_segment": next_segment, "docs": os.path.basename(docs_path)}
+        return {"state": state, "segments": segments, "docs_path": docs_path, "obsolete": obsolete}
+
+    def adopt(self, snapshot: Dict[str, Any], written: Dict[str, Any]):
+        """Switches to the segments write_snapshot() wrote for snapshot, keeping the changes made since."""
+        self._pending = self._pending[len(snapshot["pending"]):]
+        self._frozen = 0
+        self._segments = written["segments"]
+        self._segment_numbers = list(written["state"]["segments"])
+        self._next_segment = written["state"]["next_segment"]
+        self._docs_path = written["docs_path"]
+        if self._changes == snapshot["changes"]:
+            self._doc_blocks = [np.load(self._docs_path, mmap_mode="c")] # As written
+            self._removed = 0
+
+    @staticmethod
+    def files(path: str, state: Dict[str, Any]) -> List[str]:
+        """The files a state save() returned for the index at path refers to, relative to its directory."""
+        name = os.path.basename(path)
+        return [f"{name}.{number}.npy" for number in state["segments"]] + [state.get("docs", name + ".docs.npy")]
+
+    def _write_segment(self, number: int, postings: np.ndarray) -> np.ndarray:
+        segment_path = f"{self.path}.{number}.npy"
+        replace_file(segment_path, lambda f: np.save(f, postings))
+        return np.load(segment_path, mmap_mode="r")
@@ -1,24 +1,225 @@
 
-from sumy.parsers.plaintext import PlaintextParser
-from sumy.nlp.tokenizers import Tokenizer
-from sumy.summarizers.lsa import LsaSummarizer
-from sumy.nlp.stemmers import Stemmer
-from sumy.utils import get_stop_words
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Iterable, Optional
+
+import numpy as np
+
+from .doc_store import replace_file
+from .embedding_batcher import Histogram
+from .utils import iter_segments
+
+MAX_LSA_SENTENCES = 200 # Longer texts are summarized map-reduce style, so no single SVD grows beyond this
+SECTION_CHARS = 1 << 20 # Streamed text is summarized a section of about this many characters at a time
 
 class Summarizer:
-    def __init__(self, language: str = "english"):
+    def __init__(self, language: str = "english", max_sentences: int = MAX_LSA_SENTENCES, workers: int = 4):
+        """Texts with more than max_sentences sentences are split into groups that are ranked
+           in parallel on up to workers threads; the groups' best sentences are then ranked together.
+           sumy, its stemmer, stop words and tokenizer are loaded on first use.
+        """
         self.language = language
-        self.stemmer = Stemmer(language)
-        self.summarizer = LsaSummarizer(self.stemmer)
-        self.summarizer.stop_words = get_stop_words(language)
+        self._summarizer = None
+        self._tokenizer = None
+        self._load_lock = threading.Lock()
+        self.max_sentences = max_sentences
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self.latencies: Dict[str, Histogram] = {} # Method -> per-call latency in milliseconds
+        self._stats_lock = threading.Lock()
+
+    def _load(self):
+        with self._load_lock:
+            if self._summarizer is None:
+                from sumy.nlp.stemmers import Stemmer
+                from sumy.nlp.tokenizers import Tokenizer
+                from sumy.summarizers.lsa import LsaSummarizer
+                from sumy.utils import get_stop_words
+                self._tokenizer = Tokenizer(self.language) # Loads the sentence splitting model, so it is built once
+                summarizer = LsaSummarizer(Stemmer(self.language))
+                summarizer.stop_words = get_stop_words(self.language)
+                self._summarizer = summarizer
+
+    @property
+    def summarizer(self) -> Any:
+        if self._summarizer is None:
+            self._load()
+        return self._summarizer
+
+    @property
+    def tokenizer(self) -> Any:
+        if self._summarizer is None:
+            self._load()
+        return self._tokenizer
+
+    def warmup(self):
+        """Loads sumy and the language data up front."""
+        self._load()
 
     def summarize(self, text_content: str, num_sentences: int = 3) -> str:
         """Generates an extractive summary of the given text content."""
+        return self.summarize_many(text_content, [num_sentences])[num_sentences]
+
+    def summarize_many(self, text_content: str, counts: Iterable[int]) -> Dict[int, str]:
+        """Summarizes text_content at several sentence counts from a single ranking of its sentences.
+           At counts of at least its number of sentences, the text is returned whole, without running LSA.
+        """
+        counts = list(counts)
         if not text_content:
+            return {count: "" for count in counts}
+        from sumy.parsers.plaintext import PlaintextParser
+        started = time.perf_counter()
+        sentences = list(PlaintextParser.from_string(text_content, self.tokenizer).document.sentences)
+        ranked_count = max((count for count in counts if count < len(sentences)), default=0)
+        ranked = self._rank(sentences, ranked_count) if ranked_count else []
+        summaries = {}
+        for count in counts:
+            picked = range(len(sentences)) if count >= len(sentences) else sorted(ranked[:count]) # Nothing to choose between
+            summaries[count] = " ".join(str(sentences[i]) for i in picked)
+        self._record("lsa" if ranked_count else "short", started)
+        return summaries
+
+    def summarize_stream(self, pieces: Iterable[str], counts: Iterable[int], section_chars: int = SECTION_CHARS) -> Dict[int, str]:
+        """Like summarize_many, for text streamed in pieces, e.g. by TextProcessor.iter_text_from_file.
+           Text beyond section_chars characters is never held whole: each section, cut at a sentence
+           boundary, is reduced to its best sentences as it arrives, and those are ranked together.
+        """
+        counts = list(counts)
+        keep = max(counts)
+        kept: List[str] = [] # Best sentences of the sections so far, in document order
+        kept_chars = 0
+        section: List[str] = []
+        section_chars_read = 0
+        for segment, _ in iter_segments(pieces):
+            section.append(segment)
+            section_chars_read += len(segment)
+            if section_chars_read < section_chars:
+                continue
+            best = self.summarize_many("".join(section), [keep])[keep]
+            section, section_chars_read = [], 0
+            kept.append(best)
+            kept_chars += len(best)
+            if kept_chars >= section_chars: # Many sections: fold what was kept, so it stays bounded too
+                kept = [self.summarize_many(" ".join(kept), [keep])[keep]]
+                kept_chars = len(kept[0])
+        if not kept:
+            return self.summarize_many("".join(section), counts) # Short enough to summarize whole
+        if section:
+            kept.append(self.summarize_many("".join(section), [keep])[keep])
+        return self.summarize_many(" ".join(kept), counts)
+
+    def _rank(self, sentences: List[Any], count: int) -> List[int]:
+        """Returns the positions of the count best sentences, best first."""
+        if len(sentences) <= count:
+            return list(range(len(sentences)))
+        if len(sentences) > self.max_sentences and count <= self.max_sentences // 2:
+            # Map: rank groups of sentences separately; reduce: rank the groups' best sentences together
+            groups = [list(range(start, min(start + self.max_sentences, len(sentences))))
+                      for start in range(0, len(sentences), self.max_sentences)]
+            picks = self._map(lambda group: [group[i] for i in self._rank([sentences[j] for j in group], count)], groups)
+            candidates = sorted(i for pick in picks for i in pick)
+            return [candidates[i] for i in self._rank([sentences[i] for i in candidates], count)]
+
+        from sumy.models.dom import ObjectDocumentModel, Paragraph
+        ranked = []
+        def take_best(infos):
+            # Called with the sentence infos sorted by rating, best first
+            ranked.extend(info.order for info in infos)
+            return infos[:count]
+        self.summarizer(ObjectDocumentModel([Paragraph(sentences)]), take_best)
+        return ranked[:count]
+
+    def _map(self, func, items: List[Any]) -> List[Any]:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="summarizer")
+        return list(self._pool.map(func, items))
+
+    def summarize_by_vectors(self, texts: List[str], vectors: np.ndarray, num_sentences: int = 3,
+                             query_vector: Optional[np.ndarray] = None) -> str:
+        """A cheap extractive summary of chunks whose embeddings are already known (e.g. search results).
+
+        Chunks are picked by maximal marginal relevance: close to query_vector (or to the
+        chunks' centroid) but not to chunks already picked. Their sentences are taken in turn,
+        first sentences first, so no sentence is embedded and no SVD is run.
+        """
+        if not texts:
             return ""
-        
-        parser = PlaintextParser.from_string(text_content, Tokenizer(self.language))
-        summary_sentences = self.summarizer(parser.document, num_sentences)
-        return " ".join([str(sentence) for sentence in summary_sentences])
+        started = time.perf_counter()
+        vectors = np.asarray(vectors, dtype="float32")
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        target = vectors.mean(axis=0) if query_vector is None else np.asarray(query_vector, dtype="float32")
+        relevance = vectors @ target
+        order: List[int] = []
+        redundancy = np.zeros(len(texts), dtype="float32")
+        while len(order) < min(len(texts), num_sentences):
+            scores = 0.7 * relevance - 0.3 * redundancy
+            scores[order] = -np.inf
+            best = int(np.argmax(scores))
+            order.append(best)
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+        chunk_sentences = [self.tokenizer.to_sentences(texts[i]) for i in order]
+        picked: List[str] = []
+        for position in range(max(len(sentences) for sentences in chunk_sentences)):
+            for sentences in chunk_sentences:
+                if position < len(sentences) and len(picked) < num_sentences:
+                    picked.append(sentences[position])
+        self._record("embedding", started)
+        return " ".join(picked)
+
+    def _record(self, method: str, started: float):
+        elapsed_ms = max(1, int(round((time.perf_counter() - started) * 1000)))
+        with self._stats_lock:
+            self.latencies.setdefault(method, Histogram()).record(elapsed_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-call latency histograms in milliseconds, per method: "short" (returned as is), "lsa" and "embedding"."""
+        with self._stats_lock:
+            return {method: histogram.snapshot() for method, histogram in self.latencies.items()}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+class SummaryCache:
+    """Precomputed summaries of a user's files, one small JSON file per file in directory.
+       Each entry records the content hash it was computed from and is only served for that content.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, file_path: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(file_path.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, file_path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(file_path), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, file_path: str, content_hash: str, num_sentences: int) -> Optional[str]:
+        entry = self._load(file_path)
+        if entry is None or entry["content_hash"] != content_hash:
+            return None
+        return entry["summaries"].get(str(num_sentences))
 
+    def put(self, file_path: str, content_hash: str, summaries: Dict[int, str]):
+        """Stores summaries by sentence count, keeping other counts already stored for the same content."""
+        entry = self._load(file_path)
+        if entry is None or entry["content_hash"] != content_hash:
+            entry = {"file_path": file_path, "content_hash": content_hash, "summaries": {}}
+        entry["summaries"].update({str(count): summary for count, summary in summaries.items()})
+        os.makedirs(self.directory, exist_ok=True)
+        data = json.dumps(entry).encode("utf-8")
+        replace_file(self._path(file_path), lambda f: f.write(data))
 
+    def remove(self, file_path: str):
+        if os.path.exists(self._path(file_path)):
+            os.remove(self._path(file_path))
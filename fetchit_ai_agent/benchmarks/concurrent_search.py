@@ -0,0 +1,80 @@
+"""Measures how search throughput on one user index scales with the number of threads.
+
+FAISS releases the GIL while searching, so searches sharing a VectorIndex read lock should
+scale across cores. A random-vector embedder is used by default so the numbers reflect the
+index and locking rather than the embedding model; pass --real-model to embed queries with
+the sentence-transformers model instead, and add --query-batch-wait to embed concurrent
+queries in micro-batches (queries are then not pre-cached, so every search embeds).
+
+    python benchmarks/concurrent_search.py --chunks 200000 --threads 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fetchit_agent.vector_index import VectorIndex
+
+class RandomEmbedder:
+    """Stands in for Embedder: returns a fixed random unit vector per query."""
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+    def embed_query(self, query: str):
+        rng = np.random.default_rng(abs(hash(query)) % (2 ** 32))
+        vector = rng.standard_normal(self.dimension).astype("float32")
+        return vector / np.linalg.norm(vector)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--real-model", action="store_true")
+    parser.add_argument("--query-batch-wait", type=float, default=None, help="seconds, with --real-model")
+    args = parser.parse_args()
+
+    if args.real_model:
+        from fetchit_agent.embedder import Embedder
+        embedder = Embedder(normalize=True, query_cache_size=0)
+        if args.query_batch_wait is not None:
+            embedder.enable_query_batching(max_wait=args.query_batch_wait)
+        args.dimension = embedder.model.get_sentence_embedding_dimension()
+    else:
+        embedder = RandomEmbedder(args.dimension)
+
+    vectors = np.random.default_rng(0).standard_normal((args.chunks, args.dimension)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = VectorIndex(embedder, os.path.join(tmp, "bench.faiss"), autosave_every=None,
+                            index_type=args.index_type, metric="ip")
+        index.add_documents([f"chunk {i}" for i in range(args.chunks)], {"file_path": "bench.txt"}, vectors)
+        queries = [f"query {i}" for i in range(args.queries)]
+        if args.real_model and args.query_batch_wait is None:
+            embedder.query_cache.max_size = len(queries)
+            for query in queries:
+                embedder.embed_query(query) # Pre-cache queries so only the search is measured
+
+        baseline = None
+        for threads in args.threads:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(lambda query: index.search(query, args.top_k), queries))
+            qps = len(queries) / (time.perf_counter() - start)
+            baseline = baseline or qps
+            print(f"{threads:3d} threads: {qps:10.1f} queries/s  ({qps / baseline:.2f}x)")
+        index.close()
+        if getattr(embedder, "query_batcher", None) is not None:
+            print(embedder.query_batcher.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Compares embedding backends on a fixed corpus: throughput, query latency and retrieval quality.
+
+Every backend embeds the same chunks and queries. Quality is measured against the first
+backend given (by default the full-precision "torch" one): the mean cosine similarity of
+each chunk's vectors, and recall@k, the share of the reference backend's top-k chunks for
+each query that the other backend also ranks in its top k. The corpus is a directory of
+.txt files (--corpus) or, by default, a generated one that is the same on every run.
+
+    python benchmarks/embedding_backends.py --backends torch torch-int8 onnx onnx-int8 --threads 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fetchit_agent.embedder import Embedder
+from fetchit_agent.utils import TextProcessor
+
+TOPICS = ["invoice", "deployment", "vacation policy", "quarterly revenue", "database migration", "onboarding",
+          "security audit", "customer churn", "office move", "hiring plan", "incident review", "pricing"]
+
+def generated_corpus(size: int):
+    rng = np.random.default_rng(0)
+    texts = []
+    for i in range(size):
+        topic, other = rng.choice(TOPICS, 2, replace=False)
+        texts.append(f"Note {i} about the {topic}. The team discussed the {topic} with regard to the {other} "
+                     f"and agreed on {rng.integers(2, 9)} follow-up items before the next review.")
+    return texts
+
+def load_corpus(directory: str):
+    processor = TextProcessor()
+    texts = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".txt"):
+            texts.extend(processor.chunk_text("".join(processor.iter_text_from_file(os.path.join(directory, name), "txt"))))
+    return texts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch-int8"])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--corpus", default=None, help="directory of .txt files")
+    parser.add_argument("--chunks", type=int, default=2000, help="size of the generated corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus) if args.corpus else generated_corpus(args.chunks)
+    queries = [f"what was decided about the {TOPICS[i % len(TOPICS)]} in note {i}" for i in range(args.queries)]
+    reference = None
+    for name in args.backends:
+        embedder = Embedder(normalize=True, query_cache_size=0, backend=name, threads=args.threads)
+        embedder.warmup()
+        start = time.perf_counter()
+        vectors = embedder.embed(texts, batch_size=args.batch_size)
+        throughput = len(texts) / (time.perf_counter() - start)
+        latencies = []
+        query_vectors = []
+        for query in queries:
+            start = time.perf_counter()
+            query_vectors.append(embedder.embed_query(query))
+            latencies.append(time.perf_counter() - start)
+        top = np.argsort(-(np.stack(query_vectors) @ vectors.T), axis=1)[:, :args.top_k]
+
+        line = (f"{name:>10}: {throughput:8.1f} chunks/s  query p50 {np.percentile(latencies, 50) * 1000:6.2f} ms"
+                f"  p99 {np.percentile(latencies, 99) * 1000:6.2f} ms")
+        if reference is None:
+            reference = (vectors, top)
+        else:
+            cosine = float((vectors * reference[0]).sum(axis=1).mean())
+            recall = np.mean([len(set(mine) & set(theirs)) / args.top_k for mine, theirs in zip(top.tolist(), reference[1].tolist())])
+            line += f"  cosine vs {args.backends[0]} {cosine:.4f}  recall@{args.top_k} {recall:.3f}"
+        print(line)
+        embedder.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Measures cold-start costs of a worker: importing the agent, constructing it and warming it up.
+
+Each step runs in a fresh interpreter, so nothing is already imported or cached. Importing
+and constructing should stay cheap because models and parsing libraries load on first use;
+warmup is where the embedding model is paid for. With --import-budget, the script exits with
+status 1 if importing fetchit_agent.agent takes longer than that many seconds, so it can
+guard against a heavy import creeping back in.
+
+    python benchmarks/startup.py --repeat 5 --import-budget 0.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+STEPS = """
+import json, sys, time
+start = time.perf_counter()
+from fetchit_agent.agent import FetchItAgent
+imported = time.perf_counter()
+agent = FetchItAgent(data_dir=sys.argv[1], embedding_cache_size=None)
+constructed = time.perf_counter()
+agent.warmup()
+warm = time.perf_counter()
+heavy = [name for name in ("sentence_transformers", "torch", "sumy", "pypdf", "docx") if name in sys.modules]
+print(json.dumps({"import": imported - start, "construct": constructed - imported, "warmup": warm - constructed, "loaded": heavy}))
+agent.close()
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--import-budget", type=float, default=None, help="seconds")
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(args.repeat):
+            output = subprocess.run([sys.executable, "-c", STEPS, tmp], cwd=ROOT, check=True,
+                                    capture_output=True, text=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+    for step in ("import", "construct", "warmup"):
+        times = sorted(run[step] for run in runs)
+        print(f"{step:>10}: median {times[len(times) // 2] * 1000:8.1f} ms  max {times[-1] * 1000:8.1f} ms")
+    print(f"loaded after warmup: {', '.join(runs[-1]['loaded'])}")
+    if args.import_budget is not None and max(run["import"] for run in runs) > args.import_budget:
+        print(f"Import took longer than the {args.import_budget}s budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
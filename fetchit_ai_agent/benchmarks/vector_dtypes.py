@@ -0,0 +1,72 @@
+"""Evaluates compact vector storage: recall, memory and disk size per vector dtype and index type.
+
+Chunks and queries are random clustered unit vectors, like normalized sentence embeddings,
+and are the same on every run. For each vector_dtype the script builds a VectorIndex, takes
+exact float32 inner-product search as ground truth and reports recall@k, the estimated
+memory of the index (VectorIndex.memory_bytes) and the size of its files on disk.
+
+    python benchmarks/vector_dtypes.py --chunks 100000 --index-types flat hnsw ivf_flat
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fetchit_agent.vector_index import VECTOR_DTYPES, VectorIndex
+
+class FixedEmbedder:
+    """Stands in for Embedder: returns the precomputed vector of each query."""
+    def __init__(self, queries: dict):
+        self.queries = queries
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self.queries[query]
+
+    def embed_queries(self, queries: list) -> np.ndarray:
+        return np.stack([self.queries[query] for query in queries])
+
+def clustered_unit_vectors(rng: np.random.Generator, count: int, dimension: int, centers: np.ndarray) -> np.ndarray:
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.35 * rng.standard_normal((count, dimension)).astype("float32")
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--index-types", nargs="+", default=["flat"])
+    parser.add_argument("--dtypes", nargs="+", default=list(VECTOR_DTYPES))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((64, args.dimension)).astype("float32") / np.sqrt(args.dimension) * 3
+    vectors = clustered_unit_vectors(rng, args.chunks, args.dimension, centers)
+    query_vectors = clustered_unit_vectors(rng, args.queries, args.dimension, centers)
+    truth = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :args.top_k]
+    queries = {f"query {i}": vector for i, vector in enumerate(query_vectors)}
+
+    for index_type in args.index_types:
+        for vector_dtype in args.dtypes:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "eval.faiss")
+                index = VectorIndex(FixedEmbedder(queries), path, autosave_every=None, index_type=index_type,
+                                    metric="ip", lexical=False, dedup=None, vector_dtype=vector_dtype)
+                index.add_documents([f"chunk {i}" for i in range(args.chunks)], {"file_path": "eval.txt"}, vectors)
+                results = index.search_batch(list(queries), args.top_k)
+                found = [[hit["metadata"]["chunk_id"] for hit in hits] for hits in results]
+                recall = np.mean([len(set(hits) & set(expected)) / args.top_k for hits, expected in zip(found, truth.tolist())])
+                memory = index.memory_bytes()
+                index.flush()
+                disk = sum(os.path.getsize(name) for name in glob.glob(path + "*"))
+                index.close()
+            print(f"{index_type:>8} {vector_dtype:>7}: recall@{args.top_k} {recall:.4f}  memory {memory / 2 ** 20:8.1f} MiB"
+                  f"  disk {disk / 2 ** 20:8.1f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Any, Optional, Tuple
+
+from .agent import FetchItAgent
+from .connector_interface import FileConnector
+
+class AsyncFetchItAgent:
+    """An asyncio facade over FetchItAgent for async web servers.
+
+    Model inference, FAISS and disk work run in two bounded thread pools: one for queries
+    (search, answers, chat) and one for ingestion, so a slow PDF ingest occupies an ingest
+    worker without holding up other users' queries. File reads go through the connector's
+    async methods. At most max_pending_ingests ingest calls and max_pending_queries query
+    calls are admitted at a time; further callers wait for a slot, which pushes back on a
+    web tier that submits faster than the agent can keep up.
+
+    Cancelling a call that is still waiting for a slot or a worker means its work never runs.
+    Cancelling an ingest between its stages (metadata, read, index) stops it before the next
+    one. Work already running in a worker thread finishes, and its result is discarded.
+    """
+    def __init__(self, agent: Optional[FetchItAgent] = None, max_query_workers: int = 4, max_ingest_workers: int = 1,
+                 max_pending_queries: int = 64, max_pending_ingests: int = 16, **agent_options):
+        """agent_options are passed to FetchItAgent when no agent is given."""
+        self.agent = agent if agent is not None else FetchItAgent(**agent_options)
+        self._query_executor = ThreadPoolExecutor(max_workers=max_query_workers, thread_name_prefix="fetchit-query")
+        self._ingest_executor = ThreadPoolExecutor(max_workers=max_ingest_workers, thread_name_prefix="fetchit-ingest")
+        self._query_slots = asyncio.Semaphore(max_pending_queries)
+        self._ingest_slots = asyncio.Semaphore(max_pending_ingests)
+
+    async def _run(self, executor: ThreadPoolExecutor, func, *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
+    async def _query(self, func, *args, **kwargs) -> Any:
+        async with self._query_slots:
+            return await self._run(self._query_executor, func, *args, **kwargs)
+
+    async def _ingest(self, func, *args, **kwargs) -> Any:
+        async with self._ingest_slots:
+            return await self._run(self._ingest_executor, func, *args, **kwargs)
+
+    async def index_file(self, user_id: str, file_path: str, file_type: str, connector: FileConnector, force: bool = False) -> bool:
+        """Awaitable FetchItAgent.index_file; the file is read with the connector's async methods."""
+        async with self._ingest_slots:
+            file_metadata = await connector.get_file_metadata_async(file_path)
+            if not force and await self._run(self._ingest_executor, self.agent.is_file_unchanged, user_id, file_path, file_metadata):
+                print(f"Skipping unchanged file {file_path}")
+                return False
+            raw_content = await connector.read_file_async(file_path, file_type)
+            return await self._run(self._ingest_executor, self.agent.index_content,
+                                   user_id, file_path, file_type, raw_content, file_metadata, force)
+
+    async def index_files(self, user_id: str, files: List[Tuple[str, str]], connector: FileConnector, **options) -> List[Dict[str, Any]]:
+        """Awaitable FetchItAgent.index_files."""
+        return await self._ingest(self.agent.index_files, user_id, files, connector, **options)
+
+    async def sync_directory(self, user_id: str, directory: str, connector: FileConnector, **options) -> List[Dict[str, Any]]:
+        """Awaitable FetchItAgent.sync_directory."""
+        return await self._ingest(self.agent.sync_directory, user_id, directory, connector, **options)
+
+    async def remove_file(self, user_id: str, file_path: str):
+        """Awaitable FetchItAgent.remove_file."""
+        await self._ingest(self.agent.remove_file, user_id, file_path)
+
+    async def list_indexed_files(self, user_id: str) -> List[str]:
+        """Awaitable FetchItAgent.list_indexed_files."""
+        return await self._query(self.agent.list_indexed_files, user_id)
+
+    async def search_files(self, user_id: str, query: str, top_k: int = 5, min_score: Optional[float] = None,
+                           filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Awaitable FetchItAgent.search_files."""
+        return await self._query(self.agent.search_files, user_id, query, top_k, min_score, filters)
+
+    async def search_files_batch(self, user_id: str, queries: List[str], top_k: int = 5, min_score: Optional[float] = None,
+                                 filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Awaitable FetchItAgent.search_files_batch."""
+        return await self._query(self.agent.search_files_batch, user_id, queries, top_k, min_score, filters)
+
+    async def answer_question(self, user_id: str, question: str, top_k: int = 5, min_score: Optional[float] = None) -> Dict[str, Any]:
+        """Awaitable FetchItAgent.answer_question."""
+        return await self._query(self.agent.answer_question, user_id, question, top_k, min_score)
+
+    async def answer_questions(self, user_id: str, questions: List[str], top_k: int = 5, min_score: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Awaitable FetchItAgent.answer_questions."""
+        return await self._query(self.agent.answer_questions, user_id, questions, top_k, min_score)
+
+    async def summarize_file(self, user_id: str, file_path: str, file_type: str, connector: FileConnector, num_sentences: int = 3) -> str:
+        """Awaitable FetchItAgent.summarize_file; the file is read with the connector's async methods."""
+        async with self._query_slots:
+            file_metadata = await connector.get_file_metadata_async(file_path)
+            summary = await self._run(self._query_executor, self.agent.cached_summary, user_id, file_path, num_sentences, file_metadata)
+            if summary is not None:
+                return summary
+            raw_content = await connector.read_file_async(file_path, file_type)
+            return await self._run(self._query_executor, self.agent.summarize_content,
+                                   user_id, file_path, file_type, raw_content, num_sentences)
+
+    async def summarize_text(self, text_content: str, num_sentences: int = 3) -> str:
+        """Awaitable FetchItAgent.summarize_text."""
+        return await self._query(self.agent.summarize_text, text_content, num_sentences)
+
+    async def process_message(self, user_id: str, message: str) -> Dict[str, Any]:
+        """Awaitable FetchItAgent.process_message."""
+        return await self._query(self.agent.process_message, user_id, message)
+
+    def get_chat_history(self, user_id: str) -> List[Dict[str, str]]:
+        """Returns the user's chat history. It is held in memory, so no worker is involved."""
+        return self.agent.get_chat_history(user_id)
+
+    def clear_chat_history(self, user_id: str):
+        """Clears the user's chat history."""
+        self.agent.clear_chat_history(user_id)
+
+    async def warmup(self):
+        """Awaitable FetchItAgent.warmup."""
+        await self._ingest(self.agent.warmup)
+
+    async def flush(self):
+        """Awaitable FetchItAgent.flush."""
+        await self._ingest(self.agent.flush)
+
+    async def close(self):
+        """Waits for running work, then flushes and unloads all indexes."""
+        await asyncio.get_running_loop().run_in_executor(None, self._shutdown)
+
+    def _shutdown(self):
+        self._query_executor.shutdown(wait=True)
+        self._ingest_executor.shutdown(wait=True)
+        self.agent.close()
+
+    async def __aenter__(self) -> "AsyncFetchItAgent":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
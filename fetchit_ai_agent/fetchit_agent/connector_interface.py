@@ -1,6 +1,7 @@
 
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
 import os
 
 class FileConnector(ABC):
@@ -15,8 +16,28 @@ class FileConnector(ABC):
         """Retrieves metadata for a given file path."""
         pass
 
+    def list_files(self, directory: str) -> List[Tuple[str, str]]:
+        """Lists the (file_path, file_type) pairs of supported files below a directory."""
+        raise NotImplementedError(f"{type(self).__name__} does not support listing files")
+
+    def get_local_path(self, file_path: str) -> Optional[str]:
+        """Returns a local filesystem path the file can be streamed from, or None if it must be read with read_file."""
+        return None
+
+    async def read_file_async(self, file_path: str, file_type: str) -> Any:
+        """Awaitable read_file. By default read_file runs in a worker thread; connectors with an
+           async client (cloud storage, HTTP) should override this to read without a thread.
+        """
+        return await asyncio.to_thread(self.read_file, file_path, file_type)
+
+    async def get_file_metadata_async(self, file_path: str) -> Dict[str, Any]:
+        """Awaitable get_file_metadata, run in a worker thread unless overridden."""
+        return await asyncio.to_thread(self.get_file_metadata, file_path)
+
 class LocalFileConnector(FileConnector):
     """A concrete implementation of FileConnector for local file system access."""
+    SUPPORTED_FILE_TYPES = ("txt", "pdf", "docx")
+
     def read_file(self, file_path: str, file_type: str) -> Any:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
@@ -41,4 +62,19 @@ class LocalFileConnector(FileConnector):
             "source": "local_filesystem"
         }
 
+    def get_local_path(self, file_path: str) -> Optional[str]:
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        return file_path
+
+    def list_files(self, directory: str) -> List[Tuple[str, str]]:
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"Directory not found: {directory}")
 
+        files = []
+        for root, _, names in os.walk(directory):
+            for name in sorted(names):
+                file_type = os.path.splitext(name)[1].lstrip(".").lower()
+                if file_type in self.SUPPORTED_FILE_TYPES:
+                    files.append((os.path.join(root, name), file_type))
+        return files
@@ -1,13 +1,121 @@
 
-from sentence_transformers import SentenceTransformer
-from typing import List
+
+from typing import Any, List, Optional, Union
+
+import numpy as np
+
+from .embedding_backends import EmbeddingBackend, make_backend
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import EmbeddingCache
+from .lru_cache import LRUCache
+from .utils import estimate_tokens
 
 class Embedder:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", cache: Optional[EmbeddingCache] = None, query_cache_size: int = 1024,
+                 normalize: bool = False, backend: Union[str, EmbeddingBackend] = "torch", threads: Optional[int] = None):
+        """With normalize, embeddings are scaled to unit length so inner product equals cosine similarity.
+           backend runs the model: "torch" (full precision), "torch-int8", "onnx", "onnx-int8" or an
+           EmbeddingBackend instance; threads bounds its CPU threads. The model is loaded on first
+           use (or by warmup), not here.
+        """
+        self.model_name = model_name
+        self.backend = make_backend(backend, model_name, threads)
+        self.cache = cache
+        self.normalize = normalize
+        self.query_cache = LRUCache(query_cache_size) # In-memory, for repeated search queries
+        self.query_batcher: Optional[EmbeddingBatcher] = None
+
+    @property
+    def model(self) -> Any:
+        """The backend's model, imported and loaded on first access; torch makes the import alone take seconds."""
+        return self.backend.model
+
+    @property
+    def loaded(self) -> bool:
+        return self.backend.loaded
+
+    def warmup(self):
+        """Loads the model and runs one dummy encode, so the first real request does not pay for either.
+           Called before forking worker processes, it lets them share the model's memory copy-on-write.
+        """
+        self.backend.encode(["warmup"], batch_size=1)
+
+    @property
+    def max_tokens(self) -> int:
+        """The longest text, in tokens, the model embeds without truncating it ([CLS] and [SEP] excluded)."""
+        return self.backend.max_seq_length - 2
+
+    def count_tokens(self, text: str) -> int:
+        """Counts text's tokens with the model's tokenizer, or estimates them if it has none."""
+        tokenizer = self.backend.tokenizer
+        if tokenizer is None:
+            return estimate_tokens(text)
+        return len(tokenizer.tokenize(text))
+
+    def embed(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Generates embeddings for a list of texts, batch_size texts per forward pass, as a
+           contiguous float32 matrix with one row per text.
+           With a cache, only texts this model has not embedded before reach the model.
+        """
+        if self.cache is None:
+            return self._encode(texts, batch_size)
+
+        keys = [EmbeddingCache.make_key(self.backend.cache_namespace, text) for text in texts]
+        cached = self.cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            computed = dict(zip(missing, self.backend.encode(list(missing.values()), batch_size=batch_size)))
+            self.cache.put_many(computed)
+            cached.update(computed)
+        # The cache holds raw model output, so normalized and raw embedders can share it
+        return self._finish(np.stack([cached[key] for key in keys]) if keys else np.zeros((0, 0), dtype="float32"))
+
+    def _encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Embeds texts without the persistent cache, as for search queries (the query cache covers repeats)."""
+        return self._finish(self.backend.encode(texts, batch_size=batch_size))
+
+    def _finish(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if self.normalize and len(vectors):
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    def enable_query_batching(self, max_batch_size: int = 32, max_wait: float = 0.003):
+        """Merges queries embedded concurrently from several threads into batched model calls,
+           waiting up to max_wait seconds for a batch to fill.
+        """
+        self.close()
+        self.query_batcher = EmbeddingBatcher(self._encode, max_batch_size, max_wait)
 
-    def embed(self, texts: List[str]) -> List[List[float]]:
-        """Generates embeddings for a list of texts."""
-        return self.model.encode(texts).tolist()
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embeds a single search query, reusing the vector of a recently seen identical query.
+           The vector may be shared with other callers, so it is read-only.
+        """
+        embedding = self.query_cache.get(query)
+        if embedding is None:
+            if self.query_batcher is not None:
+                embedding = self.query_batcher.embed(query)
+            else:
+                embedding = self._encode([query])[0]
+            embedding.setflags(write=False)
+            self.query_cache.put(query, embedding)
+        return embedding
 
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeds several search queries into a matrix, running the ones not in the query cache through one embed call."""
+        embeddings = [self.query_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if missing:
+            computed = dict(zip(missing, self._encode(missing)))
+            for query, embedding in computed.items():
+                embedding.setflags(write=False)
+                self.query_cache.put(query, embedding)
+            embeddings = [computed[query] if embedding is None else embedding for query, embedding in zip(queries, embeddings)]
+        return np.stack(embeddings) if embeddings else np.zeros((0, 0), dtype="float32")
 
+    def close(self):
+        """Stops the query batching thread, if any."""
+        if self.query_batcher is not None:
+            self.query_batcher.close()
+            self.query_batcher = None
@@ -1,64 +1,170 @@
 
 import os
-from typing import List
+import re
+from collections import deque
+from io import BytesIO
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
 
-# For PDF processing
-import pypdf
+Chunk = Tuple[str, int, int] # (text, start, end) with character offsets into the source text
 
-# For DOCX processing
-from docx import Document
+TEXT_BLOCK_SIZE = 1 << 20 # Characters read per step when streaming a text file
+DEFAULT_MAX_TOKENS = 254 # all-MiniLM-L6-v2 embeds 256 tokens, two of which are [CLS] and [SEP]
+MAX_SEGMENT_CHARS = 20000 # Text without any sentence boundary is cut here, so buffering stays bounded
+
+# A sentence ends at ., ! or ? (plus closing quotes or brackets) followed by whitespace; a paragraph at a blank line
+_BOUNDARY = re.compile(r"[.!?][\"')\]]*\s+|\n\s*\n")
+_WORD = re.compile(r"\S+\s*")
+_TOKEN_ESTIMATE = re.compile(r"\w{1,6}|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the word-piece tokens in text from above, for when no tokenizer is at hand."""
+    return len(_TOKEN_ESTIMATE.findall(text))
+
+def iter_segments(pieces: Iterable[str]) -> Iterator[Tuple[str, int]]:
+    """Splits a stream of text pieces into consecutive sentence/paragraph segments.
+       Yields (segment, start offset); each segment keeps its trailing whitespace, so the
+       segments concatenate back to the original text.
+    """
+    carry = ""
+    offset = 0 # Offset of carry in the whole text
+    for piece in pieces:
+        if not piece:
+            continue
+        buffer = carry + piece
+        pos = 0
+        for match in _BOUNDARY.finditer(buffer):
+            if match.end() == len(buffer):
+                break # The whitespace may continue in the next piece
+            yield buffer[pos:match.end()], offset + pos
+            pos = match.end()
+        while len(buffer) - pos > MAX_SEGMENT_CHARS:
+            yield buffer[pos:pos + MAX_SEGMENT_CHARS], offset + pos
+            pos += MAX_SEGMENT_CHARS
+        carry = buffer[pos:]
+        offset += pos
+    if carry:
+        yield carry, offset
 
 class TextProcessor:
-    def __init__(self):
-        pass
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: Optional[int] = None,
+                 count_tokens: Optional[Callable[[str], int]] = None):
+        """Chunks hold at most max_tokens tokens as counted by count_tokens (by default an estimate),
+           and repeat up to overlap_tokens (default max_tokens // 8) of the previous chunk's sentences.
+        """
+        self.max_tokens = max_tokens
+        self.overlap_tokens = max_tokens // 8 if overlap_tokens is None else overlap_tokens
+        self.count_tokens = count_tokens or estimate_tokens
 
     def extract_text_from_raw(self, raw_content: Any, file_type: str) -> str:
         """Extracts text content from raw content (bytes for binary, string for text files)."""
-        text_content = ""
+        return "".join(self.iter_text_from_raw(raw_content, file_type))
+
+    def iter_text_from_raw(self, raw_content: Any, file_type: str) -> Iterator[str]:
+        """Yields the text of raw content piece by piece: a page of a PDF, a paragraph of a DOCX.
+           raw_content may be bytes or a memory-mapped buffer for binary files, a string for text files.
+        """
         if file_type == "txt":
-            text_content = raw_content # raw_content is already string for txt
-        elif file_type == "pdf":
+            yield raw_content # raw_content is already string for txt
+        elif file_type in ("pdf", "docx"):
+            # pypdf and python-docx expect a file-like object or path, so wrap the bytes in BytesIO
+            yield from self._iter_document_text(BytesIO(raw_content), file_type)
+        else:
+            raise ValueError(f"Unsupported file type for text extraction: {file_type}")
+
+    def iter_text_from_file(self, file_path: str, file_type: str) -> Iterator[str]:
+        """Yields the text of a local file piece by piece. Text files are read a block at a time.
+           pypdf reads a PDF through the open file, fetching each page's objects as the page is
+           requested, so the whole file is not read into memory. python-docx still parses a
+           DOCX body up front.
+        """
+        if file_type == "txt":
+            with open(file_path, "r", encoding="utf-8") as f:
+                for block in iter(lambda: f.read(TEXT_BLOCK_SIZE), ""):
+                    yield block
+        elif file_type in ("pdf", "docx"):
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"File not found: {file_path}")
+            # Given a path, pypdf would read the whole file into memory; the handle stays open while pages are yielded
+            with open(file_path, "rb") as f:
+                yield from self._iter_document_text(f, file_type)
+        else:
+            raise ValueError(f"Unsupported file type for text extraction: {file_type}")
+
+    def _iter_document_text(self, source: Any, file_type: str) -> Iterator[str]:
+        # pypdf and python-docx are imported on first use, so txt-only workers never load them
+        if file_type == "pdf":
+            import pypdf
             try:
-                # pypdf expects a file-like object or path. We need to wrap raw_content (bytes) in BytesIO.
-                from io import BytesIO
-                pdf_file = BytesIO(raw_content)
-                reader = pypdf.PdfReader(pdf_file)
+                reader = pypdf.PdfReader(source)
                 for page in reader.pages:
-                    text_content += page.extract_text() or ""
+                    yield page.extract_text() or ""
             except Exception as e:
                 print(f"Error extracting text from PDF: {e}")
-                text_content = ""
-        elif file_type == "docx":
+        else:
+            from docx import Document
             try:
-                # python-docx expects a file-like object or path. We need to wrap raw_content (bytes) in BytesIO.
-                from io import BytesIO
-                docx_file = BytesIO(raw_content)
-                document = Document(docx_file)
+                # python-docx parses the whole document body up front; paragraphs are still yielded one by one
+                document = Document(source)
                 for paragraph in document.paragraphs:
-                    text_content += paragraph.text + "\n"
+                    yield paragraph.text + "\n"
             except Exception as e:
                 print(f"Error extracting text from DOCX: {e}")
-                text_content = ""
-        else:
-            raise ValueError(f"Unsupported file type for text extraction: {file_type}")
-        return text_content
-
-    def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-        """Splits text into smaller chunks with optional overlap."""
-        if not text:
-            return []
-
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start += chunk_size - overlap
-            if start >= len(text) - overlap and end < len(text):
-                # Ensure the last chunk includes the end of the text
-                chunks.append(text[start:])
-                break
-        return chunks
 
+    def chunk_text(self, text: str, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[str]:
+        """Splits text into chunks of whole sentences that fit the token budget."""
+        return [chunk for chunk, _, _ in self.iter_chunks([text], max_tokens, overlap_tokens)]
+
+    def iter_chunks(self, pieces: Iterable[str], max_tokens: Optional[int] = None,
+                    overlap_tokens: Optional[int] = None) -> Iterator[Chunk]:
+        """Chunks a stream of text pieces in one pass, yielding (chunk, start, end) as chunks fill up.
+
+        Chunks are cut between sentences or paragraphs, hold at most max_tokens tokens and
+        start with the last sentences of the previous chunk, up to overlap_tokens. A sentence
+        longer than max_tokens is cut between words. start and end are character offsets of
+        the chunk in the whole text, so text[start:end] == chunk.
+        """
+        max_tokens = max_tokens or self.max_tokens
+        overlap_tokens = self.overlap_tokens if overlap_tokens is None else overlap_tokens
+        window = deque() # (segment, start, tokens) of the chunk being built
+        window_tokens = 0
+        fresh = False # Whether the window holds a segment that no emitted chunk contains
+        for segment, start, tokens in self._iter_bounded_segments(pieces, max_tokens):
+            if window_tokens + tokens > max_tokens:
+                if fresh:
+                    chunk = self._make_chunk(window)
+                    if chunk is not None:
+                        yield chunk
+                    fresh = False
+                while window and (window_tokens > overlap_tokens or window_tokens + tokens > max_tokens):
+                    window_tokens -= window.popleft()[2]
+            window.append((segment, start, tokens))
+            window_tokens += tokens
+            fresh = True
+        if fresh:
+            chunk = self._make_chunk(window)
+            if chunk is not None:
+                yield chunk
+
+    def _iter_bounded_segments(self, pieces: Iterable[str], max_tokens: int) -> Iterator[Tuple[str, int, int]]:
+        for segment, start in iter_segments(pieces):
+            tokens = self.count_tokens(segment)
+            if tokens <= max_tokens:
+                yield segment, start, tokens
+                continue
+            # A sentence longer than the budget is cut between words
+            part_start, part_tokens = 0, 0
+            for word in _WORD.finditer(segment):
+                word_tokens = self.count_tokens(word.group())
+                if part_tokens and part_tokens + word_tokens > max_tokens:
+                    yield segment[part_start:word.start()], start + part_start, part_tokens
+                    part_start, part_tokens = word.start(), 0
+                part_tokens += word_tokens
+            yield segment[part_start:], start + part_start, part_tokens
 
+    def _make_chunk(self, window: deque) -> Optional[Chunk]:
+        text = "".join(segment for segment, _, _ in window)
+        stripped = text.strip()
+        if not stripped:
+            return None
+        start = window[0][1] + len(text) - len(text.lstrip())
+        return stripped, start, start + len(stripped)
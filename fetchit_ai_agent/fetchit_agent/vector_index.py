@@ -1,161 +1,1316 @@
-
 import faiss
 import numpy as np
+import itertools
 import json
+import math
 import os
-from typing import List, Dict, Any
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
 
+from .concurrency import ReadWriteLock
+from .dedup import DEDUP_MODES, SIMHASH_BANDS, content_hash, hamming_distance, simhash, simhash_bands
 from .embedder import Embedder
+from .doc_store import DocumentStore, replace_file, save_rows
+from .lexical_index import LexicalIndex
+from .lru_cache import LRUCache
+from .wal import Entry, WriteAheadLog, fsync_directory
+
+# Shared by all indexes so a version is never reused, even after an index is reloaded from disk
+_versions = itertools.count(1)
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# Fewest vectors to train an index type on: FAISS wants about 39 points per centroid,
+# and ivf_pq learns 256 centroids per sub-quantizer
+MIN_TRAINING_VECTORS = {"flat": 0, "hnsw": 0, "ivf_flat": 39, "ivf_pq": 39 * 256}
+VECTOR_DTYPES = ("float32", "float16", "int8")
+# FAISS scalar quantizer per compact vector type; int8 learns each dimension's range from the vectors
+SCALAR_QUANTIZERS = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+MIN_INT8_TRAINING_VECTORS = 1000 # int8 indexes smaller than this use float16, as too few vectors give poor ranges
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+SEARCH_PARAMS = ("nprobe", "ef_search") # Accepted by configure() besides its named options
+RRF_K = 60 # Reciprocal rank fusion constant: a result at rank r contributes 1 / (RRF_K + r)
+FUSION_DEPTH = 4 # Hybrid search fuses the top top_k * FUSION_DEPTH hits of each ranking
+EXACT_FILTER_LIMIT = 4096 # Filters matching at most this many chunks are searched exactly, without FAISS
+CHECKPOINT_BYTES = 64 * 1024 * 1024 # Write-ahead log size that triggers a background checkpoint
+# A merge starts once the delta segment or the tombstones exceed both MERGE_MIN_CHUNKS and
+# MERGE_FRACTION of the main segment, so each vector is copied a bounded number of times
+MERGE_MIN_CHUNKS = 1024
+MERGE_FRACTION = 0.25
+# Bytes per entry of the duplicate lookups, Python dicts of ints and tuples (measured on CPython 3.11)
+HASH_ENTRY_BYTES = 120 # Content hash of a canonical chunk
+BAND_ENTRY_BYTES = 210 # One of the SIMHASH_BANDS bands a canonical chunk is filed under
+DUPLICATE_ENTRY_BYTES = 120 # A duplicate listed under its canonical chunk
 
 class VectorIndex:
-    def __init__(self, embedder: Embedder, index_path: str):
+    def __init__(self, embedder: Embedder, index_path: str, autosave_every: Optional[int] = 1, autosave_interval: Optional[float] = None,
+                 index_type: str = "flat", ann_threshold: Optional[int] = None, nprobe: int = 16, ef_search: int = 64, hnsw_m: int = 32,
+                 metric: str = "l2", dedup: Optional[str] = "exact", near_duplicate_bits: int = 3,
+                 lexical: bool = True, hybrid: bool = False, shortlist: Optional[int] = None, vector_dtype: str = "float32",
+                 checkpoint_bytes: Optional[int] = CHECKPOINT_BYTES):
+        """autosave_every is the number of changed chunks that triggers a save and autosave_interval
+           the number of seconds after which pending changes are saved, by a timer if no write comes.
+           Either can be None to disable that trigger; flush() always saves pending changes.
+
+           A save appends the changes made since the previous one to a write-ahead log, so it
+           costs as much as the changes, not the index. Once the log outgrows checkpoint_bytes a
+           checkpoint writes the whole index as a new generation of files in the background
+           and starts an empty log; None checkpoints on every save. Loading replays the log.
+
+           FAISS is split into segments. New vectors go to a small flat delta segment, and
+           removed chunks become tombstones that searches filter out, so neither rebuilds the
+           main segment, which holds everything else in index_type. Searches query both
+           segments and merge their top hits. Once the delta segment or the tombstones grow
+           large enough, a merge on a background thread builds a new main segment from the
+           stored vectors while searches and writes go on; see rebuild().
+
+           index_type is one of INDEX_TYPES. Approximate types start as a flat index and are
+           promoted, trained on the stored vectors, once the index holds ann_threshold chunks
+           (and enough to train on). nprobe (IVF) and ef_search (HNSW) trade recall for latency.
+
+           metric is "l2" or "ip" (inner product, i.e. cosine similarity for normalized embeddings)
+           and applies to new indexes; a saved index keeps the metric it was built with.
+
+           dedup is "exact", "near" or None. A chunk whose text duplicates an indexed chunk is
+           stored as a reference to it: it is not embedded or added to FAISS again, and search
+           results list every file the text occurs in. "near" also treats chunks whose SimHash
+           fingerprints differ in at most near_duplicate_bits bits as duplicates.
+
+           lexical keeps a BM25 index of the chunk texts next to the vectors. hybrid and shortlist
+           are the defaults for search: hybrid fuses BM25 and vector rankings, and shortlist
+           limits vector ranking to that many BM25 candidates (see search). Both need lexical.
+
+           vector_dtype "float16" or "int8" stores vectors compactly: FAISS holds them as float16
+           or 8-bit scalar-quantized codes (2x and 4x smaller than float32), and the stored copy
+           used for rebuilds and exact scoring is float16. ivf_pq compresses vectors already and
+           ignores it. A saved index is converted to the configured type when it is loaded.
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric: {metric}")
+        if dedup not in DEDUP_MODES:
+            raise ValueError(f"Unsupported dedup mode: {dedup}")
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {vector_dtype}")
         self.embedder = embedder
         self.index_path = index_path
-        self.index = None
-        self.documents: List[Dict[str, Any]] = [] # Stores {'content': str, 'metadata': dict}
+        self.index_type = index_type
+        self.metric = metric
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self.dedup = dedup
+        self.near_duplicate_bits = near_duplicate_bits
+        self.hybrid = hybrid
+        self.shortlist = shortlist
+        self.vector_dtype = vector_dtype
+        self.checkpoint_bytes = checkpoint_bytes
+        # Searches share the lock; adds, removes, rebuilds and saves take it exclusively
+        self.lock = ReadWriteLock()
+        self.built_index_type = "flat" # Type of self.index, which lags index_type until promotion
+        self.autosave_every = autosave_every
+        self.autosave_interval = autosave_interval
+        self.pending_changes = 0 # Chunks added or removed since the last save
+        self._batch_depth = 0
+        self._last_save = time.monotonic()
+        self._autosave_timer: Optional[threading.Timer] = None # Saves pending changes once autosave_interval expires
+        # The manifest (<index_path>.json) names the files of the current generation and is
+        # replaced last, so a crash during a checkpoint leaves the previous generation intact
+        self.generation = 0 # Of the last checkpoint; 0 before the first
+        self._manifest: Optional[Dict[str, Any]] = None # As last written or loaded
+        self.wal: Optional[WriteAheadLog] = None # Changes saved since the last checkpoint
+        self._log: List[Entry] = [] # Changes made since the last save, for the write-ahead log
+        self._checkpoint_due = False # Set by changes the log does not capture, e.g. a rebuild
+        self._background: Dict[str, threading.Thread] = {} # Running checkpoint and merge threads
+        self._background_lock = threading.Lock() # Guards _background
+        self._merge_lock = threading.Lock() # One merge at a time
+        self._checkpoint_lock = threading.Lock() # One checkpoint at a time
+        # While a checkpoint writes its files: the changes saved since its snapshot, which start its new
+        # log, and how many entries of _log its snapshot holds
+        self._checkpoint_log: Optional[List[Entry]] = None
+        self._checkpoint_mark = 0
+        self._closing = False
+        self.index = None # The main segment
+        self.delta = None # Flat segment of the chunks indexed since the last merge
+        self.tombstones = np.zeros(0, dtype="int64") # Sorted ids of removed chunks still in a segment
+        self.store = DocumentStore(index_path + ".store") # Chunk texts and metadata, ordered by chunk_id
+        self.lexical = LexicalIndex(index_path + ".bm25") if lexical else None # BM25 over canonical chunks
+        self._vector_blocks: List[np.ndarray] = [] # Embeddings, row-aligned with the store table (removed rows included)
+        self.file_records: Dict[str, Dict[str, Any]] = {} # file_path -> content hash, size and mtime at indexing time
+        self.next_chunk_id = 0
+        self.version = next(_versions) # Changes whenever the searchable content changes
+        # Built on first use: content hash -> canonical chunk_id, (band, value) -> [(chunk_id, simhash)]
+        # of canonical chunks, and canonical chunk_id -> chunk_ids of its duplicates
+        self._by_hash: Optional[Dict[int, int]] = None
+        self._by_band: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+        self._duplicates: Optional[Dict[int, List[int]]] = None
+        self._filter_cache = LRUCache(64) # (version, filters) -> chunks the filters let through
+        self._memory_bytes = 0 # Estimate refreshed by writers, read without the lock
         self.load_index()
 
     def load_index(self):
-        """Loads the FAISS index and documents from disk if they exist."""
-        if os.path.exists(self.index_path) and os.path.exists(self.index_path + ".docs"):
+        """Loads the FAISS index and documents from disk if they exist, then replays the changes
+           saved to the write-ahead log since. Chunk texts and vectors are memory-mapped rather
+           than read into memory.
+        """
+        with self.lock.write_locked():
+            self._load_index()
+            self._update_memory_bytes()
+        self._schedule_merge()
+
+    def _load_index(self):
+        manifest = self._read_manifest()
+        if manifest is not None:
             print(f"Loading index from {self.index_path}")
-            self.index = faiss.read_index(self.index_path)
-            with open(self.index_path + ".docs", "r") as f:
-                self.documents = json.load(f)
-            print(f"Loaded {len(self.documents)} documents.")
+            directory = os.path.dirname(self.index_path)
+            self.index = faiss.read_index(os.path.join(directory, manifest["faiss"]))
+            self.next_chunk_id = manifest["next_chunk_id"]
+            self.built_index_type = manifest["index_type"]
+            self.metric = manifest["metric"]
+            self.file_records = manifest["files"]
+            self.store.load(manifest["store"])
+            self._vector_blocks = [np.load(os.path.join(directory, manifest["vectors"]), mmap_mode="r")]
+            self.generation = manifest["generation"]
+            self._manifest = manifest
+            self._apply_search_params()
+            self._derive_segments()
+            self._load_lexical_index(manifest["lexical"])
+            self._remove_files(manifest.get("obsolete", [])) # Left behind if the last checkpoint was cut short after its commit
+            if manifest["wal"] is None:
+                self._checkpoint_due = True # Saved before write-ahead logs existed: the next save writes the current format
+            else:
+                self.wal = WriteAheadLog(os.path.join(directory, manifest["wal"]))
+                self._replay(self.wal.replay())
+            if self._vector_blocks[0].dtype != self._storage_dtype() or self._built_vector_dtype() != self._target_vector_dtype(): # Without merging the blocks
+                print(f"Converting index to {self.vector_dtype} vectors")
+                self._vector_blocks = [self._stored_vectors().astype(self._storage_dtype())]
+                self._rebuild(self.built_index_type)
+                self._checkpoint_due = True
+                self.pending_changes += 1 # Written in the new type on the next flush
+            print(f"Loaded {len(self.store)} documents.")
+        elif os.path.exists(self.index_path) and os.path.exists(self.index_path + ".docs"):
+            self._load_json_index()
         else:
             print("No existing index found, starting fresh.")
             # Initialize an empty index. Dimension will be set when first documents are added.
             self.index = None
-            self.documents = []
+            self._vector_blocks = []
+            self.file_records = {}
 
-    def save_index(self):
-        """Saves the FAISS index and documents to disk."""
-        if self.index is not None:
-            print(f"Saving index to {self.index_path}")
-            faiss.write_index(self.index, self.index_path)
-            with open(self.index_path + ".docs", "w") as f:
-                json.dump(self.documents, f)
-            print("Index saved.")
+    def _read_manifest(self) -> Optional[Dict[str, Any]]:
+        """Reads the manifest, filling in the fixed file names of indexes saved before generations existed."""
+        if not os.path.exists(self.index_path + ".json"):
+            return None
+        with open(self.index_path + ".json", "r") as f:
+            manifest = json.load(f)
+        if "generation" in manifest:
+            return manifest
+        if not (os.path.exists(self.index_path) and self.store.exists()):
+            return None
+        name = os.path.basename(self.index_path)
+        manifest.update({"generation": 0, "faiss": name, "vectors": name + ".vecs.npy", "lexical": None, "wal": None,
+                         "store": {"blob": name + ".store.bin", "table": name + ".store.idx.npy", "meta": name + ".store.meta.json"},
+                         "legacy": [name + ".bm25.json"]})
+        if os.path.exists(self.index_path + ".bm25.json"):
+            with open(self.index_path + ".bm25.json", "r") as f:
+                manifest["lexical"] = json.load(f)
+        return manifest
+
+    def _manifest_files(self, manifest: Dict[str, Any]) -> List[str]:
+        """The files a manifest refers to, relative to the index's directory."""
+        files = [manifest[key] for key in ("faiss", "vectors", "wal") if manifest.get(key)]
+        files += list(manifest.get("store", {}).values()) + manifest.get("legacy", [])
+        if manifest.get("lexical") is not None:
+            files += LexicalIndex.files(self.index_path + ".bm25", manifest["lexical"])
+        return files
+
+    def _remove_files(self, file_names: List[str]):
+        for file_name in file_names:
+            path = os.path.join(os.path.dirname(self.index_path), file_name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _replay(self, frames: List[List[Entry]]):
+        """Re-applies the changes saved to the write-ahead log, in order."""
+        if not frames:
+            return
+        pending_changes = self.pending_changes
+        self._batch_depth += 1 # They are on disk already: nothing to save
+        try:
+            for entries in frames:
+                for entry, vectors in entries:
+                    if entry["op"] == "add":
+                        ids = np.arange(entry["first_id"], entry["first_id"] + len(entry["texts"]), dtype="int64")
+                        self.next_chunk_id = max(self.next_chunk_id, int(ids[-1]) + 1)
+                        self._insert(ids, entry["texts"], entry["metadata"], vectors, entry["offsets"], entry["hashes"],
+                                     entry["fingerprints"], np.array(entry["canonical"], dtype="int64"))
+                    elif entry["op"] == "remove":
+                        self._remove_documents(entry["file_path"])
+                    elif entry["op"] == "file":
+                        self.file_records[entry["file_path"]] = entry["record"]
+        finally:
+            self._batch_depth -= 1
+        self._log = []
+        self.pending_changes = pending_changes
+        print(f"Replayed {sum(len(entries) for entries in frames)} logged changes from {self.wal.path}")
+
+    def _load_json_index(self):
+        """Loads an index saved by older versions, which kept every document in a JSON .docs file.
+           It is written in the current format on the next save.
+        """
+        print(f"Loading index from {self.index_path}")
+        self.index = faiss.read_index(self.index_path)
+        with open(self.index_path + ".docs", "r") as f:
+            saved = json.load(f)
+        # The oldest versions saved a bare list of documents
+        documents = saved["documents"] if isinstance(saved, dict) else saved
+        for doc in documents:
+            metadata = {key: value for key, value in doc["metadata"].items() if key != "chunk_id"}
+            self.store.add(np.array([doc["metadata"]["chunk_id"]]), [doc["content"]], metadata)
+        chunk_ids = self.store.chunk_ids()
+        self.next_chunk_id = int(chunk_ids.max()) + 1 if len(chunk_ids) else 0
+        self.metric = "l2"
+        if isinstance(saved, dict):
+            self.next_chunk_id = max(self.next_chunk_id, saved["next_chunk_id"])
+            self.built_index_type = saved.get("index_type", "flat")
+            self.metric = saved.get("metric", "l2")
+            self.file_records = saved.get("files", {})
+        if os.path.exists(self.index_path + ".vecs.npy"):
+            self._vector_blocks = [np.load(self.index_path + ".vecs.npy")]
         else:
-            print("No index to save.")
+            self._vector_blocks = [self._reconstruct_vectors(self.index)]
+        if not isinstance(self.index, faiss.IndexIDMap2):
+            # The oldest versions used row position as the chunk_id
+            self.index = self._build_index("flat", self._stored_vectors(), self._chunk_ids())
+        self._apply_search_params()
+        self._derive_segments()
+        self._load_lexical_index(None)
+        name = os.path.basename(self.index_path)
+        self._manifest = {"legacy": [name, name + ".vecs.npy", name + ".docs"]} # Replaced by the first checkpoint
+        self._checkpoint_due = True
+        self.pending_changes += 1 # Make the next flush write the current format
+        print(f"Loaded {len(self.store)} documents.")
+
+    def _derive_segments(self):
+        """Recovers the delta segment and tombstones of a loaded main segment from the store: live
+           chunks the main segment lacks go to the delta segment, and chunks it holds that are gone
+           are tombstones. Only the main segment is saved. Membership is worked out from the ids, so
+           only the delta segment's vectors are read from the memory-mapped matrix.
+        """
+        rows, ids = self._indexed_rows()
+        in_main = faiss.vector_to_array(self.index.id_map)
+        self.tombstones = np.setdiff1d(in_main, ids)
+        added = ~np.isin(ids, in_main)
+        self.delta = self._build_delta(self._stored_vectors()[rows[added]], ids[added])
+
+    def _load_lexical_index(self, state: Optional[Dict[str, Any]]):
+        if self.lexical is None:
+            return
+        if state is not None:
+            self.lexical.load(state)
+            return
+        # Saved before the BM25 index existed (or without it): index the stored texts once
+        table = self.store.table()
+        chunk_ids = table["chunk_id"][(table["canonical"] == table["chunk_id"]) & self.store.live()]
+        print(f"Building lexical index over {len(chunk_ids)} chunks")
+        for start in range(0, len(chunk_ids), 1024):
+            batch = chunk_ids[start:start + 1024]
+            self.lexical.add(batch, [self.store.get(chunk_id)["content"] for chunk_id in batch.tolist()])
+        self._checkpoint_due = True
+        self.pending_changes += 1
+
+    def _reconstruct_vectors(self, index) -> np.ndarray:
+        """Recovers the stored vectors of a flat index saved before vectors were kept separately."""
+        if not isinstance(index, faiss.IndexIDMap2):
+            return index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), dtype="float32")
+        rows = {int(chunk_id): row for row, chunk_id in enumerate(faiss.vector_to_array(index.id_map))}
+        vectors = index.index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), dtype="float32")
+        return vectors[[rows[chunk_id] for chunk_id in self._chunk_ids()]]
+
+    def _stored_vectors(self) -> np.ndarray:
+        """Returns all embeddings as one matrix, row-aligned with the store table. Rows of removed
+           chunks stay until the next checkpoint drops them together with their table rows.
+        """
+        if len(self._vector_blocks) > 1:
+            self._vector_blocks = [np.vstack(self._vector_blocks)]
+        return self._vector_blocks[0] if self._vector_blocks else np.zeros((0, self.index.d if self.index else 0), dtype=self._storage_dtype())
+
+    def _storage_dtype(self) -> str:
+        """dtype of the stored vectors: float16 unless vectors are kept at full precision."""
+        return "float32" if self.vector_dtype == "float32" else "float16"
+
+    def _target_vector_dtype(self, count: Optional[int] = None) -> str:
+        """How FAISS should hold count vectors (default: those indexed now)."""
+        if count is None:
+            count = self.ntotal
+        if self.vector_dtype == "int8" and count < MIN_INT8_TRAINING_VECTORS:
+            return "float16"
+        return self.vector_dtype
+
+    def _built_vector_dtype(self) -> str:
+        """How the current FAISS index holds its vectors."""
+        base = faiss.downcast_index(self.index.index)
+        if isinstance(base, faiss.IndexHNSW):
+            base = faiss.downcast_index(base.storage)
+        if isinstance(base, faiss.IndexIVFPQ):
+            return self.vector_dtype # Compressed either way
+        if not isinstance(base, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+            return "float32"
+        return "float16" if base.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "int8"
+
+    @property
+    def ntotal(self) -> int:
+        """Vectors searchable across the segments: those of canonical chunks, not of their duplicates."""
+        if self.index is None:
+            return 0
+        return self.index.ntotal + self.delta.ntotal - len(self.tombstones)
+
+    def _chunk_ids(self) -> np.ndarray:
+        """The chunk id of each row of the store table and the stored vectors, removed chunks included."""
+        return np.asarray(self.store.table()["chunk_id"], dtype="int64")
 
-    def add_documents(self, texts: List[str], metadata: Dict[str, Any]):
-        """Adds texts and their metadata to the index."""
+    def _indexed_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the rows (of the store table and the stored vectors) and chunk ids that belong in
+           FAISS: those of canonical chunks, not their duplicates. Reads no vectors.
+        """
+        ids = self._chunk_ids()
+        rows = np.flatnonzero((self.store.table()["canonical"] == ids) & self.store.live())
+        return rows, ids[rows]
+
+    def _indexed_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the vectors and chunk ids that belong in FAISS."""
+        rows, ids = self._indexed_rows()
+        vectors = self._stored_vectors()
+        if len(rows) == len(vectors):
+            return vectors, ids
+        return vectors[rows], ids
+
+    @property
+    def documents(self) -> List[Dict[str, Any]]:
+        """All chunks as {'content': str, 'metadata': dict}. Materializes every text, so avoid on large indexes."""
+        with self.lock.read_locked():
+            return [self.store.get(chunk_id) for chunk_id in self.store.chunk_ids().tolist()]
+
+    def _build_index(self, index_type: str, vectors: np.ndarray, ids: np.ndarray):
+        """Creates an ID-mapped FAISS index of the given type, trains it if needed and adds the vectors."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        dimension = vectors.shape[1]
+        metric = METRICS[self.metric]
+        quantizer_type = SCALAR_QUANTIZERS.get(self._target_vector_dtype(len(vectors)))
+        if index_type == "flat":
+            if quantizer_type is None:
+                base = faiss.IndexFlat(dimension, metric)
+            else:
+                base = faiss.IndexScalarQuantizer(dimension, quantizer_type, metric)
+        elif index_type == "hnsw":
+            if quantizer_type is None:
+                base = faiss.IndexHNSWFlat(dimension, self.hnsw_m, metric)
+            else:
+                base = faiss.IndexHNSWSQ(dimension, quantizer_type, self.hnsw_m, metric)
+        else:
+            # Roughly 4 * sqrt(n) lists, with enough vectors per list to train the centroids
+            nlist = max(1, min(int(4 * math.sqrt(len(vectors))), len(vectors) // 39))
+            quantizer = faiss.IndexFlat(dimension, metric)
+            if index_type == "ivf_pq":
+                sub_quantizers = max(m for m in range(1, max(1, min(64, dimension // 4)) + 1) if dimension % m == 0)
+                base = faiss.IndexIVFPQ(quantizer, dimension, nlist, sub_quantizers, 8, metric)
+            elif quantizer_type is None:
+                base = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+            else:
+                base = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, quantizer_type, metric)
+        if not base.is_trained:
+            base.train(vectors)
+        index = faiss.IndexIDMap2(base)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        return index
+
+    def _build_delta(self, vectors: np.ndarray, ids: np.ndarray):
+        """Creates a delta segment: flat, as it stays small, and float16 unless vectors are kept at full precision."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if self.vector_dtype == "float32":
+            base = faiss.IndexFlat(vectors.shape[1], METRICS[self.metric])
+        else:
+            base = faiss.IndexScalarQuantizer(vectors.shape[1], faiss.ScalarQuantizer.QT_fp16, METRICS[self.metric])
+        delta = faiss.IndexIDMap2(base)
+        if len(ids):
+            delta.add_with_ids(vectors, ids)
+        return delta
+
+    def _apply_search_params(self):
+        if self.index is None:
+            return
+        base = faiss.downcast_index(self.index.index)
+        if isinstance(base, faiss.IndexIVF):
+            base.nprobe = self.nprobe
+        elif isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch = self.ef_search
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Adjusts the recall/latency trade-off of IVF (nprobe) and HNSW (ef_search) indexes."""
+        with self.lock.write_locked():
+            if nprobe is not None:
+                self.nprobe = nprobe
+            if ef_search is not None:
+                self.ef_search = ef_search
+            self._apply_search_params()
+
+    def configure(self, index_type: Optional[str] = None, ann_threshold: Optional[int] = None, metric: Optional[str] = None,
+                  dedup: Optional[str] = "unchanged", near_duplicate_bits: Optional[int] = None, hybrid: Optional[bool] = None,
+                  shortlist: Optional[int] = None, vector_dtype: Optional[str] = None, **search_params):
+        """Changes the index type, promotion threshold, metric or vector dtype, rebuilding the index from the stored vectors if needed.
+           A new dedup mode applies to chunks added from now on. hybrid and shortlist (0 to turn
+           it off) change the search defaults.
+        """
+        unknown = [key for key in search_params if key not in SEARCH_PARAMS]
+        if unknown:
+            raise ValueError(f"Unsupported index option: {', '.join(unknown)}")
+        if index_type is not None and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        if metric is not None and metric not in METRICS:
+            raise ValueError(f"Unsupported metric: {metric}")
+        if dedup != "unchanged" and dedup not in DEDUP_MODES:
+            raise ValueError(f"Unsupported dedup mode: {dedup}")
+        if vector_dtype is not None and vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {vector_dtype}")
+        with self.lock.write_locked():
+            if dedup != "unchanged" and dedup != self.dedup:
+                self.dedup = dedup
+                self._by_hash = None # The lookups depend on the mode
+            if near_duplicate_bits is not None:
+                self.near_duplicate_bits = near_duplicate_bits
+            if (hybrid is not None and hybrid != self.hybrid) or (shortlist is not None and (shortlist or None) != self.shortlist):
+                self.hybrid = self.hybrid if hybrid is None else hybrid
+                self.shortlist = self.shortlist if shortlist is None else (shortlist or None)
+                self.version = next(_versions) # Searches now rank differently, so cached results are stale
+            if index_type is not None:
+                self.index_type = index_type
+            if ann_threshold is not None:
+                self.ann_threshold = ann_threshold
+            metric_changed = metric is not None and metric != self.metric
+            if metric_changed:
+                self.metric = metric
+            self.set_search_params(**search_params)
+            dtype_changed = vector_dtype is not None and vector_dtype != self.vector_dtype
+            if dtype_changed:
+                self.vector_dtype = vector_dtype
+                self._vector_blocks = [self._stored_vectors().astype(self._storage_dtype())]
+            needs_rebuild = self.index is not None and (metric_changed or dtype_changed or self._target_index_type() != self.built_index_type)
+            self._update_memory_bytes()
+        if needs_rebuild:
+            self.rebuild(self._target_index_type())
+
+    def _target_index_type(self) -> str:
+        required = max(self.ann_threshold or 0, MIN_TRAINING_VECTORS[self.index_type])
+        return self.index_type if self.ntotal >= required else "flat" # Duplicates are not in FAISS
+
+    def _needs_merge(self) -> bool:
+        """Whether the delta segment or the tombstones have outgrown the main segment, or enough
+           chunks are indexed now to promote it to index_type or to learn int8 ranges.
+        """
+        limit = max(MERGE_MIN_CHUNKS, MERGE_FRACTION * self.index.ntotal)
+        return (self.delta.ntotal > limit or len(self.tombstones) > limit
+                or (self.built_index_type == "flat" and self._target_index_type() != "flat")
+                or self._built_vector_dtype() != self._target_vector_dtype())
+
+    def rebuild(self, index_type: Optional[str] = None):
+        """Merges the segments: builds (and trains) a new main segment from the stored vectors of the
+           live chunks, without re-embedding anything, which drops the delta segment and the tombstoned
+           vectors. index_type defaults to the current type, or to the configured one once a flat
+           index has grown enough to be promoted.
+
+           The new segment is built while searches and writes keep using the current ones. Chunks
+           added or removed meanwhile become its delta segment and tombstones when it is swapped in.
+        """
+        with self._merge_lock:
+            with self.lock.read_locked():
+                if self.index is None:
+                    return
+                if index_type is None:
+                    index_type = self._target_index_type() if self.built_index_type == "flat" else self.built_index_type
+                settings = (self.metric, self.vector_dtype)
+                vectors, ids = self._indexed_vectors()
+            print(f"Building {index_type} index over {len(ids)} vectors")
+            new_index = self._build_index(index_type, vectors, ids)
+            with self.lock.write_locked():
+                if (self.metric, self.vector_dtype) != settings:
+                    return # Reconfigured meanwhile; configure() merges again with the new settings
+                live_rows, live_ids = self._indexed_rows()
+                added = ~np.isin(live_ids, ids)
+                self.index = new_index
+                self.delta = self._build_delta(self._stored_vectors()[live_rows[added]], live_ids[added])
+                self.tombstones = np.setdiff1d(ids, live_ids)
+                self.built_index_type = index_type
+                self._apply_search_params()
+                self.version = next(_versions)
+                self._checkpoint_due = True # The log records chunks, not how FAISS holds them
+                self._record_changes(1)
+                self._update_memory_bytes()
+
+    def _merge(self):
+        """Merges in the background, again as long as writes made during a merge leave the segments unbalanced."""
+        while True:
+            self.rebuild()
+            with self.lock.read_locked():
+                if self._closing or self.index is None or not self._needs_merge():
+                    return
+
+    def _schedule_merge(self):
+        """Starts a background merge if the segments need one. The public methods that change the
+           index call it once they have released the lock, and it does nothing inside a batch.
+        """
+        with self.lock.read_locked():
+            if self.index is None or self._batch_depth or not self._needs_merge():
+                return
+        self._in_background("merge", self._merge)
+
+    def _rebuild(self, index_type: str):
+        """Merges the segments synchronously, with the write lock held."""
+        vectors, ids = self._indexed_vectors()
+        print(f"Building {index_type} index over {len(ids)} vectors")
+        self.index = self._build_index(index_type, vectors, ids)
+        self.delta = self._build_delta(vectors[:0], ids[:0])
+        self.tombstones = np.zeros(0, dtype="int64")
+        self.built_index_type = index_type
+        self._apply_search_params()
+
+    def save_index(self, checkpoint: bool = False):
+        """Saves the changes made since the last save to the write-ahead log. With checkpoint,
+           or when there is no log yet, writes a checkpoint instead. Changes the log does not
+           capture, such as a merge, are written by a checkpoint in the background.
+        """
+        if checkpoint:
+            self.checkpoint()
+            return
+        with self.lock.write_locked():
+            if self.index is None:
+                print("No index to save.")
+                self._log = []
+            elif self.wal is None:
+                if not self._checkpoint_lock.acquire(blocking=False):
+                    return # Another thread is writing the first checkpoint; the changes stay pending
+                try:
+                    self._checkpoint()
+                finally:
+                    self._checkpoint_lock.release()
+            else:
+                if self._log:
+                    if self._checkpoint_log is not None:
+                        # The running checkpoint's snapshot predates these changes: its new log needs them too
+                        self._checkpoint_log += self._log[self._checkpoint_mark:]
+                        self._checkpoint_mark = 0
+                    self.wal.append(self._log)
+                    self._log = []
+                if self._checkpoint_due or self.checkpoint_bytes is None or self.wal.size > self.checkpoint_bytes:
+                    self._in_background("checkpoint", self.checkpoint)
+            self.pending_changes = 0
+            self._last_save = time.monotonic()
+
+    def checkpoint(self):
+        """Writes the whole index as a new generation of files and starts a new write-ahead log.
+           Searches and writes go on while the files are written. Call without holding the lock.
+        """
+        with self._checkpoint_lock:
+            # Again if a merge finished meanwhile, as its segment is not in the generation just written
+            while self._checkpoint() and self._checkpoint_due and not self._closing:
+                pass
+
+    def _checkpoint(self) -> bool:
+        """Takes a snapshot of the index under the read lock, writes the files of the next generation
+           from it without the lock, and commits them under the write lock by replacing the manifest.
+           Until then the previous manifest and the files it names are untouched; afterwards the
+           files only the previous generation used are deleted. Call with _checkpoint_lock held.
+           Returns whether there was an index to write.
+        """
+        with self.lock.read_locked():
+            if self.index is None:
+                return False
+            generation = self.generation + 1
+            main, vectors = self.index, self._stored_vectors() # Merges replace these rather than change them
+            store = self.store.snapshot()
+            lexical = self.lexical.snapshot() if self.lexical is not None else None
+            manifest = {"generation": generation, "next_chunk_id": self.next_chunk_id, "index_type": self.built_index_type,
+                        "metric": self.metric, "files": dict(self.file_records)}
+            # Only writers, which the read lock keeps out, use these
+            self._checkpoint_log, self._checkpoint_mark = [], len(self._log)
+            self._checkpoint_due = False
+        try:
+            print(f"Saving index to {self.index_path}")
+            # Files are replaced by rename, so memory-mapped readers of the old ones stay valid
+            faiss_path = f"{self.index_path}.{generation}"
+            replace_file(faiss_path, lambda f: f.write(faiss.serialize_index(main).tobytes()))
+            vectors_path = f"{self.index_path}.vecs.{generation}.npy"
+            replace_file(vectors_path, lambda f: save_rows(f, vectors, store["live"])) # Without the removed rows
+            store_files = self.store.write_snapshot(store, generation)
+            lexical_files = self.lexical.write_snapshot(lexical, generation) if lexical is not None else None
+            with self.lock.write_locked():
+                wal = WriteAheadLog(f"{self.index_path}.{generation}.wal")
+                wal.create()
+                if self._checkpoint_log:
+                    wal.append(self._checkpoint_log)
+                manifest.update({"faiss": os.path.basename(faiss_path), "vectors": os.path.basename(vectors_path),
+                                 "store": store_files["files"], "lexical": lexical_files["state"] if lexical_files else None,
+                                 "wal": os.path.basename(wal.path)})
+                obsolete = sorted(set(self._manifest_files(self._manifest or {})) - set(self._manifest_files(manifest)))
+                manifest["obsolete"] = obsolete
+                encoded = json.dumps(manifest).encode("utf-8")
+                replace_file(self.index_path + ".json", lambda f: f.write(encoded)) # The commit point
+                fsync_directory(os.path.dirname(self.index_path))
+                self.generation, self._manifest, self.wal = generation, manifest, wal
+                self._log = self._log[self._checkpoint_mark:] # The rest was made after the snapshot
+                self._checkpoint_log = None
+                if self.store.adopt(store, store_files):
+                    # The store switched to the table just written, without the removed rows: so do the vectors
+                    if len(self._vector_blocks) == 1 and self._vector_blocks[0] is vectors:
+                        self._vector_blocks = [np.load(vectors_path, mmap_mode="r")]
+                    else:
+                        self._vector_blocks = [self._stored_vectors()[store["live"]]] # Converted to another dtype meanwhile
+                if lexical is not None:
+                    self.lexical.adopt(lexical, lexical_files)
+                self._remove_files(obsolete)
+                self._update_memory_bytes()
+        except BaseException:
+            with self.lock.write_locked():
+                self._checkpoint_log = None
+                self._checkpoint_due = True
+            raise
+        print("Index saved.")
+        return True
+
+    def _in_background(self, name: str, task):
+        """Runs task on a background thread unless the last one started under name is still running.
+           The thread waits for the write lock the caller may hold.
+        """
+        with self._background_lock:
+            running = self._background.get(name)
+            if self._closing or (running is not None and running.is_alive()):
+                return
+            thread = threading.Thread(target=task, name=f"index-{name}", daemon=True)
+            self._background[name] = thread
+            thread.start()
+
+    def wait_for_background(self):
+        """Waits for background checkpoints and merges to finish. Call without holding the lock."""
+        while any(thread.is_alive() for thread in list(self._background.values())):
+            for thread in list(self._background.values()):
+                thread.join()
+
+    def flush(self):
+        """Saves the index if there are changes that have not been written to disk yet."""
+        with self.lock.write_locked():
+            if self.pending_changes:
+                self.save_index()
+
+    def close(self):
+        """Flushes pending changes and releases the memory-mapped document store.
+           Call at shutdown or when unloading the index; it must not be used afterwards.
+        """
+        with self.lock.write_locked():
+            self._closing = True
+            if self._autosave_timer is not None:
+                self._autosave_timer.cancel()
+                self._autosave_timer = None
+        self.wait_for_background()
+        with self.lock.write_locked():
+            self.flush()
+            self.store.close()
+
+    @property
+    def in_batch(self) -> bool:
+        return self._batch_depth > 0
+
+    def memory_bytes(self) -> int:
+        """Estimates the memory held by this index: FAISS index, stored vectors, document table,
+           duplicate lookups and cached filter masks. Writers refresh the estimate after each change,
+           so reading it takes no index lock and never waits for a write or merge.
+        """
+        return self._memory_bytes + sum(allowed.nbytes for allowed in self._filter_cache.values())
+
+    def _update_memory_bytes(self):
+        """Refreshes the estimate memory_bytes() returns. Call with the write lock held."""
+        vector_bytes = sum(block.nbytes for block in self._vector_blocks)
+        faiss_bytes = self.tombstones.nbytes
+        for segment in (self.index, self.delta):
+            if segment is None:
+                continue
+            base = faiss.downcast_index(segment.index)
+            if isinstance(base, faiss.IndexHNSW):
+                per_vector = base.storage.sa_code_size() + 2 * self.hnsw_m * 4 # Vector plus base-layer links
+            else:
+                per_vector = base.sa_code_size()
+            faiss_bytes += segment.ntotal * (per_vector + 16) # Plus the id maps of IndexIDMap2
+        lexical_bytes = self.lexical.memory_bytes() if self.lexical is not None else 0
+        lookup_bytes = 0
+        if self._by_hash is not None:
+            lookup_bytes += len(self._by_hash) * (HASH_ENTRY_BYTES + (SIMHASH_BANDS * BAND_ENTRY_BYTES if self.dedup == "near" else 0))
+        if self._duplicates is not None:
+            lookup_bytes += max(len(self.store) - self.ntotal, 0) * DUPLICATE_ENTRY_BYTES
+        self._memory_bytes = int(vector_bytes + faiss_bytes + self.store.memory_bytes() + lexical_bytes + lookup_bytes)
+
+    @contextmanager
+    def batch(self):
+        """Groups adds and removes into a single save when the outermost batch exits.
+           It does not hold the lock, so searches keep running while a batch is open.
+        """
+        with self.lock.write_locked():
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock.write_locked():
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self.flush()
+            self._schedule_merge()
+
+    def _record_changes(self, count: int):
+        """Counts changed chunks and saves once a size or time threshold is crossed. Call with the write lock held."""
+        self.pending_changes += count
+        if self._batch_depth:
+            return
+        if self.autosave_every is not None and self.pending_changes >= self.autosave_every:
+            self.save_index()
+        elif self.autosave_interval is not None and time.monotonic() - self._last_save >= self.autosave_interval:
+            self.save_index()
+        if self.pending_changes and self.autosave_interval is not None:
+            self._start_autosave_timer()
+
+    def _start_autosave_timer(self):
+        """Saves the pending changes when autosave_interval expires, even if the index goes idle. Call with the write lock held."""
+        if self._autosave_timer is not None or self._closing:
+            return
+        delay = max(0.0, self.autosave_interval - (time.monotonic() - self._last_save))
+        self._autosave_timer = threading.Timer(delay, self._autosave)
+        self._autosave_timer.daemon = True
+        self._autosave_timer.start()
+
+    def _autosave(self):
+        with self.lock.write_locked():
+            self._autosave_timer = None
+            if self._closing or self._batch_depth or not self.pending_changes:
+                return # Closing or the end of the batch saves them
+            if time.monotonic() - self._last_save < self.autosave_interval:
+                self._start_autosave_timer() # Saved meanwhile: wait a full interval for the changes since
+                return
+            self.save_index()
+
+    def add_documents(self, texts: List[str], metadata: Dict[str, Any], embeddings: Optional[np.ndarray] = None,
+                      offsets: Optional[List[Tuple[int, int]]] = None):
+        """Adds texts and their metadata to the index.
+           Precomputed embeddings (one row per text) can be passed to skip the embedder; otherwise
+           only texts that do not duplicate an indexed chunk are embedded.
+           offsets, the (start, end) of each text in its source document, are returned with
+           search results as the "start_offset" and "end_offset" metadata.
+        """
         if not texts:
             return
 
-        embeddings = self.embedder.embed(texts)
-        embeddings_np = np.array(embeddings).astype("float32")
+        hashes = [content_hash(text) for text in texts]
+        fingerprints = [simhash(text) for text in texts] if self.dedup == "near" else [0] * len(texts)
+        embedded = np.ones(len(texts), dtype=bool)
+        if embeddings is None:
+            with self.lock.read_locked():
+                existing, earlier = self._find_duplicates(hashes, fingerprints)
+            embedded = (existing < 0) & (earlier < 0)
+            embeddings_np = self._embed_rows(texts, embedded)
+        else:
+            embeddings_np = np.array(embeddings, dtype="float32") # A copy: rows of duplicates are overwritten below
+
+        # Embedding happens outside the lock; only the index update excludes searches
+        with self.lock.write_locked():
+            self._add_embeddings(texts, metadata, embeddings_np, offsets, hashes, fingerprints, embedded)
+            self._update_memory_bytes()
+        self._schedule_merge()
 
+    def _embed_rows(self, texts: List[str], rows: np.ndarray, embeddings: Optional[np.ndarray] = None) -> np.ndarray:
+        """Embeds the texts selected by rows into a matrix with one row per text (zeros elsewhere)."""
+        positions = np.flatnonzero(rows)
+        if not len(positions):
+            if embeddings is not None:
+                return embeddings
+            return np.zeros((len(texts), self.index.d), dtype="float32")
+        vectors = self.embedder.embed([texts[position] for position in positions])
+        if embeddings is None:
+            embeddings = np.zeros((len(texts), vectors.shape[1]), dtype="float32")
+        embeddings[positions] = vectors
+        return embeddings
+
+    def _add_embeddings(self, texts: List[str], metadata: Dict[str, Any], embeddings_np: np.ndarray,
+                        offsets: Optional[List[Tuple[int, int]]], hashes: List[int], fingerprints: List[int],
+                        embedded: np.ndarray):
         if self.index is None:
-            # Initialize FAISS index with the dimension of the first embedding
+            # Initialize FAISS index with the dimension of the first embedding.
+            # The ID map lets us address chunks by a stable chunk_id and remove them in place.
             dimension = embeddings_np.shape[1]
-            self.index = faiss.IndexFlatL2(dimension) # L2 distance for similarity
+            self.index = self._build_index("flat", np.zeros((0, dimension), dtype="float32"), np.zeros(0, dtype="int64"))
+            self.delta = self._build_delta(np.zeros((0, dimension), dtype="float32"), np.zeros(0, dtype="int64"))
+            self.built_index_type = "flat"
             print(f"Initialized FAISS index with dimension {dimension}")
 
-        # Add embeddings to the FAISS index
-        self.index.add(embeddings_np)
+        # Resolve duplicates again: the index may have changed since add_documents looked
+        existing, earlier = self._find_duplicates(hashes, fingerprints)
+        is_new = (existing < 0) & (earlier < 0)
+        if (is_new & ~embedded).any():
+            # A chunk this text duplicated was removed meanwhile, so it needs a vector of its own after all
+            embeddings_np = self._embed_rows(texts, is_new & ~embedded, embeddings_np)
+
+        ids = np.arange(self.next_chunk_id, self.next_chunk_id + len(texts), dtype="int64")
+        self.next_chunk_id += len(texts)
+
+        # Duplicates point at their canonical chunk and store a copy of its vector, keeping vectors
+        # row-aligned with the store, but only canonical chunks go into FAISS
+        canonical = np.where(existing >= 0, existing, ids)
+        within = np.flatnonzero(earlier >= 0)
+        canonical[within] = ids[earlier[within]]
+        embeddings_np[within] = embeddings_np[earlier[within]]
+        outside = np.flatnonzero(existing >= 0)
+        if len(outside):
+            rows = np.searchsorted(self._chunk_ids(), existing[outside])
+            embeddings_np[outside] = self._stored_vectors()[rows]
+
+        vectors = embeddings_np.astype(self._storage_dtype(), copy=False)
+        self._log.append(({"op": "add", "first_id": int(ids[0]), "texts": texts, "metadata": metadata, "offsets": offsets,
+                           "hashes": hashes, "fingerprints": fingerprints, "canonical": canonical.tolist()}, vectors))
+        self._insert(ids, texts, metadata, vectors, offsets, hashes, fingerprints, canonical)
+        self._record_changes(len(texts))
+
+    def _insert(self, ids: np.ndarray, texts: List[str], metadata: Dict[str, Any], vectors: np.ndarray,
+                offsets: Optional[List[Tuple[int, int]]], hashes: List[int], fingerprints: List[int], canonical: np.ndarray):
+        """Adds chunks whose ids, vectors and canonical chunks are settled, e.g. when replaying the log."""
+        is_new = canonical == ids
+        # New vectors go to the delta segment under their chunk ids
+        self.delta.add_with_ids(np.ascontiguousarray(vectors[is_new], dtype="float32"), ids[is_new])
+        self._vector_blocks.append(vectors)
+
+        # Store content and metadata; chunk ids are stable and never reused
+        self.store.add(ids, texts, metadata, offsets, hashes, fingerprints, canonical.tolist())
+        if self.lexical is not None:
+            self.lexical.add(ids[is_new], [texts[row] for row in np.flatnonzero(is_new).tolist()])
+        if self._by_hash is not None:
+            for row in range(len(texts)):
+                if is_new[row]:
+                    self._register_canonical(int(ids[row]), hashes[row], fingerprints[row])
+        if self._duplicates is not None:
+            for chunk_id, canonical_id in zip(ids[~is_new].tolist(), canonical[~is_new].tolist()):
+                self._duplicates.setdefault(canonical_id, []).append(chunk_id)
 
-        # Store content and metadata
-        for i, text in enumerate(texts):
-            doc_metadata = metadata.copy()
-            doc_metadata["chunk_id"] = len(self.documents) # Unique ID for this chunk
-            self.documents.append({"content": text, "metadata": doc_metadata})
-        
-        self.save_index()
+        self.version = next(_versions)
+
+    def _duplicate_lookups(self) -> Dict[int, int]:
+        """Returns the content hash lookup, building it and the SimHash bands from the store on first use."""
+        if self._by_hash is None:
+            table = self.store.table()
+            canonical = table[(table["canonical"] == table["chunk_id"]) & self.store.live()]
+            by_hash = dict(zip(canonical["content_hash"].tolist(), canonical["chunk_id"].tolist()))
+            by_band = {}
+            if self.dedup == "near":
+                for chunk_id, fingerprint in zip(canonical["chunk_id"].tolist(), canonical["simhash"].tolist()):
+                    if fingerprint:
+                        for key in simhash_bands(fingerprint):
+                            by_band.setdefault(key, []).append((chunk_id, fingerprint))
+            # add_documents may build these under the read lock concurrently; both are complete before _by_hash is set
+            self._by_band = by_band
+            self._by_hash = by_hash
+        return self._by_hash
+
+    def _duplicate_ids(self) -> Dict[int, List[int]]:
+        """Returns canonical chunk_id -> chunk_ids of its duplicates, building it from the store on first use."""
+        if self._duplicates is None:
+            table = self.store.table()
+            refs = table[(table["canonical"] != table["chunk_id"]) & self.store.live()]
+            duplicates = {}
+            for chunk_id, canonical_id in zip(refs["chunk_id"].tolist(), refs["canonical"].tolist()):
+                duplicates.setdefault(canonical_id, []).append(chunk_id)
+            self._duplicates = duplicates
+        return self._duplicates
+
+    def _register_canonical(self, chunk_id: int, text_hash: int, fingerprint: int):
+        self._by_hash.setdefault(text_hash, chunk_id)
+        if self.dedup == "near" and fingerprint:
+            for key in simhash_bands(fingerprint):
+                self._by_band.setdefault(key, []).append((chunk_id, fingerprint))
+
+    def _unregister_canonical(self, chunk_id: int, text_hash: int, fingerprint: int):
+        if self._by_hash.get(text_hash) == chunk_id:
+            del self._by_hash[text_hash]
+        if fingerprint:
+            for key in simhash_bands(fingerprint):
+                if key in self._by_band:
+                    self._by_band[key] = [entry for entry in self._by_band[key] if entry[0] != chunk_id]
+
+    def _near_match(self, fingerprint: int, by_band: Dict[Tuple[int, int], List[Tuple[int, int]]]) -> Optional[int]:
+        for key in simhash_bands(fingerprint):
+            for candidate, other in by_band.get(key, ()):
+                if hamming_distance(fingerprint, other) <= self.near_duplicate_bits:
+                    return candidate
+        return None
+
+    def _find_duplicates(self, hashes: List[int], fingerprints: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """For each new chunk, finds the canonical chunk it duplicates. Returns (existing, earlier):
+           the chunk_id of an indexed chunk, or the position of an earlier chunk in the same batch,
+           with -1 where there is none. Call with the lock held.
+        """
+        existing = np.full(len(hashes), -1, dtype="int64")
+        earlier = np.full(len(hashes), -1, dtype="int64")
+        if self.dedup is None:
+            return existing, earlier
+        near = self.dedup == "near"
+        by_hash = self._duplicate_lookups()
+        batch_hash: Dict[int, int] = {}
+        batch_band: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+        for row, (text_hash, fingerprint) in enumerate(zip(hashes, fingerprints)):
+            match = by_hash.get(text_hash)
+            if match is None and near and fingerprint:
+                match = self._near_match(fingerprint, self._by_band)
+            if match is not None:
+                existing[row] = match
+                continue
+            match = batch_hash.get(text_hash)
+            if match is None and near and fingerprint:
+                match = self._near_match(fingerprint, batch_band)
+            if match is not None:
+                earlier[row] = match
+                continue
+            batch_hash[text_hash] = row
+            if near and fingerprint:
+                for key in simhash_bands(fingerprint):
+                    batch_band.setdefault(key, []).append((row, fingerprint))
+        return existing, earlier
 
     def remove_documents(self, file_path: str):
         """Removes documents associated with a specific file_path from the index.
-           Note: FAISS IndexFlatL2 does not support direct removal. 
-           This is a placeholder for a more sophisticated re-indexing strategy.
-           For now, it will effectively rebuild the index without the specified file.
-        """
-        print(f"Attempting to remove documents for {file_path}. This will rebuild the index.")
-        new_documents = [doc for doc in self.documents if doc["metadata"].get("file_path") != file_path]
-        
-        # Rebuild the index from scratch with the remaining documents
-        self.index = None # Reset index
-        self.documents = [] # Reset documents
-        
-        if new_documents:
-            # Re-add documents that are not part of the removed file
-            all_texts = [doc["content"] for doc in new_documents]
-            all_metadata = [doc["metadata"] for doc in new_documents]
-            
-            # This is a simplified re-indexing. In a production system, you'd re-embed and re-add.
-            # For now, we'll just re-add the content and metadata, assuming embeddings can be regenerated.
-            # A more robust solution would involve storing embeddings or using a FAISS index that supports deletion.
-            
-            # For this basic implementation, we'll re-embed and re-add.
-            # This is inefficient for large indices but demonstrates the concept.
-            
-            # Let's just re-add the documents one by one to leverage the existing add_documents logic.
-            # This is still not ideal for performance but ensures correctness.
-            
-            # Re-thinking: The `add_documents` method expects a list of texts and *one* metadata dict.
-            # We need to iterate through `new_documents` and add them individually or in batches.
-            
-            # Let's make `add_documents` handle a list of (text, metadata) pairs for easier re-indexing.
-            # For now, let's just re-add them one by one.
-            
-            # This is a major simplification. Proper deletion in FAISS often involves ID mapping and re-indexing.
-            # For the scope of this project, we'll simulate by filtering and re-saving the document list.
-            # The FAISS index itself won't shrink, but search results will filter out removed files.
-            
-            # Let's update the `remove_documents` to just mark documents as inactive or rebuild the `documents` list.
-            # The actual FAISS index deletion is complex. For now, we'll rely on filtering at search time.
-            
-            # Re-thinking again: The simplest way to handle deletion with IndexFlatL2 is to rebuild the index.
-            # This is inefficient but correct for a basic implementation.
-            
-            # Let's just filter the `self.documents` list and then rebuild the FAISS index from scratch.
-            # This will be done by re-adding all remaining documents.
-            
-            # Reset index and documents
-            self.index = None
-            self.documents = []
-            
-            # Re-add all documents that are not part of the removed file
-            for doc in new_documents:
-                # This is inefficient as it re-embeds. A production system would store embeddings.
-                self.add_documents([doc["content"]], doc["metadata"])
-            
-            print(f"Rebuilt index with {len(self.documents)} documents.")
+           The stored vectors of the remaining chunks are reused, so nothing is
+           re-embedded and the index is saved at most once. Removed chunks become
+           tombstones in FAISS and marked rows in the store, so the cost is that of
+           the removed chunks; the next merge and checkpoint drop them for good.
+        """
+        with self.lock.write_locked():
+            self._remove_documents(file_path)
+            self._update_memory_bytes()
+        self._schedule_merge()
+
+    def _remove_documents(self, file_path: str):
+        self._log.append(({"op": "remove", "file_path": file_path}, None))
+        had_record = self.file_records.pop(file_path, None) is not None
+        removed = self.store.rows_for_file(file_path)
+        removed_ids = self._chunk_ids()[removed]
+        if not len(removed_ids):
+            if had_record:
+                self._record_changes(1)
+            return
+
+        in_segments = removed_ids[self.store.table()["canonical"][removed] == removed_ids] # Duplicates are not in FAISS
+        repointed, new_canonical = self._forget_removed(removed)
+        self.store.remove_rows(removed) # Their vectors stay, row-aligned, until the next checkpoint
+        if len(repointed):
+            self.store.set_canonical(repointed, new_canonical)
+        promoted = np.unique(new_canonical)
+        if self.lexical is not None:
+            self.lexical.remove(removed_ids)
+            self.lexical.add(promoted, [self.store.get(chunk_id)["content"] for chunk_id in promoted.tolist()])
+        # Removed vectors stay in their segment, hidden from searches, until the next merge drops them
+        self.tombstones = np.union1d(self.tombstones, in_segments)
+        if len(promoted):
+            rows = np.searchsorted(self._chunk_ids(), promoted)
+            self.delta.add_with_ids(np.ascontiguousarray(self._stored_vectors()[rows], dtype="float32"), promoted)
+        self.version = next(_versions)
+        print(f"Removed {len(removed_ids)} chunks for {file_path}, {len(self.store)} remaining.")
+        self._record_changes(len(removed_ids))
+
+    def _forget_removed(self, removed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Updates the duplicate lookups for the rows about to be removed (a mask over the store table).
+           A removed canonical chunk hands over to its first surviving duplicate, which the others then
+           point at. Returns the surviving chunk_ids that need a new canonical chunk and that chunk's id.
+        """
+        table = self.store.table()
+        by_hash = self._duplicate_lookups()
+        duplicates = self._duplicate_ids()
+        gone = set(table["chunk_id"][removed].tolist())
+        repointed, new_canonical = [], []
+        for record in table[removed]:
+            chunk_id, canonical_id = int(record["chunk_id"]), int(record["canonical"])
+            if chunk_id != canonical_id:
+                if canonical_id in duplicates:
+                    duplicates[canonical_id].remove(chunk_id)
+                    if not duplicates[canonical_id]:
+                        del duplicates[canonical_id]
+                continue
+            self._unregister_canonical(chunk_id, int(record["content_hash"]), int(record["simhash"]))
+            survivors = [ref for ref in duplicates.pop(chunk_id, []) if ref not in gone]
+            if not survivors:
+                continue
+            heir = survivors[0]
+            repointed += survivors
+            new_canonical += [heir] * len(survivors)
+            if len(survivors) > 1:
+                duplicates[heir] = survivors[1:]
+            heir_record = table[int(np.searchsorted(table["chunk_id"], heir))]
+            self._register_canonical(heir, int(heir_record["content_hash"]), int(heir_record["simhash"]))
+        return np.array(repointed, dtype="int64"), np.array(new_canonical, dtype="int64")
+
+    def get_file_record(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """Returns what was recorded about file_path when it was last indexed, if anything."""
+        return self.file_records.get(file_path)
+
+    def set_file_record(self, file_path: str, record: Dict[str, Any]):
+        """Records the content hash, size and modification time file_path was indexed at."""
+        with self.lock.write_locked():
+            previous = self.file_records.get(file_path)
+            self.file_records[file_path] = record
+            self._log.append(({"op": "file", "file_path": file_path, "record": record}, None))
+            if previous is not None and previous.get("last_modified") != record.get("last_modified"):
+                self.version = next(_versions) # Results of "modified_after" filters may change
+            self._record_changes(1)
+
+    def _similarities(self, distances: np.ndarray) -> np.ndarray:
+        """Converts FAISS distances to similarities in [-1, 1] (cosine for normalized embeddings)."""
+        if self.metric == "ip":
+            similarities = distances
         else:
-            print("No documents remaining after removal. Index will be empty.")
-            self.index = None # Ensure index is truly empty
-            self.documents = []
-            self.save_index() # Save empty state
-
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Performs a semantic search and returns top_k relevant documents."""
-        if self.index is None or not self.documents:
-            return []
+            similarities = 1.0 - distances / 2.0 # FAISS reports squared L2 distance: |a - b|^2 = 2 - 2cos
+        return np.clip(similarities, -1.0, 1.0)
+
+    def search(self, query: str, top_k: int = 5, min_score: Optional[float] = None, hybrid: Optional[bool] = None,
+               shortlist: Optional[int] = None, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Performs a semantic search and returns up to top_k relevant documents, best first.
+           Each result carries the raw FAISS "distance" and a comparable "score" in [-1, 1];
+           results scoring below min_score are dropped.
 
-        query_embedding = np.array(self.embedder.embed([query])).astype("float32")
-        
-        # Ensure query_embedding has the same dimension as the index
-        if query_embedding.shape[1] != self.index.d:
-            print(f"Warning: Query embedding dimension ({query_embedding.shape[1]}) does not match index dimension ({self.index.d}). Cannot search.")
+           hybrid fuses the vector ranking with a BM25 ranking by reciprocal rank fusion, so exact
+           identifiers and rare terms are found; fused results also carry their "fusion_score".
+           shortlist ranks only the shortlist best BM25 matches by vector similarity instead of
+           searching the whole FAISS index. Both default to the index settings.
+
+           filters restricts the search to chunks whose file matches all of the given conditions:
+           "file_type" or "file_path" (a value or a list of values), "path_prefix", "modified_after"
+           (a timestamp compared with the file's recorded last_modified) or any other metadata key.
+           They are applied inside FAISS, so a filtered search returns top_k matching results.
+        """
+        if self.index is None or not len(self.store):
             return []
 
-        distances, indices = self.index.search(query_embedding, top_k)
+        query_embedding = self.embedder.embed_query(query)[np.newaxis]
+        hybrid = self.hybrid if hybrid is None else hybrid
+        shortlist = self.shortlist if shortlist is None else shortlist
+        with self.lock.read_locked():
+            return self._search(query_embedding, top_k, min_score, [query], hybrid, shortlist, filters)[0]
 
+    def search_batch(self, queries: List[str], top_k: int = 5, min_score: Optional[float] = None, hybrid: Optional[bool] = None,
+                     shortlist: Optional[int] = None, filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Searches for several queries at once and returns one result list (as from search) per query.
+           The queries are embedded together and run through a single FAISS search.
+        """
+        if self.index is None or not len(self.store) or not queries:
+            return [[] for _ in queries]
+
+        query_embeddings = self.embedder.embed_queries(queries)
+        hybrid = self.hybrid if hybrid is None else hybrid
+        shortlist = self.shortlist if shortlist is None else shortlist
+        with self.lock.read_locked():
+            return self._search(query_embeddings, top_k, min_score, queries, hybrid, shortlist, filters)
+
+    def _search(self, query_embeddings: np.ndarray, top_k: int, min_score: Optional[float], queries: Optional[List[str]] = None,
+                hybrid: bool = False, shortlist: Optional[int] = None,
+                filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        if self.index is None:
+            return [[] for _ in range(len(query_embeddings))]
+        # Ensure query_embeddings have the same dimension as the index
+        if query_embeddings.shape[1] != self.index.d:
+            print(f"Warning: Query embedding dimension ({query_embeddings.shape[1]}) does not match index dimension ({self.index.d}). Cannot search.")
+            return [[] for _ in range(len(query_embeddings))]
+
+        allowed = self._filter_mask(filters) if filters else None
+        if allowed is not None and not allowed.any():
+            return [[] for _ in range(len(query_embeddings))]
+        fusion = None
+        if queries is not None and self.lexical is not None and (hybrid or shortlist):
+            distances, ids, fusion = self._lexical_search(query_embeddings, queries, top_k, hybrid, shortlist, allowed)
+        else:
+            distances, ids = self._vector_search(query_embeddings, top_k, allowed)
+        scores = self._similarities(distances)
+        keep = ids >= 0 # FAISS pads with -1 when there are fewer than top_k hits
+        if min_score is not None:
+            keep &= scores >= min_score
+
+        # Each distinct hit is materialized once, even if several queries found it
+        docs = {chunk_id: self.store.get(chunk_id) for chunk_id in np.unique(ids[keep]).tolist()}
+        duplicates = self._duplicate_ids()
+        for chunk_id, doc in docs.items():
+            if doc is not None:
+                # Duplicates are not in FAISS, so a hit stands for every file its text occurs in
+                file_paths = [doc["metadata"].get("file_path")] + self.store.file_paths_of(duplicates.get(chunk_id, []))
+                doc["metadata"]["file_paths"] = list(dict.fromkeys(file_paths))
         results = []
-        for i, doc_idx in enumerate(indices[0]):
-            if doc_idx < len(self.documents):
-                doc = self.documents[doc_idx]
-                results.append({
+        for row in range(len(ids)):
+            hits = []
+            for column in np.flatnonzero(keep[row]).tolist():
+                doc = docs[int(ids[row, column])]
+                if doc is None:
+                    continue
+                hit = {
                     "content": doc["content"],
-                    "metadata": doc["metadata"],
-                    "distance": distances[0][i]
-                })
+                    "metadata": dict(doc["metadata"]),
+                    "distance": distances[row, column],
+                    "score": float(scores[row, column])
+                }
+                if fusion is not None:
+                    hit["fusion_score"] = float(fusion[row, column])
+                hits.append(hit)
+            results.append(hits)
         return results
 
-    def list_indexed_files(self) -> List[str]:
-        """Returns a list of unique file paths currently in the index."""
-        return list(set([doc["metadata"]["file_path"] for doc in self.documents if "file_path" in doc["metadata"]]))
+    def _lexical_search(self, query_embeddings: np.ndarray, queries: List[str], top_k: int, hybrid: bool,
+                        shortlist: Optional[int], allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """Ranks with the help of the BM25 index. Returns FAISS-style (distances, ids) matrices padded
+           with -1 ids, plus the reciprocal rank fusion scores if hybrid. With shortlist, queries with
+           enough lexical matches rank just those by vector; only the others are searched in FAISS.
+        """
+        depth = top_k * FUSION_DEPTH if hybrid else top_k
+        rankings: List[Optional[Tuple[np.ndarray, np.ndarray]]] = [None] * len(queries) # Per query: vector ids and distances
+        if shortlist:
+            for row, query in enumerate(queries):
+                candidates, _ = self.lexical.search(query, shortlist, allowed)
+                if len(candidates) >= top_k:
+                    candidate_distances = self._exact_distances(query_embeddings[row], candidates)
+                    order = np.argsort(candidate_distances if self.metric == "l2" else -candidate_distances, kind="stable")[:depth]
+                    rankings[row] = (candidates[order], candidate_distances[order])
+        unranked = [row for row, ranking in enumerate(rankings) if ranking is None]
+        if unranked:
+            distances, ids = self._vector_search(query_embeddings[unranked], depth, allowed)
+            for row, row_distances, row_ids in zip(unranked, distances, ids):
+                rankings[row] = (row_ids[row_ids >= 0], row_distances[row_ids >= 0])
+        out_distances = np.zeros((len(queries), top_k), dtype="float32")
+        out_ids = np.full((len(queries), top_k), -1, dtype="int64")
+        out_fusion = np.zeros((len(queries), top_k), dtype="float32") if hybrid else None
+        for row, query in enumerate(queries):
+            vector_ids, vector_distances = rankings[row]
+            if hybrid:
+                lexical_ids, _ = self.lexical.search(query, depth, allowed)
+                fused: Dict[int, float] = {}
+                for ranking in (vector_ids.tolist(), lexical_ids.tolist()):
+                    for rank, chunk_id in enumerate(ranking):
+                        fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+                best = sorted(fused, key=lambda chunk_id: -fused[chunk_id])[:top_k]
+                known = dict(zip(vector_ids.tolist(), vector_distances.tolist()))
+                missing = np.array([chunk_id for chunk_id in best if chunk_id not in known], dtype="int64")
+                known.update(zip(missing.tolist(), self._exact_distances(query_embeddings[row], missing).tolist()))
+                out_ids[row, :len(best)] = best
+                out_distances[row, :len(best)] = [known[chunk_id] for chunk_id in best]
+                out_fusion[row, :len(best)] = [fused[chunk_id] for chunk_id in best]
+            else:
+                out_ids[row, :len(vector_ids[:top_k])] = vector_ids[:top_k]
+                out_distances[row, :len(vector_ids[:top_k])] = vector_distances[:top_k]
+        return out_distances, out_ids, out_fusion
+
+    def _vector_search(self, query_embeddings: np.ndarray, top_k: int, allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """FAISS search restricted to the chunk ids set in allowed (a boolean array over chunk ids), if given.
+           allowed never includes removed chunks; without it, tombstones are filtered out.
+        """
+        if allowed is None:
+            if not len(self.tombstones):
+                return self._search_segments(query_embeddings, top_k, None)
+            tombstones = self.tombstones # Referenced by the selector during the search
+            removed = faiss.IDSelectorBatch(len(tombstones), faiss.swig_ptr(tombstones))
+            return self._search_segments(query_embeddings, top_k, faiss.IDSelectorNot(removed))
+        candidates = np.flatnonzero(allowed)
+        if len(candidates) <= EXACT_FILTER_LIMIT:
+            # Few enough to compare against directly, which is exact and cheaper than a filtered graph or list walk
+            distances = np.zeros((len(query_embeddings), top_k), dtype="float32")
+            ids = np.full((len(query_embeddings), top_k), -1, dtype="int64")
+            for row, query_embedding in enumerate(query_embeddings):
+                candidate_distances = self._exact_distances(query_embedding, candidates)
+                order = np.argsort(candidate_distances if self.metric == "l2" else -candidate_distances, kind="stable")[:top_k]
+                distances[row, :len(order)], ids[row, :len(order)] = candidate_distances[order], candidates[order]
+            return distances, ids
+        bitmap = np.packbits(allowed, bitorder="little") # The layout faiss.IDSelectorBitmap reads
+        return self._search_segments(query_embeddings, top_k, faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(bitmap)))
 
+    def _search_segments(self, query_embeddings: np.ndarray, top_k: int, selector) -> Tuple[np.ndarray, np.ndarray]:
+        """Searches every segment, skipping ids the selector rejects, and merges their hits into
+           FAISS-style (distances, ids) matrices of the top_k best, padded with -1 ids.
+        """
+        hits = []
+        for segment in (self.index, self.delta):
+            if not segment.ntotal:
+                continue
+            if selector is None:
+                hits.append(segment.search(query_embeddings, top_k))
+                continue
+            base = faiss.downcast_index(segment.index)
+            if isinstance(base, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+            elif isinstance(base, faiss.IndexHNSW):
+                params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            hits.append(segment.search(query_embeddings, top_k, params=params))
+        if not hits:
+            return np.zeros((len(query_embeddings), top_k), dtype="float32"), np.full((len(query_embeddings), top_k), -1, dtype="int64")
+        if len(hits) == 1:
+            return hits[0]
+        distances = np.hstack([segment_distances for segment_distances, _ in hits])
+        ids = np.hstack([segment_ids for _, segment_ids in hits])
+        ranking = np.where(ids < 0, np.inf, distances if self.metric == "l2" else -distances)
+        best = np.argsort(ranking, axis=1, kind="stable")[:, :top_k]
+        return np.take_along_axis(distances, best, axis=1), np.take_along_axis(ids, best, axis=1)
+
+    def _filter_mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Returns a boolean array over chunk ids marking the indexed chunks that match filters.
+           Filters are evaluated once per file (interned metadata) and cached until the index changes.
+        """
+        key = (self.version, json.dumps(filters, sort_keys=True, default=list))
+        allowed = self._filter_cache.get(key)
+        if allowed is None:
+            # The trailing False is what the meta_id of removed rows, -1, picks
+            matching = np.array([self._matches(metadata, filters) for metadata in self.store.metadata] + [False])
+            table = self.store.table()
+            allowed = np.zeros(self.next_chunk_id, dtype=bool)
+            # A duplicate that matches makes its canonical chunk, which stands in for it in FAISS, eligible
+            allowed[table["canonical"][matching[table["meta_id"]]]] = True
+            self._filter_cache.put(key, allowed)
+        return allowed
+
+    def _matches(self, metadata: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+        for key, expected in filters.items():
+            if key == "path_prefix":
+                matched = metadata.get("file_path", "").startswith(expected)
+            elif key == "modified_after":
+                record = self.file_records.get(metadata.get("file_path"))
+                modified = record.get("last_modified") if record else None
+                matched = modified is not None and modified > expected
+            elif isinstance(expected, (list, tuple, set)):
+                matched = metadata.get(key) in expected
+            else:
+                matched = metadata.get(key) == expected
+            if not matched:
+                return False
+        return True
 
+    def _exact_distances(self, query_embedding: np.ndarray, chunk_ids: np.ndarray) -> np.ndarray:
+        """Computes FAISS-style distances between a query and stored vectors, without the FAISS index."""
+        if not len(chunk_ids):
+            return np.zeros(0, dtype="float32")
+        vectors = self._stored_vectors()[np.searchsorted(self._chunk_ids(), chunk_ids)].astype("float32", copy=False)
+        if self.metric == "ip":
+            return vectors @ query_embedding
+        return ((vectors - query_embedding) ** 2).sum(axis=1)
 
+    def get_vectors(self, chunk_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the stored embeddings of the given chunks (e.g. search hits' "chunk_id"), without
+           re-embedding them, plus a boolean array telling which chunks are still stored.
+           Chunks that are gone are left out of the vectors.
+        """
+        with self.lock.read_locked():
+            stored = self._chunk_ids()
+            chunk_ids = np.asarray(chunk_ids, dtype="int64")
+            rows = np.minimum(np.searchsorted(stored, chunk_ids), max(len(stored) - 1, 0))
+            found = (stored[rows] == chunk_ids) & self.store.live()[rows] if len(stored) else np.zeros(len(chunk_ids), dtype=bool)
+            return np.array(self._stored_vectors()[rows[found]], dtype="float32"), found
+
+    def list_indexed_files(self) -> List[str]:
+        """Returns a list of unique file paths currently in the index."""
+        with self.lock.read_locked():
+            return self.store.file_paths()
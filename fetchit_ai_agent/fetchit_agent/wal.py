@@ -0,0 +1,99 @@
+import json
+import os
+import struct
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# A frame is the length and CRC-32 of its payload followed by the payload: a JSON list of
+# entries (preceded by its length) and then the raw bytes of the arrays the entries describe
+FRAME_HEADER = struct.Struct("<QI")
+JSON_LENGTH = struct.Struct("<I")
+
+Entry = Tuple[Dict[str, Any], Optional[np.ndarray]]
+
+def fsync_directory(path: str):
+    """Makes new files and renames in the directory path durable. A no-op on platforms
+       where directories cannot be opened (Windows).
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path or ".", os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class WriteAheadLog:
+    """An append-only log of the changes made to an index since its last checkpoint.
+
+    append() writes one frame holding a list of entries, each a JSON-serializable dict with an
+    optional array, and fsyncs it. A crash in the middle of an append leaves a frame that is
+    incomplete or fails its checksum; replay() stops there and truncates the file, so a frame
+    is either replayed whole or not at all.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+
+    def create(self):
+        """Starts an empty log, replacing anything left at path."""
+        with open(self.path, "wb") as f:
+            os.fsync(f.fileno())
+        self.size = 0
+
+    def append(self, entries: List[Entry]):
+        headers, arrays, offset = [], [], 0
+        for header, array in entries:
+            header = dict(header)
+            if array is not None:
+                array = np.ascontiguousarray(array)
+                header["array"] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+                arrays.append(array)
+                offset += array.nbytes
+            headers.append(header)
+        encoded = json.dumps(headers).encode("utf-8")
+        payload = b"".join([JSON_LENGTH.pack(len(encoded)), encoded] + [array.tobytes() for array in arrays])
+        with open(self.path, "ab") as f:
+            f.write(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.size += FRAME_HEADER.size + len(payload)
+
+    def replay(self) -> List[List[Entry]]:
+        """Returns the entries of every complete frame, oldest first, and drops any torn frame at the end."""
+        if not os.path.exists(self.path):
+            self.size = 0
+            return []
+        with open(self.path, "rb") as f:
+            data = f.read()
+        frames, position = [], 0
+        while position + FRAME_HEADER.size <= len(data):
+            length, checksum = FRAME_HEADER.unpack_from(data, position)
+            payload = data[position + FRAME_HEADER.size:position + FRAME_HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            frames.append(self._decode(payload))
+            position += FRAME_HEADER.size + length
+        if position < len(data):
+            print(f"Discarding {len(data) - position} bytes of an incomplete write at the end of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(position)
+                os.fsync(f.fileno())
+        self.size = position
+        return frames
+
+    @staticmethod
+    def _decode(payload: bytes) -> List[Entry]:
+        (json_length,) = JSON_LENGTH.unpack_from(payload, 0)
+        start = JSON_LENGTH.size + json_length
+        entries = []
+        for header in json.loads(payload[JSON_LENGTH.size:start].decode("utf-8")):
+            array = None
+            if "array" in header:
+                spec = header.pop("array")
+                count = int(np.prod(spec["shape"]))
+                array = np.frombuffer(payload, dtype=spec["dtype"], count=count, offset=start + spec["offset"]).reshape(spec["shape"])
+            entries.append((header, array))
+        return entries
@@ -1,8 +1,18 @@
 
+import gc
 import os
+import subprocess
+import sys
+import threading
+import time
+import weakref
+import numpy as np
 import pytest
+from fetchit_agent import agent as agent_module
+from fetchit_agent import vector_index as vector_index_module
 from fetchit_agent.agent import FetchItAgent
 from fetchit_agent.connector_interface import LocalFileConnector
+from fetchit_agent.index_cache import IndexCache
 
 # Setup a temporary data directory for tests
 @pytest.fixture(scope="module")
@@ -94,6 +104,593 @@ def test_remove_file(fetchit_agent, local_connector, dummy_files):
     results = fetchit_agent.search_files(user_id, "AI machine learning")
     assert len(results) == 0
 
+def test_remove_file_does_not_reembed(fetchit_agent, local_connector, dummy_files, monkeypatch):
+    user_id = "test_user_6"
+    fetchit_agent.index_file(user_id, dummy_files["file1"], "txt", local_connector)
+    fetchit_agent.index_file(user_id, dummy_files["file2"], "txt", local_connector)
+    index = fetchit_agent._get_vector_index(user_id)
+    surviving_ids = [doc["metadata"]["chunk_id"] for doc in index.documents if doc["metadata"]["file_path"] == dummy_files["file2"]]
+
+    embed_calls = []
+    original_encode = fetchit_agent.embedder.backend.encode
+    monkeypatch.setattr(fetchit_agent.embedder.backend, "encode", lambda texts, batch_size=32: embed_calls.append(texts) or original_encode(texts, batch_size))
+
+    fetchit_agent.remove_file(user_id, dummy_files["file1"])
+    assert embed_calls == []
+    # Surviving chunks keep their ids and stay searchable
+    assert [doc["metadata"]["chunk_id"] for doc in index.documents] == surviving_ids
+    assert index.ntotal == len(surviving_ids)
+    results = fetchit_agent.search_files(user_id, "natural language processing")
+    assert results[0]["metadata"]["file_path"] == dummy_files["file2"]
+
+def test_duplicate_chunks_share_one_vector(fetchit_agent, local_connector, dummy_files, tmp_path):
+    user_id = "test_user_18"
+    copy = tmp_path / "copy_of_doc1.txt"
+    copy.write_text(open(dummy_files["file1"]).read())
+    fetchit_agent.index_file(user_id, dummy_files["file1"], "txt", local_connector)
+    fetchit_agent.index_file(user_id, str(copy), "txt", local_connector)
+    index = fetchit_agent._get_vector_index(user_id)
+    assert len(index.store) == 2 and index.ntotal == 1
+
+    results = fetchit_agent.search_files(user_id, "AI machine learning")
+    assert len(results) == 1 # The copy does not crowd out other results
+    assert sorted(results[0]["metadata"]["file_paths"]) == sorted([dummy_files["file1"], str(copy)])
+    assert sorted(fetchit_agent.answer_question(user_id, "Tell me about AI.")["source_files"]) == sorted([dummy_files["file1"], str(copy)])
+
+    # The copy takes over the shared vector when the original goes away
+    fetchit_agent.remove_file(user_id, dummy_files["file1"])
+    assert index.ntotal == 1
+    results = fetchit_agent.search_files(user_id, "AI machine learning")
+    assert results[0]["metadata"]["file_paths"] == [str(copy)]
+    index.save_index()
+    reloaded = fetchit_agent._load_vector_index(user_id)
+    assert reloaded.search("AI machine learning")[0]["metadata"]["file_paths"] == [str(copy)]
+
+def test_load_reads_only_delta_vectors(fetchit_agent, monkeypatch):
+    user_id = "test_user_18b"
+    index = fetchit_agent._get_vector_index(user_id)
+    index.add_documents(["Shared onboarding checklist.", "Security training schedule."], {"file_path": "a.txt"})
+    index.add_documents(["Shared onboarding checklist."], {"file_path": "b.txt"}) # A duplicate: only in the store
+    index.checkpoint()
+    index.add_documents(["Parking permits renew in May."], {"file_path": "c.txt"}) # Only in the write-ahead log
+    index.flush()
+
+    monkeypatch.setattr(vector_index_module.VectorIndex, "_indexed_vectors", lambda self: pytest.fail("expected no full vector read"))
+    reloaded = fetchit_agent._load_vector_index(user_id)
+    monkeypatch.undo()
+    assert reloaded.ntotal == 3 and len(reloaded.store) == 4
+    assert isinstance(reloaded._vector_blocks[0], np.memmap) # Still mapped, not copied in
+    assert reloaded.search("parking permits", top_k=1)[0]["metadata"]["file_path"] == "c.txt"
+
+def test_near_duplicate_chunks(fetchit_agent, local_connector, tmp_path):
+    user_id = "test_user_19"
+    text = "The quarterly report covers revenue growth in all regions and the updated travel policy."
+    fetchit_agent.configure_index(user_id, dedup="near")
+    index = fetchit_agent._get_vector_index(user_id)
+    index.add_documents([text], {"file_path": "a.txt"})
+    index.add_documents([text.upper().rstrip(".") + "!", "Gardening tomatoes in a small backyard."], {"file_path": "b.txt"})
+    assert len(index.store) == 3 and index.ntotal == 2
+    results = index.search(text, top_k=3)
+    assert sorted(results[0]["metadata"]["file_paths"]) == ["a.txt", "b.txt"]
+
+    # The duplicate lookups and cached filter masks count towards the index's memory
+    with index.lock.write_locked():
+        index._update_memory_bytes() # The search built the duplicates map, counted from the next write on
+        with_lookups = index.memory_bytes()
+        by_hash, index._by_hash = index._by_hash, None
+        index._update_memory_bytes()
+        assert with_lookups - index.memory_bytes() == 2 * (vector_index_module.HASH_ENTRY_BYTES + 4 * vector_index_module.BAND_ENTRY_BYTES)
+        index._by_hash = by_hash
+        index._update_memory_bytes()
+    before = index.memory_bytes()
+    index.search(text, top_k=3, filters={"file_path": "a.txt"})
+    assert index.memory_bytes() == before + index.next_chunk_id
+
+def test_hybrid_search_finds_exact_identifiers(fetchit_agent, tmp_path, monkeypatch):
+    user_id = "test_user_20"
+    index = fetchit_agent._get_vector_index(user_id)
+    for number in range(30):
+        index.add_documents([f"Meeting notes number {number} about the roadmap."], {"file_path": f"notes{number}.txt"})
+    index.add_documents(["Incident ZX4471 was caused by an expired certificate."], {"file_path": "incident.txt"})
+
+    results = fetchit_agent.search_files(user_id, "ZX4471", top_k=3)
+    assert results[0]["metadata"]["file_path"] == "incident.txt"
+    assert "fusion_score" in results[0]
+    monkeypatch.setattr(index, "_vector_search", lambda *args: pytest.fail("expected the shortlist to be ranked without FAISS"))
+    results = index.search("ZX4471 certificate", top_k=1, hybrid=False, shortlist=5)
+    assert [result["metadata"]["file_path"] for result in results] == ["incident.txt"]
+    monkeypatch.undo()
+
+    index.save_index()
+    reloaded = fetchit_agent._load_vector_index(user_id)
+    assert reloaded.search("ZX4471", top_k=1)[0]["metadata"]["file_path"] == "incident.txt"
+
+@pytest.mark.parametrize("exact_filter_limit", [0, 4096]) # FAISS ID selector, or an exact scan of the matches
+def test_filtered_search(fetchit_agent, monkeypatch, exact_filter_limit):
+    monkeypatch.setattr(vector_index_module, "EXACT_FILTER_LIMIT", exact_filter_limit)
+    user_id = f"test_user_21_{exact_filter_limit}"
+    index = fetchit_agent._get_vector_index(user_id)
+    files = [("/docs/a.txt", "txt", 100.0), ("/docs/b.pdf", "pdf", 200.0), ("/mail/c.txt", "txt", 300.0)]
+    for file_path, file_type, modified in files:
+        index.add_documents([f"Budget planning notes from {file_path}."], {"file_path": file_path, "file_type": file_type})
+        index.set_file_record(file_path, {"file_type": file_type, "content_hash": file_path, "file_size": 1, "last_modified": modified})
+
+    def found(**filters):
+        return sorted(result["metadata"]["file_path"] for result in fetchit_agent.search_files(user_id, "budget planning", filters=filters))
+
+    assert found() == ["/docs/a.txt", "/docs/b.pdf", "/mail/c.txt"]
+    assert found(file_type="txt") == ["/docs/a.txt", "/mail/c.txt"]
+    assert found(path_prefix="/docs/", file_type=["pdf", "docx"]) == ["/docs/b.pdf"]
+    assert found(modified_after=150.0) == ["/docs/b.pdf", "/mail/c.txt"]
+    assert found(file_type="docx") == []
+    results = fetchit_agent.search_files(user_id, "budget planning", top_k=1, filters={"path_prefix": "/mail/"})
+    assert [result["metadata"]["file_path"] for result in results] == ["/mail/c.txt"] # Filtered before top_k
+
+    # A touched file's new modification time is picked up despite the search cache
+    index.set_file_record("/docs/a.txt", {"file_type": "txt", "content_hash": "/docs/a.txt", "file_size": 1, "last_modified": 400.0})
+    assert found(modified_after=350.0) == ["/docs/a.txt"]
+
+def test_batch_saves_once(fetchit_agent, local_connector, dummy_files, monkeypatch):
+    user_id = "test_user_7"
+    index = fetchit_agent._get_vector_index(user_id)
+    saves = []
+    original_save = index.save_index
+    monkeypatch.setattr(index, "save_index", lambda: saves.append(1) or original_save())
+
+    with fetchit_agent.batch(user_id):
+        fetchit_agent.index_file(user_id, dummy_files["file1"], "txt", local_connector)
+        fetchit_agent.index_file(user_id, dummy_files["file2"], "txt", local_connector)
+        fetchit_agent.remove_file(user_id, dummy_files["file1"])
+        assert saves == []
+        assert index.pending_changes > 0
+    assert len(saves) == 1
+    assert index.pending_changes == 0
+
+    fetchit_agent.flush() # Nothing pending, nothing written
+    assert len(saves) == 1
+
+def test_idle_index_saves_when_the_interval_expires(fetchit_agent, tmp_path):
+    path = str(tmp_path / "idle.faiss")
+    index = vector_index_module.VectorIndex(fetchit_agent.embedder, path, autosave_every=None, autosave_interval=0.05)
+    index.add_documents(["Written once, then left alone."], {"file_path": "idle.txt"})
+    assert index.pending_changes == 1
+    deadline = time.monotonic() + 5
+    while index.pending_changes and time.monotonic() < deadline: # No further write comes to trigger the save
+        time.sleep(0.01)
+    assert index.pending_changes == 0
+    assert vector_index_module.VectorIndex(fetchit_agent.embedder, path).list_indexed_files() == ["idle.txt"]
+    index.close()
+
+def test_large_file_is_streamed_in_batches(fetchit_agent, local_connector, tmp_path, monkeypatch):
+    user_id = "test_user_17"
+    monkeypatch.setattr(agent_module, "STREAM_BATCH_CHUNKS", 2)
+    big = tmp_path / "big.txt"
+    big.write_text(" ".join(f"Paragraph {i} is about topic {i % 7}." for i in range(200)))
+    index = fetchit_agent._get_vector_index(user_id)
+    added = []
+    original_add = index.add_documents
+    unsaved = []
+    def add_documents(texts, *args, **kwargs):
+        added.append(len(texts))
+        unsaved.append(len(index._log))
+        return original_add(texts, *args, **kwargs)
+    monkeypatch.setattr(index, "add_documents", add_documents)
+
+    assert fetchit_agent.index_file(user_id, str(big), "txt", local_connector)
+    assert max(unsaved) <= 1 # Each batch is saved once added, not held until the whole file is in
+    text = big.read_text()
+    expected = fetchit_agent.text_processor.chunk_text(text)
+    assert len(expected) > 2
+    assert sum(added) == len(expected) and max(added) == 2
+    docs = index.documents
+    assert [doc["content"] for doc in docs] == expected
+    assert all(text[doc["metadata"]["start_offset"]:doc["metadata"]["end_offset"]] == doc["content"] for doc in docs)
+    assert not fetchit_agent.index_file(user_id, str(big), "txt", local_connector) # Unchanged
+
+def test_index_files_reports_per_file_results(fetchit_agent, local_connector, dummy_files, tmp_path):
+    user_id = "test_user_8"
+    missing = str(tmp_path / "missing.txt")
+    files = [(dummy_files["file1"], "txt"), (missing, "txt"), (dummy_files["file2"], "txt")]
+
+    results = fetchit_agent.index_files(user_id, files, local_connector, max_workers=2, embed_batch_size=2)
+    assert [result["status"] for result in results] == ["indexed", "error", "indexed"]
+    assert results[0]["chunks"] > 0
+    assert "File not found" in results[1]["error"]
+
+    indexed_files = fetchit_agent.list_indexed_files(user_id)
+    assert sorted(indexed_files) == sorted([dummy_files["file1"], dummy_files["file2"]])
+    results = fetchit_agent.search_files(user_id, "natural language processing")
+    assert results[0]["metadata"]["file_path"] == dummy_files["file2"]
+
+def test_index_files_survives_a_failed_commit(fetchit_agent, local_connector, dummy_files, monkeypatch):
+    user_id = "test_user_8b"
+    original_replace = fetchit_agent._replace_file_chunks
+    def replace_or_fail(vector_index, file_path, *args):
+        if file_path == dummy_files["file1"]:
+            raise OSError("No space left on device")
+        return original_replace(vector_index, file_path, *args)
+    monkeypatch.setattr(fetchit_agent, "_replace_file_chunks", replace_or_fail)
+
+    files = [(dummy_files["file1"], "txt"), (dummy_files["file2"], "txt")]
+    results = fetchit_agent.index_files(user_id, files, local_connector, max_workers=1, embed_batch_size=2)
+    assert [result["status"] for result in results] == ["error", "indexed"]
+    assert "No space left" in results[0]["error"]
+    assert fetchit_agent.list_indexed_files(user_id) == [dummy_files["file2"]]
+
+def test_reindex_skips_unchanged_and_replaces_changed(fetchit_agent, local_connector, tmp_path):
+    user_id = "test_user_9"
+    docs_dir = tmp_path / "synced"
+    docs_dir.mkdir()
+    notes = docs_dir / "notes.txt"
+    notes.write_text("Quarterly planning notes about the budget.")
+    todo = docs_dir / "todo.txt"
+    todo.write_text("Buy milk and call the plumber.")
+
+    results = fetchit_agent.sync_directory(user_id, str(docs_dir), local_connector)
+    assert sorted(result["status"] for result in results) == ["indexed", "indexed"]
+
+    # Nothing changed: nothing is re-read or duplicated
+    assert fetchit_agent.index_file(user_id, str(notes), "txt", local_connector) is False
+    index = fetchit_agent._get_vector_index(user_id)
+    assert len(index.documents) == 2
+
+    # A changed file has its chunks replaced, a deleted file is dropped
+    notes.write_text("Quarterly planning notes about hiring.")
+    os.utime(notes, (0, 0))
+    todo.unlink()
+    results = fetchit_agent.sync_directory(user_id, str(docs_dir), local_connector)
+    assert {result["file_path"]: result["status"] for result in results} == {str(notes): "indexed", str(todo): "removed"}
+    assert [doc["content"] for doc in index.documents] == ["Quarterly planning notes about hiring."]
+    assert fetchit_agent.list_indexed_files(user_id) == [str(notes)]
+
+def test_embedding_cache_shared_across_users(fetchit_agent, local_connector, dummy_files):
+    fetchit_agent.index_file("test_user_10", dummy_files["docx"], "txt", local_connector)
+    hits_before = fetchit_agent.embedding_cache.stats()["hits"]
+    fetchit_agent.index_file("test_user_11", dummy_files["docx"], "txt", local_connector)
+    assert fetchit_agent.embedding_cache.stats()["hits"] > hits_before
+
+def test_search_caches_invalidate_on_index_change(fetchit_agent, local_connector, dummy_files, monkeypatch):
+    user_id = "test_user_12"
+    fetchit_agent.index_file(user_id, dummy_files["file1"], "txt", local_connector)
+    first = fetchit_agent.search_files(user_id, "machine learning")
+
+    index = fetchit_agent._get_vector_index(user_id)
+    monkeypatch.setattr(index, "search", lambda *args: pytest.fail("expected a cached result"))
+    assert fetchit_agent.search_files(user_id, "machine learning") == first
+    monkeypatch.undo()
+
+    query_hits = fetchit_agent.embedder.query_cache.stats()["hits"]
+    fetchit_agent.index_file(user_id, dummy_files["file2"], "txt", local_connector)
+    results = fetchit_agent.search_files(user_id, "machine learning")
+    assert len(results) == 2 # Recomputed against the changed index...
+    assert fetchit_agent.embedder.query_cache.stats()["hits"] == query_hits + 1 # ...with the cached query vector
+
+def test_index_promoted_to_ann(fetchit_agent, local_connector, dummy_files):
+    user_id = "test_user_13"
+    with pytest.raises(ValueError, match="ef_serach"):
+        fetchit_agent.configure_index(user_id, ef_serach=32)
+    assert user_id not in fetchit_agent.user_index_options
+    fetchit_agent.configure_index(user_id, index_type="hnsw", ann_threshold=2, ef_search=32)
+    fetchit_agent.index_file(user_id, dummy_files["file1"], "txt", local_connector)
+    index = fetchit_agent._get_vector_index(user_id)
+    assert index.built_index_type == "flat"
+
+    fetchit_agent.index_file(user_id, dummy_files["file2"], "txt", local_connector)
+    index.wait_for_background() # Promoted by a merge
+    assert index.built_index_type == "hnsw"
+    results = fetchit_agent.search_files(user_id, "natural language processing")
+    assert results[0]["metadata"]["file_path"] == dummy_files["file2"]
+
+    fetchit_agent.remove_file(user_id, dummy_files["file2"])
+    assert index.ntotal == 1
+    assert fetchit_agent.list_indexed_files(user_id) == [dummy_files["file1"]]
+
+def test_compact_vector_dtypes(fetchit_agent, monkeypatch):
+    user_id = "test_user_23"
+    monkeypatch.setattr(vector_index_module, "MIN_INT8_TRAINING_VECTORS", 50)
+    index = fetchit_agent._get_vector_index(user_id)
+    texts = [f"Ticket {i} reports a problem with module{i % 17} and subsystem{i % 5}." for i in range(60)]
+    index.add_documents(texts[:40], {"file_path": "tickets.txt"})
+    float32_results = index.search("problem with module3", top_k=5)
+    float32_bytes = index.memory_bytes()
+
+    fetchit_agent.configure_index(user_id, vector_dtype="int8")
+    assert index._built_vector_dtype() == "float16" # Too few vectors yet to learn int8 ranges from
+    assert index.search("problem with module3", top_k=5)[0]["content"] == float32_results[0]["content"]
+    index.add_documents(texts[40:], {"file_path": "more_tickets.txt"})
+    index.wait_for_background()
+    assert index._built_vector_dtype() == "int8"
+    assert index._stored_vectors().dtype == np.float16 and index.memory_bytes() < float32_bytes
+    assert index.search("problem with module3", top_k=5)[0]["content"] == float32_results[0]["content"]
+
+    # A saved index is converted when loaded with another vector_dtype
+    index.save_index()
+    fetchit_agent.configure_index(user_id, vector_dtype="float32")
+    index.save_index()
+    reloaded = vector_index_module.VectorIndex(fetchit_agent.embedder, index.index_path, metric="ip", vector_dtype="float16")
+    assert reloaded._built_vector_dtype() == "float16" and reloaded._stored_vectors().dtype == np.float16
+    assert len(reloaded.search("problem with module3", top_k=5)) == 5
+
+def test_saves_are_logged_and_recovered(fetchit_agent, tmp_path, monkeypatch):
+    index_path = str(tmp_path / "user_24_index.faiss")
+    index = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path)
+    index.add_documents(["Quarterly revenue grew in every region."], {"file_path": "report.txt"})
+    assert index.generation == 1 # The first save writes a checkpoint
+    checkpoint_files = sorted(os.listdir(tmp_path))
+
+    # Later saves only append to the log
+    index.add_documents(["The travel policy now covers rail passes.", "Quarterly revenue grew in every region."], {"file_path": "policy.txt"})
+    index.remove_documents("report.txt")
+    index.set_file_record("policy.txt", {"content_hash": "abc", "file_size": 2, "last_modified": 1.0})
+    assert index.generation == 1 and sorted(os.listdir(tmp_path)) == checkpoint_files and index.wal.size > 0
+
+    # Reopening without close(), as after a crash, replays the log; a torn last write is dropped
+    with open(index.wal.path, "ab") as f:
+        f.write(b"\x00\x01partial")
+    expected = [(result["metadata"]["chunk_id"], result["content"]) for result in index.search("travel rail revenue", top_k=5)]
+    recovered = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path)
+    assert [(result["metadata"]["chunk_id"], result["content"]) for result in recovered.search("travel rail revenue", top_k=5)] == expected
+    assert recovered.list_indexed_files() == ["policy.txt"] and recovered.next_chunk_id == 3
+    assert recovered.get_file_record("policy.txt")["content_hash"] == "abc"
+
+    # A checkpoint cut short before its manifest is written leaves the previous generation in charge
+    original_replace = vector_index_module.replace_file
+    def crash_at_commit(path, write):
+        if path == index_path + ".json":
+            raise OSError("crashed")
+        original_replace(path, write)
+    monkeypatch.setattr(vector_index_module, "replace_file", crash_at_commit)
+    with pytest.raises(OSError):
+        recovered.checkpoint()
+    monkeypatch.setattr(vector_index_module, "replace_file", original_replace)
+    reopened = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path)
+    assert reopened.generation == 1 and reopened.list_indexed_files() == ["policy.txt"]
+    assert [result["metadata"]["chunk_id"] for result in reopened.search("travel rail revenue", top_k=5)] == [chunk_id for chunk_id, _ in expected]
+
+    # A checkpoint in the background folds the log into a new generation and deletes the old files
+    reopened.checkpoint_bytes = 1
+    reopened.add_documents(["Office plants are watered on Fridays."], {"file_path": "plants.txt"})
+    reopened.wait_for_background()
+    assert reopened.generation == 2 and reopened.wal.size == 0
+    assert not (tmp_path / "user_24_index.faiss.1").exists() and not (tmp_path / "user_24_index.faiss.1.wal").exists()
+    reopened.close()
+    assert len(vector_index_module.VectorIndex(fetchit_agent.embedder, index_path).store) == 3
+
+def test_replay_across_a_merge_threshold(fetchit_agent, tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index_module, "MERGE_MIN_CHUNKS", 20)
+    index_path = str(tmp_path / "user_26_index.faiss")
+    index = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path)
+    vectors = np.random.default_rng(0).standard_normal((300, 64)).astype("float32")
+    for number in range(300):
+        index.add_documents([f"Log line {number}."], {"file_path": f"log{number}.txt"}, embeddings=vectors[number:number + 1])
+    # Reopened without close(), as after a crash: the replay crosses the merge thresholds of the new settings
+    recovered = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path, index_type="hnsw", ann_threshold=50)
+    recovered.wait_for_background()
+    assert len(recovered.store) == recovered.ntotal == len(recovered._stored_vectors()) == 300
+    assert recovered.built_index_type == "hnsw" and recovered.delta.ntotal == 0
+    assert recovered._vector_search(vectors[7:8], 1, None)[1].tolist() == [[7]]
+
+def test_segments_and_tombstones(fetchit_agent, tmp_path, monkeypatch):
+    index = vector_index_module.VectorIndex(fetchit_agent.embedder, str(tmp_path / "user_25_index.faiss"), index_type="hnsw", ann_threshold=4)
+    for number in range(6):
+        index.add_documents([f"Meeting notes number {number} about the roadmap."], {"file_path": f"notes{number}.txt"})
+    index.wait_for_background() # Promoted by a merge at 4 chunks; the rest went to the delta segment
+    assert index.built_index_type == "hnsw" and (index.index.ntotal, index.delta.ntotal) == (4, 2)
+    index.rebuild()
+    assert (index.index.ntotal, index.delta.ntotal) == (6, 0)
+    chunk_ids = {doc["metadata"]["file_path"]: doc["metadata"]["chunk_id"] for doc in index.documents}
+
+    def found(query):
+        return [result["metadata"]["file_path"] for result in index.search(query, top_k=6)]
+
+    # A removed chunk stays in the HNSW graph as a tombstone, hidden from searches
+    index.remove_documents("notes2.txt")
+    assert index.index.ntotal == 6 and index.tombstones.tolist() == [chunk_ids["notes2.txt"]] and index.ntotal == 5
+    assert "notes2.txt" not in found("Meeting notes number 2 about the roadmap.")
+
+    # Writes made while a merge builds the new main segment become its delta segment and tombstones
+    original_build = index._build_index
+    def build_while_writing(*args):
+        monkeypatch.setattr(index, "_build_index", original_build)
+        index.add_documents(["Incident report about an expired certificate."], {"file_path": "incident.txt"})
+        index.remove_documents("notes3.txt")
+        return original_build(*args)
+    monkeypatch.setattr(index, "_build_index", build_while_writing)
+    index.rebuild()
+    assert index.index.ntotal == 5 and index.delta.ntotal == 1 and index.tombstones.tolist() == [chunk_ids["notes3.txt"]]
+    assert found("Incident report about an expired certificate.")[0] == "incident.txt" # Found in the delta segment
+    assert sorted(found("Meeting notes about the roadmap.")) == ["incident.txt", "notes0.txt", "notes1.txt", "notes4.txt", "notes5.txt"]
+    # Chunk ids never change, and the segments are recovered on load
+    assert all(chunk_ids[doc["metadata"]["file_path"]] == doc["metadata"]["chunk_id"] for doc in index.documents if doc["metadata"]["file_path"] in chunk_ids)
+    index.wait_for_background() # The merged segment is written by a checkpoint in the background
+    reloaded = vector_index_module.VectorIndex(fetchit_agent.embedder, index.index_path)
+    assert (reloaded.index.ntotal, reloaded.delta.ntotal, reloaded.tombstones.tolist()) == (5, 1, [chunk_ids["notes3.txt"]])
+
+def test_checkpoint_writes_beside_searches_and_saves(fetchit_agent, tmp_path, monkeypatch):
+    index_path = str(tmp_path / "user_25_checkpoint.faiss")
+    index = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path)
+    index.add_documents(["The cafeteria opens at eight."], {"file_path": "cafeteria.txt"})
+    original_write = index.store.write_snapshot
+    def write_while_indexing(*args):
+        # The files are written without the lock: another thread's add and save go through meanwhile
+        writer = threading.Thread(target=index.add_documents, args=(["Parking permits renew in March."], {"file_path": "parking.txt"}))
+        writer.start()
+        writer.join(timeout=10)
+        assert not writer.is_alive()
+        assert index.search("parking permits renew", top_k=1)[0]["metadata"]["file_path"] == "parking.txt"
+        return original_write(*args)
+    monkeypatch.setattr(index.store, "write_snapshot", write_while_indexing)
+    index.checkpoint()
+    assert index.generation == 2 and index.wal.size > 0 # The new log starts with the save made after the snapshot
+    recovered = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path)
+    assert sorted(recovered.list_indexed_files()) == ["cafeteria.txt", "parking.txt"] and len(recovered.store) == 2
+
+def test_removal_marks_chunks_until_the_next_checkpoint(fetchit_agent, tmp_path):
+    index_path = str(tmp_path / "user_01_removal.faiss")
+    index = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path)
+    index.add_documents(["Alpha notes.", "Beta notes."], {"file_path": "alpha.txt"})
+    index.add_documents(["Gamma notes."], {"file_path": "gamma.txt"})
+    index.checkpoint()
+    vectors = index._stored_vectors()
+    assert isinstance(vectors, np.memmap)
+
+    # The memory-mapped vectors are neither copied nor read: the removed rows are only marked
+    index.remove_documents("alpha.txt")
+    assert index._stored_vectors() is vectors and len(index.store.table()) == 3
+    assert len(index.store) == 1 and index.store.chunk_ids().tolist() == [2] and index.list_indexed_files() == ["gamma.txt"]
+    assert index.get_vectors([0, 2])[1].tolist() == [False, True]
+    assert [result["metadata"]["file_path"] for result in index.search("Alpha notes.", top_k=3)] == ["gamma.txt"]
+
+    # The checkpoint drops them from the table and the vectors alike
+    index.checkpoint()
+    assert len(index.store.table()) == len(index._stored_vectors()) == 1
+    reloaded = vector_index_module.VectorIndex(fetchit_agent.embedder, index_path)
+    assert reloaded.store.chunk_ids().tolist() == [2] and len(reloaded._stored_vectors()) == 1
+    assert np.array_equal(reloaded.get_vectors([2])[0], index.get_vectors([2])[0])
+
+def test_search_scores_and_threshold(fetchit_agent, local_connector, dummy_files):
+    user_id = "test_user_14"
+    fetchit_agent.index_file(user_id, dummy_files["file1"], "txt", local_connector)
+    fetchit_agent.index_file(user_id, dummy_files["file2"], "txt", local_connector)
+
+    results = fetchit_agent.search_files(user_id, "natural language processing and deep learning")
+    scores = [result["score"] for result in results]
+    assert all(-1.0 <= score <= 1.0 for score in scores)
+    assert scores == sorted(scores, reverse=True)
+
+    results = fetchit_agent.search_files(user_id, "natural language processing and deep learning", min_score=scores[0])
+    assert [result["metadata"]["file_path"] for result in results] == [dummy_files["file2"]]
+
+    response = fetchit_agent.answer_question(user_id, "What is discussed about deep learning?", min_score=1.01)
+    assert response["source_files"] == []
+
+def test_search_files_batch_matches_single_searches(fetchit_agent, local_connector, dummy_files, monkeypatch):
+    user_id = "test_user_16"
+    fetchit_agent.index_file(user_id, dummy_files["file1"], "txt", local_connector)
+    fetchit_agent.index_file(user_id, dummy_files["file2"], "txt", local_connector)
+    queries = ["natural language processing models", "AI and machine learning", "natural language processing models"]
+
+    embed_calls = []
+    original_encode = fetchit_agent.embedder.backend.encode
+    monkeypatch.setattr(fetchit_agent.embedder.backend, "encode", lambda texts, batch_size=32: embed_calls.append(texts) or original_encode(texts, batch_size))
+    batch_results = fetchit_agent.search_files_batch(user_id, queries, top_k=2)
+    assert embed_calls == [queries[:2]] # One call, duplicates embedded once
+    monkeypatch.undo()
+
+    for query, results in zip(queries, batch_results):
+        single = fetchit_agent.search_files(user_id, query, top_k=2)
+        assert [r["metadata"]["chunk_id"] for r in results] == [r["metadata"]["chunk_id"] for r in single]
+        assert [r["score"] for r in results] == pytest.approx([r["score"] for r in single])
+
+    answers = fetchit_agent.answer_questions(user_id, ["Tell me about AI.", "What about deep learning?"])
+    assert dummy_files["file1"] in answers[0]["source_files"]
+    assert dummy_files["file2"] in answers[1]["source_files"]
+
+def test_startup_loads_models_lazily(tmp_path):
+    # A fresh interpreter, so modules imported by other tests do not count
+    script = ("import sys; from fetchit_agent.agent import FetchItAgent; FetchItAgent(data_dir=sys.argv[1]);"
+              "print(sorted(name for name in ('sentence_transformers', 'sumy', 'pypdf', 'docx') if name in sys.modules))")
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    output = subprocess.run([sys.executable, "-c", script, str(tmp_path)], cwd=root, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+def test_warmup_loads_the_model(tmp_path):
+    agent = FetchItAgent(data_dir=str(tmp_path))
+    assert not agent.embedder.loaded
+    agent.warmup()
+    assert agent.embedder.loaded
+    agent.close()
+
+def test_dropped_agent_is_collected(local_connector, dummy_files, tmp_path):
+    agent = FetchItAgent(data_dir=str(tmp_path))
+    agent.index_file("tenant_gc", dummy_files["file1"], "txt", local_connector)
+    agent.flush() # A queued summary job holds the agent until it runs
+    agent_ref = weakref.ref(agent)
+    del agent
+    gc.collect()
+    assert agent_ref() is None # Not kept alive by its close-at-exit registration
+
+def test_index_cache_evicts_and_reloads(local_connector, dummy_files, tmp_path):
+    agent = FetchItAgent(data_dir=str(tmp_path / "bounded"), max_loaded_indexes=1, autosave_every=None)
+    agent.index_file("tenant_a", dummy_files["file1"], "txt", local_connector)
+    agent.index_file("tenant_b", dummy_files["file2"], "txt", local_connector)
+
+    stats = agent.index_cache_stats()
+    assert stats["loaded"] == 1
+    assert stats["evictions"] == 1
+    assert stats["memory_bytes"] > 0
+
+    # tenant_a's unsaved changes were flushed on eviction and are loaded again on access
+    assert agent.list_indexed_files("tenant_a") == [dummy_files["file1"]]
+    assert agent.index_cache_stats()["misses"] == 3
+    agent.close()
+
+def test_index_cache_loads_without_blocking_other_users(fetchit_agent, tmp_path):
+    release = threading.Event()
+    loads = []
+    def loader(user_id):
+        loads.append(user_id)
+        if user_id == "slow_tenant":
+            release.wait(10)
+        return vector_index_module.VectorIndex(fetchit_agent.embedder, str(tmp_path / f"{user_id}.faiss"))
+    cache = IndexCache(loader)
+    slow = [threading.Thread(target=cache.get, args=("slow_tenant",)) for _ in range(2)]
+    for thread in slow:
+        thread.start()
+    while not loads:
+        time.sleep(0.01)
+    assert cache.get("fast_tenant") is cache.peek("fast_tenant")
+    assert cache.peek("slow_tenant") is None # Still loading: the other tenant did not wait for it
+    release.set()
+    for thread in slow:
+        thread.join()
+    assert loads.count("slow_tenant") == 1 and cache.stats()["loaded"] == 2 # The second caller waited for the first load
+    assert cache.evict("slow_tenant") and cache.get("slow_tenant") is not None and loads.count("slow_tenant") == 2
+
+def test_index_cache_evicts_without_waiting_on_other_indexes(fetchit_agent, tmp_path, monkeypatch):
+    cache = IndexCache(lambda user_id: vector_index_module.VectorIndex(fetchit_agent.embedder, str(tmp_path / f"{user_id}.faiss")),
+                       max_indexes=1, memory_budget=10**9)
+    busy = cache.get("busy_tenant")
+    busy.add_documents(["Quarterly revenue grew."], {"file_path": "report.txt"})
+    assert busy.memory_bytes() > 0
+    closing = threading.Event()
+    release = threading.Event()
+    monkeypatch.setattr(busy, "close", lambda: closing.set() or release.wait(10))
+
+    with busy.lock.write_locked(): # A long write of one tenant does not stall another tenant's request...
+        assert cache.get("other_tenant") is not None
+    assert closing.wait(10) and cache.peek("busy_tenant") is None # ...which left closing the evicted index to the background
+    release.set()
+    cache.clear()
+    assert len(cache) == 0
+
+def test_concurrent_search_while_indexing(local_connector, dummy_files, tmp_path):
+    agent = FetchItAgent(data_dir=str(tmp_path / "concurrent"), search_cache_size=0)
+    user_id = "test_user_15"
+    agent.index_file(user_id, dummy_files["file2"], "txt", local_connector)
+    errors = []
+
+    def search_repeatedly():
+        try:
+            for _ in range(50):
+                results = agent.search_files(user_id, "natural language processing", top_k=2)
+                assert dummy_files["file2"] in [result["metadata"]["file_path"] for result in results]
+        except Exception as e:
+            errors.append(e)
+
+    searchers = [threading.Thread(target=search_repeatedly) for _ in range(4)]
+    for thread in searchers:
+        thread.start()
+    for _ in range(10):
+        agent.index_file(user_id, dummy_files["file1"], "txt", local_connector, force=True)
+        agent.remove_file(user_id, dummy_files["file1"])
+    for thread in searchers:
+        thread.join()
+
+    assert errors == []
+    assert agent.list_indexed_files(user_id) == [dummy_files["file2"]]
+    agent.close()
+
 def test_summarize_file(fetchit_agent, local_connector, dummy_files):
     user_id = "test_user_3"
     # For summarize_file, we need to ensure the content is read correctly.
@@ -102,6 +699,40 @@ def test_summarize_file(fetchit_agent, local_connector, dummy_files):
     assert "test document" in summary or "AI" in summary
     assert len(summary.split('.')) <= 2 # Should be roughly 1 sentence
 
+def test_summaries_precomputed_at_index_time(fetchit_agent, local_connector, tmp_path, monkeypatch):
+    user_id = "test_user_21"
+    file_path = tmp_path / "report.txt"
+    file_path.write_text(" ".join(f"Quarter {i} revenue grew in region {i % 4}." for i in range(12)))
+    fetchit_agent.index_file(user_id, str(file_path), "txt", local_connector)
+    fetchit_agent.flush() # Waits for the background summaries
+
+    def no_reads(*args):
+        raise AssertionError("the file should not be read")
+    monkeypatch.setattr(local_connector, "read_file", no_reads)
+    summary = fetchit_agent.summarize_file(user_id, str(file_path), "txt", local_connector, num_sentences=3)
+    assert summary.count("revenue grew") == 3
+    monkeypatch.undo()
+
+    # Changed content invalidates the stored summaries, whether or not the file was reindexed
+    file_path.write_text("The office moves next month. Parking is free.")
+    os.utime(file_path, (1, 1))
+    assert fetchit_agent.summarize_file(user_id, str(file_path), "txt", local_connector, num_sentences=3) == "The office moves next month. Parking is free."
+    fetchit_agent.remove_file(user_id, str(file_path))
+    assert not os.listdir(os.path.join(fetchit_agent.data_dir, f"user_{user_id}_summaries"))
+
+def test_embedding_answers_reuse_stored_vectors(local_connector, dummy_files, tmp_path, monkeypatch):
+    agent = FetchItAgent(data_dir=str(tmp_path / "data"), answer_method="embedding")
+    agent.index_file("test_user_22", dummy_files["file2"], "txt", local_connector)
+    embedded = []
+    encode = agent.embedder.backend.encode
+    monkeypatch.setattr(agent.embedder.backend, "encode", lambda texts, batch_size=32: embedded.extend(texts) or encode(texts, batch_size))
+    response = agent.answer_question("test_user_22", "What about deep learning models?")
+    assert "deep learning" in response["answer"]
+    assert response["source_files"] == [dummy_files["file2"]]
+    assert embedded == ["What about deep learning models?"] # Only the question, once
+    assert agent.summarization_stats()["embedding"]["count"] == 1
+    agent.close()
+
 def test_answer_question(fetchit_agent, local_connector, dummy_files):
     user_id = "test_user_4"
     fetchit_agent.index_file(user_id, dummy_files["file1"], "txt", local_connector)
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+from fetchit_agent.async_agent import AsyncFetchItAgent
+from fetchit_agent.connector_interface import LocalFileConnector
+
+class SlowConnector(LocalFileConnector):
+    """Blocks reads until released, to stand in for a slow PDF download."""
+    def __init__(self):
+        self.release = threading.Event()
+
+    def read_file(self, file_path, file_type):
+        self.release.wait(timeout=10)
+        return super().read_file(file_path, file_type)
+
+def test_async_index_and_search(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_text("The second document discusses natural language processing and deep learning models.")
+
+    async def scenario():
+        async with AsyncFetchItAgent(data_dir=str(tmp_path / "data")) as agent:
+            assert await agent.index_file("async_user", str(doc), "txt", LocalFileConnector())
+            assert not await agent.index_file("async_user", str(doc), "txt", LocalFileConnector())
+            results = await agent.search_files("async_user", "natural language processing")
+            assert results[0]["metadata"]["file_path"] == str(doc)
+            response = await agent.process_message("async_user", "Tell me about deep learning.")
+            assert str(doc) in response["source_files"]
+
+    asyncio.run(scenario())
+
+def test_slow_ingest_does_not_block_queries_and_can_be_cancelled(tmp_path):
+    slow_doc = tmp_path / "slow.txt"
+    slow_doc.write_text("A slow document about quarterly budgets.")
+    queued_doc = tmp_path / "queued.txt"
+    queued_doc.write_text("A queued document about the office party.")
+    connector = SlowConnector()
+
+    async def scenario():
+        async with AsyncFetchItAgent(data_dir=str(tmp_path / "data"), max_pending_ingests=1) as agent:
+            slow = asyncio.create_task(agent.index_file("async_user", str(slow_doc), "txt", connector))
+            queued = asyncio.create_task(agent.index_file("async_user", str(queued_doc), "txt", connector))
+            await asyncio.sleep(0.1)
+
+            # Queries are served while the only ingest slot is taken
+            assert await asyncio.wait_for(agent.list_indexed_files("async_user"), timeout=5) == []
+
+            queued.cancel() # Still waiting for the ingest slot, so it never runs
+            connector.release.set()
+            assert await slow
+            assert await agent.list_indexed_files("async_user") == [str(slow_doc)]
+            assert queued.cancelled()
+
+    asyncio.run(scenario())
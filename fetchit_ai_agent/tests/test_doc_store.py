@@ -0,0 +1,59 @@
+import numpy as np
+from fetchit_agent.doc_store import DocumentStore
+
+def test_store_round_trip(tmp_path):
+    store = DocumentStore(str(tmp_path / "docs"))
+    store.add(np.array([0, 1]), ["first chunk", "zweiter Abschnitt ✓"], {"file_path": "a.txt", "file_type": "txt"})
+    store.add(np.array([5]), ["other file"], {"file_path": "b.txt", "file_type": "txt"})
+    assert store.get(1) == {"content": "zweiter Abschnitt ✓", "metadata": {"file_path": "a.txt", "file_type": "txt", "chunk_id": 1}}
+    store.save()
+
+    reopened = DocumentStore(str(tmp_path / "docs"))
+    reopened.load()
+    assert len(reopened) == 3
+    assert len(reopened.metadata) == 2 # Interned per file, not per chunk
+    assert reopened.get(5)["content"] == "other file"
+    assert reopened.get(2) is None
+    assert sorted(reopened.file_paths()) == ["a.txt", "b.txt"]
+
+def test_store_remove_and_compact(tmp_path):
+    store = DocumentStore(str(tmp_path / "docs"))
+    store.add(np.array([0, 1, 2]), ["a" * 100, "b" * 100, "c" * 100], {"file_path": "big.txt"})
+    store.add(np.array([3]), ["kept"], {"file_path": "small.txt"})
+    store.save()
+
+    store.remove_rows(store.rows_for_file("big.txt"))
+    assert store.chunk_ids().tolist() == [3]
+    store.save() # Removed texts outweigh live ones, so the blob is rewritten
+    assert store.garbage_bytes == 0
+    assert (tmp_path / "docs.bin").read_bytes() == b"kept"
+    assert store.get(3)["content"] == "kept"
+
+def test_store_keeps_source_offsets_and_reads_old_layout(tmp_path):
+    store = DocumentStore(str(tmp_path / "docs"))
+    store.add(np.array([0, 1]), ["First.", "Second."], {"file_path": "a.txt"}, offsets=[(0, 6), (7, 14)])
+    store.save()
+    assert store.get(1)["metadata"]["start_offset"] == 7 and store.get(1)["metadata"]["end_offset"] == 14
+
+    # Tables written before offsets were stored load with unknown offsets
+    old_dtype = np.dtype([("chunk_id", "<i8"), ("offset", "<i8"), ("length", "<i4"), ("meta_id", "<i4")])
+    old_table = np.zeros(2, dtype=old_dtype)
+    for field in old_dtype.names:
+        old_table[field] = store.table()[field]
+    np.save(str(tmp_path / "docs.idx.npy"), old_table)
+    reopened = DocumentStore(str(tmp_path / "docs"))
+    reopened.load()
+    assert reopened.get(1) == {"content": "Second.", "metadata": {"file_path": "a.txt", "chunk_id": 1}}
+
+def test_store_shares_duplicate_text(tmp_path):
+    store = DocumentStore(str(tmp_path / "docs"))
+    store.add(np.array([0]), ["Shared disclaimer."], {"file_path": "a.txt"})
+    store.add(np.array([1]), ["Shared disclaimer."], {"file_path": "b.txt"}, canonical=[0])
+    store.save()
+    assert (tmp_path / "docs.bin").read_bytes() == b"Shared disclaimer."
+    assert store.get(1)["content"] == "Shared disclaimer."
+
+    store.remove_rows(store.rows_for_file("a.txt"))
+    store.set_canonical(np.array([1]), np.array([1]))
+    assert store.garbage_bytes == 0 # Still used by the duplicate
+    assert store.get(1)["content"] == "Shared disclaimer."
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from fetchit_agent.embedder import Embedder
+from fetchit_agent.embedding_backends import EmbeddingBackend, make_backend
+from fetchit_agent.embedding_cache import EmbeddingCache
+
+class ConstantBackend(EmbeddingBackend):
+    """Embeds every text as the same vector, counting the texts it is asked to embed."""
+    name = "constant"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        self.encoded = 0
+
+    def _load(self):
+        return object()
+
+    def encode(self, texts, batch_size=32):
+        self.model # Loads on first use like a real backend
+        self.encoded += len(texts)
+        return np.ones((len(texts), 4), dtype="float32")
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        make_backend("tpu", "all-MiniLM-L6-v2")
+    assert make_backend("onnx-int8", "all-MiniLM-L6-v2").quantized
+    assert not make_backend("onnx", "all-MiniLM-L6-v2", threads=2).loaded # Nothing is loaded up front
+
+def test_backends_keep_separate_cache_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    backend = ConstantBackend("all-MiniLM-L6-v2")
+    embedder = Embedder(cache=cache, backend=backend)
+    assert not embedder.loaded
+    assert embedder.embed(["hello", "hello"]).tolist() == [[1.0] * 4] * 2
+    embedder.embed(["hello"])
+    assert backend.encoded == 1 and embedder.loaded
+
+    # Full-precision vectors keep the original keys; other backends' vectors never share them
+    key = EmbeddingCache.make_key(backend.cache_namespace, "hello")
+    assert key != EmbeddingCache.make_key(make_backend("torch", "all-MiniLM-L6-v2").cache_namespace, "hello")
+    assert make_backend("torch", "all-MiniLM-L6-v2").cache_namespace == "all-MiniLM-L6-v2"
+    assert make_backend("torch-int8", "all-MiniLM-L6-v2").cache_namespace != "all-MiniLM-L6-v2"
+    assert key in cache.get_many([key])
+    cache.close()
+
+def test_queries_skip_the_persistent_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    embedder = Embedder(cache=cache, backend=ConstantBackend("all-MiniLM-L6-v2"))
+    embedder.embed_query("what is new")
+    embedder.embed_queries(["what is new", "what else"])
+    assert cache.stats() == {"hits": 0, "misses": 0, "evictions": 0, "entries": 0} # The query cache covers repeats
+    assert embedder.query_cache.stats()["entries"] == 2
+    cache.close()
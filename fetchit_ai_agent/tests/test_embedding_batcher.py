@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from fetchit_agent.embedding_batcher import EmbeddingBatcher, Histogram
+
+def test_concurrent_requests_share_batches():
+    calls = []
+    def embed_batch(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(embed_batch, max_batch_size=8, max_wait=0.05)
+    start = threading.Barrier(16)
+    results = {}
+    def query(i):
+        start.wait()
+        results[i] = batcher.embed("q" * (i % 4 + 1))
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {i: [float(i % 4 + 1)] for i in range(16)}
+    assert len(calls) < 16
+    assert all(len(texts) == len(set(texts)) for texts in calls) # Duplicates are embedded once
+    stats = batcher.stats()
+    assert stats["batch_size"]["count"] == len(calls)
+    assert stats["batch_size"]["mean"] > 1
+
+def test_errors_reach_every_waiter():
+    def embed_batch(texts):
+        raise RuntimeError("model failed")
+
+    batcher = EmbeddingBatcher(embed_batch, max_wait=0.0)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.embed("query")
+    batcher.close()
+
+def test_histogram_buckets():
+    histogram = Histogram()
+    for value in [1, 2, 3, 4, 5, 9]:
+        histogram.record(value)
+    assert histogram.snapshot()["buckets"] == {"1": 1, "2": 1, "3-4": 2, "5-8": 1, "9-16": 1}
@@ -0,0 +1,44 @@
+import numpy as np
+from fetchit_agent.embedding_cache import EmbeddingCache
+
+def test_cache_round_trip_and_counters(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    key = EmbeddingCache.make_key("model-a", "hello")
+    assert key != EmbeddingCache.make_key("model-b", "hello")
+
+    assert cache.get_many([key]) == {}
+    cache.put_many({key: np.array([1.0, 2.0, 3.0])})
+    found = cache.get_many([key, key])
+    np.testing.assert_array_equal(found[key], np.array([1.0, 2.0, 3.0], dtype="float32"))
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 0, "entries": 1}
+    cache.close()
+
+    # Entries survive a restart
+    reopened = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    assert key in reopened.get_many([key])
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    keys = [EmbeddingCache.make_key("model", text) for text in ("a", "b", "c")]
+    cache.put_many({keys[0]: np.zeros(2)})
+    cache.put_many({keys[1]: np.zeros(2)})
+    cache.get_many([keys[0]]) # "a" is now more recent than "b"
+    cache.put_many({keys[2]: np.zeros(2)})
+
+    assert set(cache.get_many(keys)) == {keys[0], keys[2]}
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+
+def test_hits_do_not_write_until_flushed(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    keys = [EmbeddingCache.make_key("model", text) for text in ("a", "b", "c")]
+    cache.put_many({keys[0]: np.zeros(2), keys[1]: np.zeros(2)})
+    changes = cache._conn.total_changes
+    cache.get_many([keys[0]])
+    assert cache._conn.total_changes == changes
+    assert cache._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    cache.close() # Writes the pending recency of "a"
+
+    reopened = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    reopened.put_many({keys[2]: np.zeros(2)})
+    assert set(reopened.get_many(keys)) == {keys[0], keys[2]}
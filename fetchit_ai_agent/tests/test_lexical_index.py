@@ -0,0 +1,33 @@
+import numpy as np
+
+from fetchit_agent import lexical_index
+from fetchit_agent.lexical_index import LexicalIndex
+
+def test_bm25_ranks_rare_terms_and_hides_removed_chunks(tmp_path):
+    index = LexicalIndex(str(tmp_path / "bm25"))
+    index.add(np.array([0, 1, 2]), ["The deploy failed with error E4471.", "The deploy went fine.", "Lunch menu for the week."])
+    ids, scores = index.search("error E4471 deploy", top_k=5)
+    assert ids.tolist() == [0, 1] and scores[0] > scores[1]
+    assert index.search("nothing matches", top_k=5)[0].tolist() == []
+
+    index.remove(np.array([0]))
+    assert index.search("E4471", top_k=5)[0].tolist() == []
+    index.save()
+
+    reopened = LexicalIndex(str(tmp_path / "bm25"))
+    reopened.load()
+    assert reopened.search("deploy", top_k=5)[0].tolist() == [1]
+
+def test_segments_are_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(lexical_index, "MAX_SEGMENTS", 2)
+    index = LexicalIndex(str(tmp_path / "bm25"))
+    for chunk_id in range(4):
+        index.add(np.array([chunk_id]), [f"shared term and unique{chunk_id}"])
+        index.save()
+    index.remove(np.array([1]))
+    index.add(np.array([4]), ["shared term"])
+    index.save()
+    assert len(index._segments) == 1 # Merged, dropping the removed chunk's postings
+    assert len(list(tmp_path.glob("bm25.[0-9]*.npy"))) == 1
+    assert sorted(index.search("shared", top_k=10)[0].tolist()) == [0, 2, 3, 4]
+    assert index.search("unique1", top_k=10)[0].tolist() == []
@@ -0,0 +1,63 @@
+import numpy as np
+from fetchit_agent.summarizer import Summarizer, SummaryCache
+
+SENTENCES = [f"Sentence {i} covers topic {i % 7} with detail {i % 5}." for i in range(60)]
+TEXT = " ".join(SENTENCES)
+
+def test_short_text_is_returned_without_ranking():
+    summarizer = Summarizer()
+    assert summarizer.summarize("Only one sentence here. And a second one.", 3) == "Only one sentence here. And a second one."
+    assert summarizer.stats()["short"]["count"] == 1 and "lsa" not in summarizer.stats()
+
+def test_summarize_many_matches_single_counts():
+    summarizer = Summarizer()
+    summaries = summarizer.summarize_many(TEXT, [1, 3, 5])
+    for count, summary in summaries.items():
+        assert summary == summarizer.summarize(TEXT, count)
+        assert summary.count(".") == count
+
+def test_counts_beyond_the_text_keep_the_ranking_of_smaller_ones():
+    summarizer = Summarizer()
+    text = ("The weather was mild all week. Quarterly revenue grew by twelve percent on strong cloud sales. "
+            "The cafeteria menu changed. Cloud revenue and sales drove the quarterly growth.")
+    summaries = summarizer.summarize_many(text, [1, 3, 5])
+    for count in (1, 3):
+        assert summaries[count] == summarizer.summarize(text, count)
+    assert summaries[5] == text
+
+def test_long_text_is_summarized_map_reduce():
+    summarizer = Summarizer(max_sentences=20)
+    summary = summarizer.summarize(TEXT, 3)
+    picked = [sentence for sentence in SENTENCES if sentence in summary]
+    assert len(picked) == 3 and " ".join(picked) == summary # Three sentences of the text, in document order
+    summarizer.close()
+
+def test_summarize_by_vectors_prefers_the_query():
+    texts = ["Cats purr. Cats sleep a lot.", "Dogs bark loudly. Dogs fetch.", "Fish swim."]
+    vectors = np.eye(3, dtype="float32")
+    summary = Summarizer().summarize_by_vectors(texts, vectors, 1, query_vector=vectors[1])
+    assert summary == "Dogs bark loudly."
+
+def test_summary_cache_checks_content_hash(tmp_path):
+    cache = SummaryCache(str(tmp_path / "summaries"))
+    cache.put("/docs/a.txt", "hash1", {1: "One.", 3: "One. Two. Three."})
+    cache.put("/docs/a.txt", "hash1", {5: "Five."})
+    assert cache.get("/docs/a.txt", "hash1", 3) == "One. Two. Three."
+    assert cache.get("/docs/a.txt", "hash1", 5) == "Five."
+    assert cache.get("/docs/a.txt", "hash2", 3) is None
+    cache.remove("/docs/a.txt")
+    assert cache.get("/docs/a.txt", "hash1", 1) is None
+
+def test_streamed_text_is_summarized_section_by_section():
+    summarizer = Summarizer()
+    pieces = [TEXT[i:i + 50] for i in range(0, len(TEXT), 50)]
+    assert summarizer.summarize_stream(pieces, [1, 3]) == summarizer.summarize_many(TEXT, [1, 3]) # One section: as a whole
+
+    sections = []
+    summarize_many = summarizer.summarize_many
+    summarizer.summarize_many = lambda text, counts: sections.append(len(text)) or summarize_many(text, counts)
+    summaries = summarizer.summarize_stream(pieces, [1, 3], section_chars=400)
+    assert max(sections) < 2 * 400 < len(TEXT) # Sections and the sentences kept from them, never the whole text
+    for count, summary in summaries.items():
+        picked = [sentence for sentence in SENTENCES if sentence in summary]
+        assert len(picked) == count and " ".join(picked) == summary
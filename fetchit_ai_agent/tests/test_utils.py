@@ -0,0 +1,65 @@
+import pypdf
+from docx import Document
+
+from fetchit_agent import utils
+from fetchit_agent.utils import TextProcessor
+
+def test_streamed_chunks_match_whole_text():
+    processor = TextProcessor(max_tokens=30, overlap_tokens=8)
+    text = "".join(f"Sentence number {i} talks about topic {i % 5}. " for i in range(200))
+    pieces = [text[i:i + 37] for i in range(0, len(text), 37)]
+    chunks = list(processor.iter_chunks(pieces))
+    assert chunks == list(processor.iter_chunks([text]))
+    for chunk, start, end in chunks:
+        assert text[start:end] == chunk
+        assert processor.count_tokens(chunk) <= 30
+        assert chunk.startswith("Sentence") and chunk.endswith(".") # Cut between sentences
+    assert chunks[-1][2] == len(text.rstrip())
+
+def test_chunks_overlap_by_sentences_without_duplicate_tail():
+    processor = TextProcessor(max_tokens=12, overlap_tokens=4)
+    text = "One two three. Four five six. Seven eight nine. Ten."
+    assert processor.chunk_text(text) == ["One two three. Four five six. Seven eight nine.", "Seven eight nine. Ten."]
+    assert processor.chunk_text("") == []
+
+def test_long_sentence_is_cut_between_words():
+    processor = TextProcessor(max_tokens=10, overlap_tokens=0)
+    text = " ".join(["word"] * 25)
+    chunks = processor.chunk_text(text)
+    assert [len(chunk.split()) for chunk in chunks] == [10, 10, 5]
+
+def test_text_file_is_read_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "TEXT_BLOCK_SIZE", 8)
+    path = tmp_path / "notes.txt"
+    path.write_text("Block streaming keeps memory bounded.", encoding="utf-8")
+    pieces = list(TextProcessor().iter_text_from_file(str(path), "txt"))
+    assert len(pieces) > 1
+    assert "".join(pieces) == "Block streaming keeps memory bounded."
+
+def test_docx_paragraphs_are_yielded(tmp_path):
+    document = Document()
+    document.add_paragraph("First paragraph.")
+    document.add_paragraph("Second paragraph.")
+    path = tmp_path / "doc.docx"
+    document.save(str(path))
+
+    processor = TextProcessor()
+    assert list(processor.iter_text_from_file(str(path), "docx")) == ["First paragraph.\n", "Second paragraph.\n"]
+    assert processor.extract_text_from_raw(path.read_bytes(), "docx") == "First paragraph.\nSecond paragraph.\n"
+
+def test_pdf_is_read_through_an_open_file(tmp_path, monkeypatch):
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(width=72, height=72)
+    writer.add_blank_page(width=72, height=72)
+    path = tmp_path / "blank.pdf"
+    with open(path, "wb") as f:
+        writer.write(f)
+    sources = []
+    original_reader = pypdf.PdfReader
+    monkeypatch.setattr(pypdf, "PdfReader", lambda source: sources.append(source) or original_reader(source))
+
+    pages = TextProcessor().iter_text_from_file(str(path), "pdf")
+    assert next(pages) == ""
+    assert not sources[0].closed and sources[0].name == str(path) # Open while pages are yielded, not read into memory
+    assert list(pages) == [""]
+    assert sources[0].closed
@@ -0,0 +1,24 @@
+import numpy as np
+
+from fetchit_agent.wal import WriteAheadLog
+
+def test_torn_frame_is_dropped(tmp_path):
+    log = WriteAheadLog(str(tmp_path / "index.wal"))
+    log.create()
+    vectors = np.arange(6, dtype="float32").reshape(2, 3)
+    log.append([({"op": "add", "texts": ["a", "b"]}, vectors), ({"op": "remove", "file_path": "x.txt"}, None)])
+    complete = log.size
+    log.append([({"op": "remove", "file_path": "y.txt"}, None)])
+    with open(log.path, "r+b") as f:
+        f.truncate(log.size - 3) # A crash in the middle of the second append
+
+    reopened = WriteAheadLog(log.path)
+    frames = reopened.replay()
+    assert len(frames) == 1
+    (add, added_vectors), (remove, no_vectors) = frames[0]
+    assert add == {"op": "add", "texts": ["a", "b"]} and np.array_equal(added_vectors, vectors)
+    assert remove == {"op": "remove", "file_path": "x.txt"} and no_vectors is None
+    assert reopened.size == complete == (tmp_path / "index.wal").stat().st_size
+
+    reopened.append([({"op": "remove", "file_path": "z.txt"}, None)]) # Follows the last complete frame
+    assert [frame[0][0]["file_path"] for frame in WriteAheadLog(log.path).replay()[1:]] == ["z.txt"]